@@ -7,6 +7,7 @@ from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.utils import simplejson as json
+from django.core.cache import cache
 from users.utils.ldap_mock import MockLDAP
 from mock import Mock
 from nose.tools import eq_, ok_
@@ -15,6 +16,11 @@ from test_utils import TestCase
 
 class CitiesTest(TestCase):
 
+    def setUp(self):
+        super(CitiesTest, self).setUp()
+        # the cached city list outlives the rolled back database
+        cache.clear()
+
     def test_cities(self):
         url = reverse('autocomplete.cities')
         response = self.client.get(url)
@@ -55,11 +61,29 @@ class CitiesTest(TestCase):
         struct = json.loads(response.content)
         eq_(struct, ['London'])
 
+        from users.utils.city_index import search_cities
+        with self.assertNumQueries(0):
+            eq_(search_cities('lon'), ['London'])
+
+        laura = User.objects.create(username='laura')
+        profile = laura.get_profile()
+        profile.city = 'London'
+        profile.save()
+        response = self.client.get(url, {'popular': 1})
+        eq_(json.loads(response.content), ['London', 'Aberdeen'])
+        profile = mortal.get_profile()
+        profile.city = 'Lonely Island'
+        profile.save()
+        response = self.client.get(url, {'term': 'lon'})
+        # alphabetically, 'lond' comes before 'lone'
+        eq_(json.loads(response.content), ['London', 'Lonely Island'])
+
 
 class UsersTest(TestCase):
 
     def setUp(self):
         super(UsersTest, self).setUp()
+        cache.clear()
 
         ldap.open = Mock('ldap.open')
         ldap.open.mock_returns = Mock('ldap_connection')
@@ -97,9 +121,13 @@ class UsersTest(TestCase):
         eq_(response.status_code, 200)
         ok_(response['content-type'].startswith('application/json'))
 
+        from users.utils import people_index
+        people_index._index = None
         response = self.client.get(url, {'term': 'peter'})
         eq_(response.status_code, 200)
         ok_(response['content-type'].startswith('application/json'))
+        # straight to LDAP without building the mirror
+        ok_(people_index._index is None)
         struct = json.loads(response.content)
         ok_(isinstance(struct, list))
         first_item = struct[0]
@@ -176,3 +204,41 @@ class UsersTest(TestCase):
           'label': label,
           'value': value,
         })
+
+    def test_users_mirror(self):
+        from users.models import DirectoryPerson
+        for uid, given_name, sn in (('petra', 'Petra', 'Peterson'),
+                                    ('laura', 'Laura', 'van Peterhof'),
+                                    ('anna', 'Anna', 'Peter')):
+            DirectoryPerson.objects.create(
+              dn='mail=%s@mozilla.com,o=com,dc=mozilla' % uid,
+              uid=uid,
+              mail='%s@mozilla.com' % uid,
+              given_name=given_name,
+              sn=sn,
+              cn='%s %s' % (given_name, sn),
+            )
+
+        mortal = User.objects.create(username='mortal')
+        mortal.set_password('secret')
+        mortal.save()
+        assert self.client.login(username='mortal', password='secret')
+
+        with self.settings(LDAP_LOOKUP_MIRROR=True):
+            url = reverse('autocomplete.users')
+            response = self.client.get(url, {'term': 'Peter'})
+            eq_(response.status_code, 200)
+            struct = json.loads(response.content)
+            # a whole name, then the start of one, then of a word in one
+            eq_([x['id'] for x in struct], ['anna', 'petra', 'laura'])
+            eq_(struct[0]['label'], 'Anna Peter <anna@mozilla.com>')
+
+            response = self.client.get(url, {'term': ':pet'})
+            eq_([x['id'] for x in json.loads(response.content)], ['petra'])
+
+            url = reverse('autocomplete.users_known_only')
+            response = self.client.get(url, {'term': 'peter'})
+            eq_(json.loads(response.content), [])
+            User.objects.create(username='petra', email='Petra@mozilla.com')
+            response = self.client.get(url, {'term': 'peter'})
+            eq_([x['id'] for x in json.loads(response.content)], ['petra'])
@@ -4,27 +4,19 @@
 
 import logging
 from django import http
+from django.conf import settings
 from dates.decorators import json_view
-from users.models import UserProfile, User
-from users.utils import ldap_lookup
+from users.utils import ldap_lookup, people_index, city_index
 
 
 @json_view
 def cities(request):
     if not request.user.is_authenticated():
         return http.HttpResponseForbidden('Must be logged in')
-    data = []
-    term = request.GET.get('term')
-    qs = UserProfile.objects.exclude(city='')
-    if term:
-        qs = qs.filter(city__istartswith=term)
-    for each in (qs
-                     .values('city')
-                     .distinct('city')
-                     .order_by('city')):
-        city = each['city']
-        data.append(city)
-    return data
+    return city_index.search_cities(
+      request.GET.get('term'),
+      by_popularity=bool(request.GET.get('popular')),
+    )
 
 @json_view
 def users(request, known_only=False):
@@ -35,14 +27,23 @@ def users(request, known_only=False):
         return []
 
     results = []
+    mirror = getattr(settings, 'LDAP_LOOKUP_MIRROR', False)
+    # only build the index on the paths that need it
+    index = None
+    if mirror or known_only:
+        index = people_index.get_index()
     # I chose a limit of 30 because there are about 20+ 'peter'
     # something in mozilla
-    for each in ldap_lookup.search_users(query, 30, autocomplete=True):
+    if mirror:
+        found = index.search(query, 30, known_only=known_only)
+    else:
+        found = ldap_lookup.search_users(query, 30, autocomplete=True)
+    for each in found:
         if not each.get('givenName'):
             logging.warn("Skipping LDAP entry %s" % each)
             continue
         if known_only:
-            if not User.objects.filter(email__iexact=each['mail']).exists():
+            if not index.is_known(each['mail']):
                 continue
         full_name_and_email = '%s %s <%s>' % (each['givenName'],
                                               each['sn'],
@@ -14,14 +14,23 @@ class UnicodeWriter:
     """
 
     def __init__(self, f, dialect=csv.excel, encoding="utf-8", **kwds):
-        # Redirect output to a queue
-        self.queue = cStringIO.StringIO()
-        self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
         self.stream = f
-        self.encoder = codecs.getincrementalencoder(encoding)()
+        if codecs.lookup(encoding).name == 'utf-8':
+            # the cells are encoded to UTF-8 before they're written so
+            # there's nothing to re-encode and csv can write straight
+            # to the target stream
+            self.queue = None
+            self.writer = csv.writer(f, dialect=dialect, **kwds)
+        else:
+            # Redirect output to a queue
+            self.queue = cStringIO.StringIO()
+            self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
+            self.encoder = codecs.getincrementalencoder(encoding)()
 
     def writerow(self, row):
         self.writer.writerow([s.encode("utf-8") for s in row])
+        if self.queue is None:
+            return
         # Fetch UTF-8 output from the queue ...
         data = self.queue.getvalue()
         data = data.decode("utf-8")
@@ -30,4 +39,25 @@ class UnicodeWriter:
         # write to the target stream
         self.stream.write(data)
         # empty queue
-        self.queue.truncate(0)
+        self.queue.seek(0)
+        self.queue.truncate()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+def iter_csv(rows, chunk_size=16 * 1024, **kwds):
+    """Generate the CSV for these rows in chunks of roughly `chunk_size`
+    bytes. Suitable as the content of a response that needs to start
+    sending before the last row has been made."""
+    buffer = cStringIO.StringIO()
+    writer = UnicodeWriter(buffer, **kwds)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,123 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Finds PTO logged more than once: entries with the same dates, entries
+# that overlap and dates with more hours logged than a work day. The
+# entries are loaded once and swept through in order of start date.
+
+import heapq
+import datetime
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import Sum
+from .models import Entry, Hours
+
+
+class DuplicateReport(object):
+
+    def __init__(self):
+        # (entries with the same start and end, note)
+        self.duplicates = []
+        # (earlier entry, later entry) of the same user that overlap
+        self.overlaps = []
+        # (user_id, date, net hours) with more than a work day logged
+        self.double_booked = []
+
+    def __len__(self):
+        return (len(self.duplicates) + len(self.overlaps) +
+                len(self.double_booked))
+
+
+def _weekdays(start, end):
+    date = start
+    while date <= end:
+        if date.weekday() < 5:
+            yield date
+        date += datetime.timedelta(days=1)
+
+
+def _net_hours(user=None, since=None):
+    """return {(user_id, date): net hours logged} from one query"""
+    hours = Hours.objects.all()
+    if user is not None:
+        hours = hours.filter(user=user)
+    if since is not None:
+        hours = hours.filter(date__gte=since)
+    return dict(((user_id, date), total) for user_id, date, total in
+                hours.values_list('user', 'date')
+                .annotate(Sum('hours'))
+                .order_by())
+
+
+def _double_counted(user_id, start, end, net_hours):
+    """return true if more than a work day is logged on any weekday between
+    start and end. If not, whatever else was logged on them has been
+    reversed since, or nothing was logged (e.g. only weekends), and there's
+    nothing to report."""
+    for date in _weekdays(start, end):
+        if net_hours.get((user_id, date), 0) > settings.WORK_DAY:
+            return True
+    return False
+
+
+def _note(entries):
+    if len(set(x.details for x in entries)) == 1:
+        return ("Probably a duplicate! "
+                "The details are the same for each entry")
+    return "Possibly not a duplicate since the details different"
+
+
+def find_duplicates(user=None, since=None):
+    """return a DuplicateReport of this user's entries, or everybody's,
+    that start on or after since"""
+    entries = Entry.objects.filter(total_hours__gte=0)
+    if user is not None:
+        entries = entries.filter(user=user)
+    if since is not None:
+        entries = entries.filter(start__gte=since)
+    net_hours = _net_hours(user=user, since=since)
+
+    by_user = defaultdict(list)
+    for entry in entries.order_by():
+        by_user[entry.user_id].append(entry)
+
+    report = DuplicateReport()
+    for user_id in sorted(by_user):
+        user_entries = by_user[user_id]
+        user_entries.sort(key=lambda x: (x.start, x.end, x.pk))
+        # (end, pk, entry) of the entries that haven't ended yet
+        active = []
+        group = []
+        for entry in user_entries:
+            while active and active[0][0] < entry.start:
+                heapq.heappop(active)
+            if group and (group[0].start, group[0].end) == (entry.start,
+                                                            entry.end):
+                group.append(entry)
+            else:
+                if len(group) > 1:
+                    report.duplicates.append(group)
+                group = [entry]
+            for end, pk, other in active:
+                if (other.start, other.end) == (entry.start, entry.end):
+                    continue
+                start = max(other.start, entry.start)
+                if _double_counted(user_id, start, min(end, entry.end),
+                                   net_hours):
+                    report.overlaps.append((other, entry))
+            heapq.heappush(active, (entry.end, entry.pk, entry))
+        if len(group) > 1:
+            report.duplicates.append(group)
+
+    report.duplicates = [
+      (group, _note(group)) for group in report.duplicates
+      if _double_counted(group[0].user_id, group[0].start, group[0].end,
+                         net_hours)
+    ]
+    report.overlaps.sort(key=lambda x: (x[0].user_id, x[0].start, x[1].start))
+    report.double_booked = sorted(
+      (user_id, date, total) for (user_id, date), total in net_hours.items()
+      if total > settings.WORK_DAY
+    )
+    return report
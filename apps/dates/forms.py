@@ -8,8 +8,8 @@ from django.utils import formats
 from django.contrib.auth.models import User
 from django.core.validators import validate_email
 from django import forms
-from models import Hours, Entry
-from users.models import UserProfile
+from models import Entry, get_logged_hours, get_overlapping_hours
+from users.utils.country_catalog import get_countries
 import utils
 
 
@@ -65,6 +65,8 @@ class AddForm(BaseForm):
 
     def __init__(self, user, *args, **kwargs):
         self.user = user
+        # (date, hours) already logged between start and end, set by clean()
+        self.overlapping = []
         super(AddForm, self).__init__(*args, **kwargs)
 
     def clean_notify(self):
@@ -104,6 +106,10 @@ class AddForm(BaseForm):
             # XXX: this needs a unit test
             if not (days - weekends):
                 raise forms.ValidationError("Days are only weekend days")
+            # not an error since the hours entered replace these
+            self.overlapping = get_overlapping_hours(self.user,
+                                                     cleaned_data['start'],
+                                                     cleaned_data['end'])
         return cleaned_data
 
 
@@ -111,16 +117,15 @@ class HoursForm(BaseForm):
     def __init__(self, entry, *args, **kwargs):
         super(HoursForm, self).__init__(*args, **kwargs)
         self.entry = entry
+        logged_hours = get_logged_hours(entry.user, entry.start, entry.end)
         for date in utils.get_weekday_dates(self.entry.start, self.entry.end):
             field_name = date.strftime('d-%Y%m%d')
 
-            try:
-                hours_ = Hours.objects.get(date=date, entry__user=entry.user)
+            if date in logged_hours:
                 help_text = ('Already logged %d hours on this day' %
-                             hours_.hours)
-            except Hours.DoesNotExist:
+                             logged_hours[date])
+            else:
                 help_text = ''
-                hours_ = None
 
             choices = []
             choices.append((settings.WORK_DAY,
@@ -128,7 +133,7 @@ class HoursForm(BaseForm):
             choices.append((settings.WORK_DAY / 2,
                             'Half day (%sh)' % (settings.WORK_DAY / 2)))
             choices.append((-1, 'Birthday'))
-            if hours_:
+            if date in logged_hours:
                 choices.append((0, '0 hrs'))
 
             self.fields[field_name] = forms.fields.ChoiceField(
@@ -183,14 +188,10 @@ class ListFilterForm(BaseForm):
                   'data-input': data_input,
                 })
         # insert the blank one
-        self.fields['country'].choices = [('', 'Any country')]
-
-        for each in (UserProfile.objects.exclude(country='')
-                     .values('country')
-                     .distinct('country')
-                     .order_by('country')):
-            country = each['country']
-            self.fields['country'].choices.append((country, country))
+        self.fields['country'].choices = (
+          [('', 'Any country')] +
+          [(x, x) for x in get_countries()]
+        )
 
 
 class DuplicateReportFilterForm(BaseForm):
@@ -0,0 +1,84 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Writes the iCalendar feeds. vobject builds, validates and transforms a
+# whole tree of objects before it serializes anything. We only ever make
+# one shape of calendar so this writes it straight out, byte for byte the
+# same as vobject would.
+
+import random
+import socket
+import datetime
+
+
+PRODID = u'-//PYVOBJECT//NONSGML Version 1//EN'
+
+LINE_LENGTH = 75
+
+
+def escape_text(value):
+    value = (value.replace('\\', '\\\\')
+             .replace(';', '\\;')
+             .replace(',', '\\,'))
+    return (value.replace('\r\n', '\\n')
+            .replace('\n', '\\n')
+            .replace('\r', '\\n'))
+
+
+def fold_line(line, line_length=LINE_LENGTH):
+    """return the line as UTF-8, ending with CRLF, folded so that no line
+    is longer than line_length octets without splitting a character"""
+    if isinstance(line, unicode):
+        line = line.encode('utf-8')
+    if len(line) < line_length:
+        return line + '\r\n'
+    parts = []
+    start = 0
+    while True:
+        offset = start + line_length - 1
+        if offset >= len(line):
+            parts.append(line[start:])
+            break
+        while ord(line[offset]) & 0xC0 == 0x80:
+            # a continuation byte
+            offset -= 1
+        parts.append(line[start:offset])
+        start = offset
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def make_uid():
+    # the same kind of UID vobject makes up
+    return '%s-%s@%s' % (datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ'),
+                         int(random.random() * 100000),
+                         socket.gethostname())
+
+
+def _format_date(date):
+    return '%04d%02d%02d' % (date.year, date.month, date.day)
+
+
+def iter_vcalendar(events, name=None):
+    """yield a calendar of these events as UTF-8 text, one event at a time.
+
+    Each event is a dict of 'summary', 'start', 'end' (dates), 'url' and
+    'description' and optionally 'uid'.
+    """
+    yield ('BEGIN:VCALENDAR\r\n'
+           'VERSION:2.0\r\n' +
+           fold_line(u'PRODID:' + escape_text(PRODID)))
+    for event in events:
+        yield ''.join([
+          'BEGIN:VEVENT\r\n',
+          fold_line(u'UID:' + escape_text(event.get('uid') or make_uid())),
+          'DTSTART;VALUE=DATE:%s\r\n' % _format_date(event['start']),
+          'DTEND;VALUE=DATE:%s\r\n' % _format_date(event['end']),
+          fold_line(u'DESCRIPTION:' + escape_text(event['description'])),
+          fold_line(u'SUMMARY:' + escape_text(event['summary'])),
+          fold_line(u'URL:' + event['url']),
+          'END:VEVENT\r\n',
+        ])
+    if name is not None:
+        yield fold_line(u'X-WR-CALNAME:' + name)
+    yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Composite indexes that can't be expressed on the models themselves.
+# On a fresh database they're created right after syncdb, unless they
+# exist already. Existing databases get them from the schematic
+# migrations in migrations/.
+
+import logging
+from django.db.models import get_model
+
+
+# (index name, model, field names, condition for a partial index)
+# An index with a condition is only created on backends that support
+# partial indexes. The others have to make do with the full ones.
+INDEXES = (
+  # calendar_events and calendar_vcal
+  ('dates_entry_user_start_end', 'dates.Entry',
+   ('user', 'start', 'end'), None),
+  # list_json and the like looking for entries on some date
+  ('dates_entry_start_end_total_hours', 'dates.Entry',
+   ('start', 'end', 'total_hours'), None),
+  # get_right_nows and get_upcomings
+  ('dates_dayoccupancy_date_starts_user', 'dates.DayOccupancy',
+   ('date', 'starts', 'user'), None),
+  # the date filed filter in list_ and list_json
+  ('dates_entry_add_date', 'dates.Entry',
+   ('add_date',), None),
+  # the last date in get_entry_bounds
+  ('dates_entry_end', 'dates.Entry',
+   ('end',), None),
+  # only the entries that are shown on calendars
+  ('dates_entry_shown_user_end', 'dates.Entry',
+   ('user', 'end'), 'total_hours >= 0'),
+  # hours already logged on a date
+  ('dates_hours_date_entry', 'dates.Hours',
+   ('date', 'entry'), None),
+  # the hours a user has logged over some dates
+  ('dates_hours_user_date', 'dates.Hours',
+   ('user', 'date'), None),
+  # the managers of a user up to some depth
+  ('users_userhierarchy_descendant_id_depth', 'users.UserHierarchy',
+   ('descendant', 'depth'), None),
+)
+
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def get_existing_indexes(connection, table):
+    """return the set of names of the indexes on this table"""
+    cursor = connection.cursor()
+    if connection.vendor == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' % connection.ops.quote_name(table))
+        return set(row[2] for row in cursor.fetchall())
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT indexname FROM pg_indexes '
+                       'WHERE tablename = %s', [table])
+    else:
+        cursor.execute("SELECT name FROM sqlite_master "
+                       "WHERE type = 'index' AND tbl_name = %s", [table])
+    return set(row[0] for row in cursor.fetchall())
+
+
+def get_index_statements(connection, skip_existing=False):
+    qn = connection.ops.quote_name
+    statements = []
+    existing = {}
+    for name, model, field_names, condition in INDEXES:
+        if condition and connection.vendor not in PARTIAL_INDEX_VENDORS:
+            continue
+        opts = get_model(*model.split('.'))._meta
+        if skip_existing:
+            if opts.db_table not in existing:
+                existing[opts.db_table] = get_existing_indexes(connection,
+                                                               opts.db_table)
+            if name in existing[opts.db_table]:
+                continue
+        columns = [qn(opts.get_field(x).column) for x in field_names]
+        sql = 'CREATE INDEX %s ON %s (%s)' % (qn(name), qn(opts.db_table),
+                                              ', '.join(columns))
+        if condition:
+            sql += ' WHERE %s' % condition
+        statements.append(sql)
+    return statements
+
+
+def create_indexes(connection):
+    # post_syncdb is sent again by flush, e.g. when the test database is
+    # made, so the ones already there are left alone
+    cursor = connection.cursor()
+    for sql in get_index_statements(connection, skip_existing=True):
+        logging.debug(sql)
+        cursor.execute(sql)
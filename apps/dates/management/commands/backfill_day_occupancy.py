@@ -0,0 +1,25 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from dates.models import Entry, sync_day_occupancy
+from dates.utils import chunked_queryset
+
+
+class Command(NoArgsCommand):
+    help = """
+    Brings the DayOccupancy rows of every entry up to date.
+    """
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = 0
+        for chunk in chunked_queryset(Entry.objects.all()):
+            for entry in chunk:
+                sync_day_occupancy(entry)
+                count += 1
+
+        if int(options.get('verbosity', 1)):
+            print "Synced", count, "entries"
@@ -0,0 +1,44 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import defaultdict
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from dates.models import Entry, Hours, summarize_hours
+from dates.utils import chunked_queryset
+
+
+class Command(NoArgsCommand):
+    help = """
+    Stores the number of days and whether it includes a birthday on
+    every entry whose hours haven't been summarized yet.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--all', default=False,
+                                    action='store_true',
+                                    help="Redo every entry (Optional)"),
+    )
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        entries = Entry.objects.all()
+        if not options.get('all'):
+            entries = entries.filter(total_days__isnull=True)
+
+        count = 0
+        for chunk in chunked_queryset(entries.only('pk')):
+            hours = defaultdict(list)
+            for each in Hours.objects.filter(entry__in=chunk):
+                hours[each.entry_id].append(each)
+            for entry in chunk:
+                total_days, has_birthday = summarize_hours(hours[entry.pk])
+                (Entry.objects.filter(pk=entry.pk)
+                 .update(total_days=total_days, has_birthday=has_birthday))
+                count += 1
+
+        if int(options.get('verbosity', 1)):
+            print "Summarized", count, "entries"
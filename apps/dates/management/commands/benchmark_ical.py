@@ -0,0 +1,67 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+import vobject
+from dates.ical import iter_vcalendar
+
+
+class Command(NoArgsCommand):
+    help = """
+    Times writing a calendar feed with vobject against dates.ical and
+    checks that they write the same thing.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--events', default=500, type='int',
+                                    help="Events in the feed (default 500)"),
+                        make_option('--repeat', default=10, type='int',
+                                    help="Times to write it (default 10)"),
+    )
+
+    def handle_noargs(self, **options):
+        events = []
+        start = datetime.date(2012, 1, 2)
+        for i in range(options['events']):
+            events.append({
+              'uid': '20120101T000000Z-%d@localhost' % i,
+              'summary': u'P\xe9ter Bengtsson - %d days PTO' % (i % 10 + 1),
+              'start': start + datetime.timedelta(days=i),
+              'end': start + datetime.timedelta(days=i + i % 10),
+              'url': ('https://pto.mozilla.org/dates/list/?date_from=%d'
+                      '&date_to=%d&name=P%%C3%%A9ter+Bengtsson' % (i, i)),
+              'description': 'Log in to see the details',
+            })
+
+        def with_vobject():
+            cal = vobject.iCalendar()
+            cal.add('x-wr-calname').value = 'Mozilla PTO'
+            for each in events:
+                event = cal.add('vevent')
+                event.add('uid').value = each['uid']
+                event.add('summary').value = each['summary']
+                event.add('dtstart').value = each['start']
+                event.add('dtend').value = each['end']
+                event.add('url').value = each['url']
+                event.add('description').value = each['description']
+            return cal.serialize()
+
+        def with_ical():
+            return ''.join(iter_vcalendar(events, 'Mozilla PTO'))
+
+        if with_vobject() != with_ical():
+            raise CommandError("dates.ical doesn't write what vobject does")
+
+        timings = []
+        for function in (with_vobject, with_ical):
+            t0 = time.time()
+            for i in range(options['repeat']):
+                function()
+            timings.append((time.time() - t0) / options['repeat'])
+            print "%-14s %8.2f ms" % (function.__name__, timings[-1] * 1000)
+        print "%.1f times faster" % (timings[0] / timings[1])
@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.contrib.auth.models import User
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from dates.models import Entry, Hours, DayOccupancy, YearlyTotal
+
+
+class Command(NoArgsCommand):
+    help = """
+    Runs EXPLAIN on each of the hot queries in dates.views and reports
+    whether the database answers them with an index.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--database', default=DEFAULT_DB_ALIAS,
+                                    help="Database to explain on (Optional)"),
+                        make_option('--plan', default=False,
+                                    action='store_true',
+                                    help="Print the whole plan (Optional)"),
+    )
+
+    def handle_noargs(self, **options):
+        connection = connections[options['database']]
+        explain = getattr(self, '_explain_%s' % connection.vendor, None)
+        if explain is None:
+            self.stderr.write("Don't know how to EXPLAIN on %s\n" %
+                              connection.vendor)
+            return
+
+        full_scans = 0
+        for name, queryset in self._get_queries():
+            sql, params = (queryset.query
+                           .get_compiler(options['database'])
+                           .as_sql())
+            cursor = connection.cursor()
+            plan, uses_index, index_only = explain(cursor, sql, params)
+            if index_only:
+                verdict = 'index only'
+            elif uses_index:
+                verdict = 'index'
+            else:
+                verdict = 'FULL SCAN'
+                full_scans += 1
+            self.stdout.write('%-22s %s\n' % (name, verdict))
+            if options['plan'] or not uses_index:
+                for line in plan:
+                    self.stdout.write('    %s\n' % line)
+
+        self.stdout.write('%d queries without an index\n' % full_scans)
+
+    def _get_queries(self):
+        today = datetime.date.today()
+        week = datetime.timedelta(days=7)
+        user_ids = list(User.objects.values_list('pk', flat=True)[:10]) or [0]
+        calendar = (Entry.objects
+                    .filter(user__in=user_ids,
+                            total_hours__gte=0,
+                            total_hours__isnull=False))
+        return (
+          ('get_right_nows', DayOccupancy.objects.filter(date=today)),
+          ('get_upcomings', DayOccupancy.objects
+                            .filter(date__gt=today,
+                                    date__lt=today + week * 2,
+                                    starts=True)),
+          ('calendar_events', calendar
+                              .exclude(Q(end__lt=today - week * 4) |
+                                       Q(start__gt=today + week))),
+          ('calendar_vcal', calendar.filter(end__gte=today)),
+          ('get_taken_info', YearlyTotal.objects
+                             .filter(user=user_ids[0], year=today.year)),
+          ('list_json between', Entry.objects
+                                .exclude(total_hours=None)
+                                .filter(end__gte=today - week,
+                                        start__lte=today)),
+          ('list_json filed', Entry.objects
+                              .exclude(total_hours=None)
+                              .filter(add_date__gte=today - week,
+                                      add_date__lt=today)),
+          ('list_ first_date', Entry.objects.order_by('start')[:1]),
+          ('list_ last_date', Entry.objects.order_by('-end')[:1]),
+          ('list_ first_filed', Entry.objects.order_by('add_date')[:1]),
+          ('hours on date', Hours.objects
+                            .filter(date=today, user=user_ids[0])),
+        )
+
+    def _explain_mysql(self, cursor, sql, params):
+        cursor.execute('EXPLAIN ' + sql, params)
+        names = [x[0] for x in cursor.description]
+        plan = []
+        uses_index = index_only = True
+        for row in cursor.fetchall():
+            row = dict(zip(names, row))
+            plan.append('%(table)s: type=%(type)s key=%(key)s '
+                        'rows=%(rows)s %(Extra)s' % row)
+            if not row['key'] or row['type'] == 'ALL':
+                uses_index = False
+            if 'Using index' not in (row['Extra'] or ''):
+                index_only = False
+        return plan, uses_index, uses_index and index_only
+
+    def _explain_postgresql(self, cursor, sql, params):
+        cursor.execute('EXPLAIN ' + sql, params)
+        plan = [x[0] for x in cursor.fetchall()]
+        text = '\n'.join(plan)
+        uses_index = 'Seq Scan' not in text
+        index_only = uses_index and 'Index Only Scan' in text
+        return plan, uses_index, index_only
+
+    def _explain_sqlite(self, cursor, sql, params):
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = [x[-1] for x in cursor.fetchall()]
+        uses_index = index_only = True
+        for line in plan:
+            if not line.startswith(('SCAN', 'SEARCH')):
+                continue
+            if 'USING' not in line:
+                uses_index = False
+            if 'COVERING INDEX' not in line:
+                index_only = False
+        return plan, uses_index, uses_index and index_only
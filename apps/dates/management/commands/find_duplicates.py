@@ -0,0 +1,66 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.contrib.auth.models import User
+from dates.duplicates import find_duplicates
+
+
+class Command(NoArgsCommand):
+    help = """
+    Lists the PTO entries that have been logged more than once, the ones
+    that overlap and the days with more than a work day logged.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--user', default=None,
+                                    help="Username or email of one user "
+                                         "(Optional)"),
+                        make_option('--since', default=None,
+                                    help="Only entries starting on or "
+                                         "after this YYYY-MM-DD (Optional)"),
+    )
+
+    def handle_noargs(self, **options):
+        user = since = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                try:
+                    user = User.objects.get(email__iexact=options['user'])
+                except User.DoesNotExist:
+                    raise CommandError("No user %r" % options['user'])
+        if options['since']:
+            try:
+                since = datetime.datetime.strptime(options['since'],
+                                                   '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+
+        report = find_duplicates(user=user, since=since)
+        verbose = int(options['verbosity']) > 1
+        print len(report.duplicates), "duplicates,",
+        print len(report.overlaps), "overlaps,",
+        print len(report.double_booked), "days double booked"
+        if not verbose:
+            return
+        for entries, note in report.duplicates:
+            print "Duplicate:", ", ".join(str(x.pk) for x in entries),
+            print "(%s %s - %s)" % (entries[0].user.email, entries[0].start,
+                                    entries[0].end)
+        for earlier, later in report.overlaps:
+            print "Overlap: %s (%s - %s) and %s (%s - %s) of %s" % (
+              earlier.pk, earlier.start, earlier.end,
+              later.pk, later.start, later.end,
+              earlier.user.email)
+        users = dict(User.objects
+                     .filter(pk__in=set(x[0] for x in report.double_booked))
+                     .values_list('pk', 'email'))
+        for user_id, date, hours in report.double_booked:
+            print "Double booked: %s %s hours on %s" % (users[user_id], hours,
+                                                       date)
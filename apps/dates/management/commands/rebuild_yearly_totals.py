@@ -0,0 +1,31 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import defaultdict
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from dates.models import Entry, YearlyTotal, refresh_yearly_totals
+
+
+class Command(NoArgsCommand):
+    help = """
+    Works out the hours and birthdays taken per user and year again from
+    all the entries.
+    """
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        years = defaultdict(set)
+        for user_id, start, end in (Entry.objects
+                                    .filter(total_hours__isnull=False)
+                                    .values_list('user_id', 'start', 'end')):
+            years[user_id].update(range(start.year, end.year + 1))
+
+        YearlyTotal.objects.all().delete()
+        for user_id in years:
+            refresh_yearly_totals(user_id, years[user_id])
+
+        if int(options.get('verbosity', 1)):
+            print "Rebuilt the yearly totals of", len(years), "users"
@@ -0,0 +1,37 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from dates.outbox import send_outbox
+
+
+class Command(NoArgsCommand):
+    help = """
+    Sends the notification emails in the outbox that are due.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--batch-size', default=100, type='int',
+                                    help="Messages sent per connection "
+                                         "(default 100)"),
+                        make_option('--loop', default=0, type='int',
+                                    help="Keep going, looking again every "
+                                         "this many seconds (Optional)"),
+    )
+
+    def handle_noargs(self, **options):
+        verbose = int(options['verbosity']) > 1
+        while True:
+            while True:
+                sent, failed = send_outbox(options['batch_size'])
+                if verbose and (sent or failed):
+                    print "Sent", sent, "messages,", failed, "failed"
+                if sent + failed < options['batch_size']:
+                    break
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -2,12 +2,21 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import sys
 import uuid
 import datetime
-from django.db import models
+from array import array
+from collections import defaultdict
+from django.db import models, connections
+from django.db.models import Sum, Min, Max
+from django.core.cache import cache
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import (post_save, pre_save, post_delete,
+                                      post_syncdb)
+from users.models import UserHierarchy, org_hierarchy_changed
+from .utils.generations import get_generation, bump_generation
 
 
 class FollowingIntegrityError(ValueError):
@@ -24,6 +33,10 @@ class Entry(models.Model):
     start = models.DateField()
     end = models.DateField()
     details = models.TextField(blank=True)
+    # summary of the Hours of this entry as used in its title
+    # (null until the hours have been saved or backfilled)
+    total_days = models.FloatField(null=True, blank=True)
+    has_birthday = models.BooleanField(default=False)
 
     add_date = models.DateTimeField(default=datetime.datetime.utcnow)
     modify_date = models.DateTimeField(default=datetime.datetime.utcnow,
@@ -37,11 +50,114 @@ class Entry(models.Model):
 
 class Hours(models.Model):
     entry = models.ForeignKey(Entry)
+    # the same as entry.user, kept here to look up hours without a join
+    user = models.ForeignKey(User)
     hours = models.IntegerField()
     date = models.DateField()
     birthday = models.BooleanField(default=False)
 
 
+YEAR_OCCUPANCY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _day_of_year(date):
+    return date.timetuple().tm_yday - 1
+
+
+def get_year_occupancy(user_id, year):
+    """return (hours, logged) of the user in this year: arrays of 366 with
+    the net hours logged on each day of the year and 1 on the days any
+    hours (reversals included) have been logged on"""
+    cache_key = 'year_occupancy:%s:%s:%s' % (
+      user_id, year, get_generation('entries', user_id)
+    )
+    occupancy = cache.get(cache_key)
+    if occupancy is None:
+        hours = array('h', [0] * 366)
+        logged = array('b', [0] * 366)
+        for date, total in (Hours.objects
+                            .filter(user=user_id,
+                                    date__range=(datetime.date(year, 1, 1),
+                                                 datetime.date(year, 12, 31)))
+                            .values_list('date')
+                            .annotate(Sum('hours'))
+                            .order_by()):
+            hours[_day_of_year(date)] = total
+            logged[_day_of_year(date)] = 1
+        occupancy = (hours, logged)
+        cache.set(cache_key, occupancy, YEAR_OCCUPANCY_CACHE_TIMEOUT)
+    return occupancy
+
+
+def get_logged_hours(user, start, end, use_cache=True):
+    """return a dict of every date between start and end that the user
+    has logged hours on and the net hours (reversals included) logged"""
+    if not use_cache:
+        return dict(Hours.objects
+                    .filter(user=user, date__range=(start, end))
+                    .values_list('date')
+                    .annotate(Sum('hours'))
+                    .order_by())
+    logged_hours = {}
+    for year in range(start.year, end.year + 1):
+        hours, logged = get_year_occupancy(user.pk, year)
+        date = max(start, datetime.date(year, 1, 1))
+        last = min(end, datetime.date(year, 12, 31))
+        while date <= last:
+            if logged[_day_of_year(date)]:
+                logged_hours[date] = hours[_day_of_year(date)]
+            date += datetime.timedelta(days=1)
+    return logged_hours
+
+
+def get_overlapping_hours(user, start, end):
+    """return a sorted list of (date, net hours) of the weekdays between
+    start and end that the user has already logged PTO on"""
+    return sorted((date, hours) for date, hours
+                  in get_logged_hours(user, start, end).items()
+                  if hours > 0 and date.weekday() < 5)
+
+
+class DayOccupancy(models.Model):
+    """one row for every day covered by an entry that is shown, kept up to
+    date by sync_day_occupancy()"""
+    date = models.DateField()
+    user = models.ForeignKey(User)
+    entry = models.ForeignKey(Entry)
+    hours = models.IntegerField()
+    # the first day of the entry
+    starts = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('entry', 'date')
+
+
+class YearlyTotal(models.Model):
+    """hours of PTO and birthdays taken per user and calendar year, kept
+    up to date by refresh_yearly_totals()"""
+    user = models.ForeignKey(User)
+    year = models.IntegerField()
+    hours = models.IntegerField(default=0)
+    birthdays = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'year')
+
+
+def summarize_hours(hours):
+    """return (total_days, has_birthday) for these Hours objects"""
+    days = 0
+    has_birthday = False
+    for each in hours:
+        if each.hours == 8:
+            days += 1
+        elif each.hours == 4:
+            days += 0.5
+        if each.birthday:
+            has_birthday = True
+    return days, has_birthday
+
+
 class BlacklistedUser(models.Model):
     # FIXME: need to figure out the right on_delete here
     observer = models.ForeignKey(User, related_name='observer')
@@ -66,6 +182,84 @@ class FollowingUser(models.Model):
                                            self.following.username)
 
 
+class ObservedUser(models.Model):
+    """who each user sees the entries of and why, kept up to date by
+    refresh_observed_users()"""
+    DIRECT_MANAGER, INDIRECT_MANAGER, TEAMMATE, MANAGER, CURIOUS = range(1, 6)
+    REASONS = (
+      (DIRECT_MANAGER, 'direct manager of'),
+      (INDIRECT_MANAGER, 'indirect manager of'),
+      (TEAMMATE, 'teammate'),
+      (MANAGER, 'your manager'),
+      (CURIOUS, 'curious'),
+    )
+    observer = models.ForeignKey(User, related_name='observing')
+    # who observes a user, when their entries change
+    observable = models.ForeignKey(User, related_name='observed_by',
+                                   db_index=True)
+    reason = models.PositiveSmallIntegerField(choices=REASONS)
+
+    class Meta:
+        unique_together = ('observer', 'observable')
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %r observes %r (%s)>' % (self.__class__.__name__,
+                                              self.observer.username,
+                                              self.observable.username,
+                                              self.get_reason_display())
+
+
+def refresh_observed_users(observer_id):
+    """work out again who this user observes and store what's changed"""
+    reasons = {}
+    for user_id, depth in (UserHierarchy.objects
+                           .filter(ancestor=observer_id, depth__lte=2)
+                           .values_list('descendant_id', 'depth')):
+        if depth == 1:
+            reasons[user_id] = ObservedUser.DIRECT_MANAGER
+        else:
+            reasons[user_id] = ObservedUser.INDIRECT_MANAGER
+    for manager_id in (UserHierarchy.objects
+                       .filter(descendant=observer_id, depth=1)
+                       .values_list('ancestor_id', flat=True)):
+        for user_id in (UserHierarchy.objects
+                        .filter(ancestor=manager_id, depth=1)
+                        .exclude(descendant=observer_id)
+                        .values_list('descendant_id', flat=True)):
+            reasons.setdefault(user_id, ObservedUser.TEAMMATE)
+        reasons.setdefault(manager_id, ObservedUser.MANAGER)
+
+    for user_id in (BlacklistedUser.objects
+                    .filter(observer=observer_id)
+                    .values_list('observable_id', flat=True)):
+        reasons.pop(user_id, None)
+    for user_id in (FollowingUser.objects
+                    .filter(follower=observer_id)
+                    .values_list('following_id', flat=True)):
+        if reasons.get(user_id) in (None, ObservedUser.TEAMMATE):
+            reasons[user_id] = ObservedUser.CURIOUS
+
+    changed = False
+    for observed in ObservedUser.objects.filter(observer=observer_id):
+        reason = reasons.pop(observed.observable_id, None)
+        if reason is None:
+            observed.delete()
+            changed = True
+        elif reason != observed.reason:
+            observed.reason = reason
+            observed.save()
+            changed = True
+    if reasons:
+        ObservedUser.objects.bulk_create([
+          ObservedUser(observer_id=observer_id, observable_id=user_id,
+                       reason=reason)
+          for user_id, reason in reasons.items()
+        ])
+        changed = True
+    if changed:
+        bump_generation('visibility', observer_id)
+
+
 @receiver(post_save, sender=BlacklistedUser)
 def blacklist_cleanup_check(sender, instance, **kwargs):
     (FollowingUser.objects
@@ -92,6 +286,283 @@ def following_integrity_check(sender, instance, **kwargs):
         raise FollowingIntegrityError("can't follow self")
 
 
+@receiver(post_syncdb, sender=sys.modules[__name__])
+def create_extra_indexes(sender, created_models, db, **kwargs):
+    if Entry in created_models and Hours in created_models:
+        from .indexes import create_indexes
+        create_indexes(connections[db])
+
+
+@receiver(pre_save, sender=Entry)
+def remember_previous_entry(sender, instance, **kwargs):
+    # whoever and whenever it's moved away from needs updating too
+    instance._previous = None
+    if instance.pk is not None:
+        for previous in (Entry.objects.filter(pk=instance.pk)
+                         .values('user_id', 'start', 'end', 'add_date')):
+            instance._previous = previous
+
+
+@receiver(pre_save, sender=Hours)
+def hours_set_user(sender, instance, **kwargs):
+    instance.user_id = instance.entry.user_id
+
+
+@receiver(post_save, sender=Entry)
+def entry_move_hours(sender, instance, signal, **kwargs):
+    previous = _previous_entry(instance, signal)
+    if previous and previous['user_id'] != instance.user_id:
+        Hours.objects.filter(entry=instance).update(user=instance.user)
+
+
+def _previous_entry(instance, signal):
+    """return what the entry was like before it was saved"""
+    if signal is post_save:
+        return getattr(instance, '_previous', None)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def entry_bump_generation(sender, instance, signal, **kwargs):
+    bump_generation('entries', instance.user_id)
+    previous = _previous_entry(instance, signal)
+    if previous and previous['user_id'] != instance.user_id:
+        bump_generation('entries', previous['user_id'])
+
+
+@receiver(post_save, sender=Hours)
+@receiver(post_delete, sender=Hours)
+def hours_bump_generation(sender, instance, **kwargs):
+    try:
+        bump_generation('entries', instance.entry.user_id)
+    except Entry.DoesNotExist:
+        # deleted along with its entry which takes care of it
+        pass
+
+
+def _split_hours_by_year(entry, hours):
+    """return a dict of year and how many of the entry's total hours are
+    in that year"""
+    if entry.start.year == entry.end.year:
+        return {entry.start.year: entry.total_hours}
+    split = defaultdict(int)
+    if hours:
+        for date, day_hours in hours:
+            split[date.year] += day_hours
+        return split
+    # no hours logged so share it out by weekday
+    weekdays = defaultdict(int)
+    date = entry.start
+    while date <= entry.end:
+        if date.weekday() < 5:
+            weekdays[date.year] += 1
+        date += datetime.timedelta(days=1)
+    total_weekdays = sum(weekdays.values())
+    left = entry.total_hours
+    for year in sorted(weekdays)[:-1]:
+        split[year] = entry.total_hours * weekdays[year] / total_weekdays
+        left -= split[year]
+    split[max(weekdays or [entry.end.year])] += left
+    return split
+
+
+def refresh_yearly_totals(user_id, years):
+    """work out the YearlyTotal of this user in these years again"""
+    for year in set(years):
+        first = datetime.date(year, 1, 1)
+        last = datetime.date(year, 12, 31)
+        entries = list(Entry.objects
+                       .filter(user=user_id,
+                               total_hours__isnull=False,
+                               start__lte=last,
+                               end__gte=first))
+        hours = defaultdict(list)
+        split_ids = [x.pk for x in entries if x.start.year != x.end.year]
+        if split_ids:
+            for entry_id, date, day_hours in (Hours.objects
+                                              .filter(entry__in=split_ids)
+                                              .values_list('entry_id',
+                                                           'date', 'hours')):
+                hours[entry_id].append((date, day_hours))
+        total_hours = sum(_split_hours_by_year(x, hours[x.pk]).get(year, 0)
+                          for x in entries)
+        birthdays = (Hours.objects
+                     .filter(user=user_id,
+                             entry__total_hours__isnull=False,
+                             birthday=True,
+                             date__range=(first, last))
+                     .count())
+        updated = (YearlyTotal.objects
+                   .filter(user=user_id, year=year)
+                   .update(hours=total_hours, birthdays=birthdays))
+        if not updated:
+            YearlyTotal.objects.create(user_id=user_id, year=year,
+                                       hours=total_hours,
+                                       birthdays=birthdays)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def entry_refresh_yearly_totals(sender, instance, signal, **kwargs):
+    if signal is post_delete and instance.total_hours is None:
+        # unfinished entries were never counted
+        return
+    years = range(instance.start.year, instance.end.year + 1)
+    previous = _previous_entry(instance, signal)
+    if previous and previous['user_id'] != instance.user_id:
+        refresh_yearly_totals(previous['user_id'],
+                              range(previous['start'].year,
+                                    previous['end'].year + 1))
+    elif previous:
+        years.extend(range(previous['start'].year,
+                           previous['end'].year + 1))
+    refresh_yearly_totals(instance.user_id, years)
+
+
+@receiver(post_save, sender=Hours)
+@receiver(post_delete, sender=Hours)
+def hours_refresh_yearly_totals(sender, instance, **kwargs):
+    try:
+        entry = instance.entry
+    except Entry.DoesNotExist:
+        # deleted along with its entry which takes care of it
+        return
+    if instance.birthday or entry.start.year != entry.end.year:
+        refresh_yearly_totals(entry.user_id, [instance.date.year])
+
+
+def sync_day_occupancy(entry):
+    """make the DayOccupancy rows of this entry match its days"""
+    if entry.total_hours is None or entry.total_hours < 0:
+        # unfinished entries and reversals aren't shown
+        DayOccupancy.objects.filter(entry=entry).delete()
+        return
+    hours = dict(Hours.objects
+                 .filter(entry=entry)
+                 .values_list('date', 'hours'))
+    existing = dict((x.date, x) for x in
+                    DayOccupancy.objects.filter(entry=entry))
+    new = []
+    date = entry.start
+    while date <= entry.end:
+        if hours:
+            day_hours = hours.get(date, 0)
+        elif date.weekday() < 5:
+            day_hours = settings.WORK_DAY
+        else:
+            day_hours = 0
+        values = dict(user_id=entry.user_id, hours=day_hours,
+                      starts=date == entry.start)
+        occupancy = existing.pop(date, None)
+        if occupancy is None:
+            new.append(DayOccupancy(entry=entry, date=date, **values))
+        elif any(getattr(occupancy, k) != v for k, v in values.items()):
+            for key, value in values.items():
+                setattr(occupancy, key, value)
+            occupancy.save()
+        date += datetime.timedelta(days=1)
+    if existing:
+        (DayOccupancy.objects
+         .filter(pk__in=[x.pk for x in existing.values()])
+         .delete())
+    if new:
+        DayOccupancy.objects.bulk_create(new)
+
+
+@receiver(post_save, sender=Entry)
+def entry_sync_day_occupancy(sender, instance, **kwargs):
+    sync_day_occupancy(instance)
+
+
+ENTRY_BOUNDS_CACHE_KEY = 'entry_bounds'
+ENTRY_BOUNDS_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_entry_bounds():
+    """return the (first start, last end, first add_date) of all entries,
+    all None if there are none"""
+    bounds = cache.get(ENTRY_BOUNDS_CACHE_KEY)
+    if bounds is None:
+        aggregates = Entry.objects.aggregate(Min('start'), Max('end'),
+                                             Min('add_date'))
+        bounds = (aggregates['start__min'],
+                  aggregates['end__max'],
+                  aggregates['add_date__min'])
+        cache.set(ENTRY_BOUNDS_CACHE_KEY, bounds, ENTRY_BOUNDS_CACHE_TIMEOUT)
+    return bounds
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def entry_update_bounds(sender, instance, signal, **kwargs):
+    bounds = cache.get(ENTRY_BOUNDS_CACHE_KEY)
+    if bounds is None:
+        return
+    first_date, last_date, first_filed_date = bounds
+    previous = _previous_entry(instance, signal)
+    if signal is post_delete:
+        previous = instance.__dict__
+    if previous and (previous['start'] == first_date or
+                     previous['end'] == last_date or
+                     previous['add_date'] == first_filed_date):
+        # it might have been the only one there
+        cache.delete(ENTRY_BOUNDS_CACHE_KEY)
+        return
+    if signal is post_delete:
+        return
+    if first_date is None:
+        new_bounds = (instance.start, instance.end, instance.add_date)
+    else:
+        new_bounds = (min(first_date, instance.start),
+                      max(last_date, instance.end),
+                      min(first_filed_date, instance.add_date))
+    if new_bounds != bounds:
+        cache.set(ENTRY_BOUNDS_CACHE_KEY, new_bounds,
+                  ENTRY_BOUNDS_CACHE_TIMEOUT)
+
+
+@receiver(post_save, sender=Hours)
+def hours_sync_day_occupancy(sender, instance, **kwargs):
+    (DayOccupancy.objects
+     .filter(entry=instance.entry_id, date=instance.date)
+     .update(hours=instance.hours))
+
+
+@receiver(post_save, sender=FollowingUser)
+@receiver(post_delete, sender=FollowingUser)
+def following_refresh_observed(sender, instance, **kwargs):
+    refresh_observed_users(instance.follower_id)
+
+
+@receiver(post_save, sender=BlacklistedUser)
+@receiver(post_delete, sender=BlacklistedUser)
+def blacklist_refresh_observed(sender, instance, **kwargs):
+    refresh_observed_users(instance.observer_id)
+
+
+@receiver(org_hierarchy_changed)
+def org_refresh_observed(sender, user_id, old_manager_id, new_manager_id,
+                         **kwargs):
+    if user_id is None:
+        observer_ids = User.objects.values_list('pk', flat=True)
+    else:
+        # the user, the managers up to two levels above before and after
+        # and the teammates before and after
+        observer_ids = set([user_id])
+        for manager_id in (old_manager_id, new_manager_id):
+            if manager_id is None:
+                continue
+            observer_ids.add(manager_id)
+            observer_ids.update(UserHierarchy.objects
+                                .filter(descendant=manager_id, depth=1)
+                                .values_list('ancestor_id', flat=True))
+            observer_ids.update(UserHierarchy.objects
+                                .filter(ancestor=manager_id, depth=1)
+                                .values_list('descendant_id', flat=True))
+    for observer_id in observer_ids:
+        refresh_observed_users(observer_id)
+
+
 def generate_random_key(length=None):
     if length is None:
         length = UserKey.KEY_LENGTH
@@ -112,3 +583,29 @@ class UserKey(models.Model):
 
     def __repr__(self):
         return '<%s: %r>' % (self.__class__.__name__, self.key)
+
+
+class OutboxMessage(models.Model):
+    """a notification email waiting to be sent by the send_outbox command
+    (see dates.outbox)"""
+    entry = models.ForeignKey(Entry, null=True, on_delete=models.SET_NULL)
+    is_edit = models.BooleanField(default=False)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    # one email address per line
+    to = models.TextField()
+    cc = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(default=datetime.datetime.utcnow,
+                                        db_index=True)
+    sent_date = models.DateTimeField(null=True, blank=True)
+
+    add_date = models.DateTimeField(default=datetime.datetime.utcnow)
+    modify_date = models.DateTimeField(default=datetime.datetime.utcnow,
+                                       auto_now=True)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %r to %s>' % (self.__class__.__name__, self.subject,
+                                   self.to.replace('\n', ', '))
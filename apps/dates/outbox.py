@@ -0,0 +1,172 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Notification emails are put in the outbox instead of being sent while
+# the request waits on SMTP. The send_outbox management command sends
+# the ones that are due over one connection and backs off the ones that
+# fail.
+
+import socket
+import smtplib
+import logging
+import datetime
+
+from django.conf import settings
+from django.core.mail import get_connection, EmailMessage
+from .models import OutboxMessage
+
+
+def _split(addresses):
+    return [x.strip() for x in addresses.splitlines() if x.strip()]
+
+
+def _merge(*address_lists):
+    merged = []
+    for addresses in address_lists:
+        for address in addresses:
+            if address not in merged:
+                merged.append(address)
+    return merged
+
+
+def has_pending_notification(entry):
+    """return true if the first notification about this entry hasn't
+    been sent yet"""
+    return (OutboxMessage.objects
+            .filter(entry=entry, sent_date__isnull=True, is_edit=False)
+            .exists())
+
+
+def has_unsent_messages(entry):
+    """return true if any notification about this entry is still waiting
+    in the outbox"""
+    return (OutboxMessage.objects
+            .filter(entry=entry, sent_date__isnull=True)
+            .exists())
+
+
+def enqueue_notification(entry, subject, body, from_email, to, cc=None,
+                         is_edit=False):
+    """put a notification about this entry in the outbox.
+
+    A message about the same entry that hasn't been sent yet is replaced
+    instead, to everyone either of them is to, so a few edits in quick
+    succession only send one email.
+    """
+    pending = list(OutboxMessage.objects
+                   .filter(entry=entry, sent_date__isnull=True)
+                   .order_by('pk')[:1])
+    if pending:
+        message = pending[0]
+        to = _merge(_split(message.to), to)
+        cc = _merge(_split(message.cc), cc or [])
+    else:
+        message = OutboxMessage(entry=entry)
+    message.is_edit = is_edit
+    message.subject = subject
+    message.body = body
+    message.from_email = from_email
+    message.to = '\n'.join(to)
+    message.cc = '\n'.join(cc or [])
+    message.attempts = 0
+    message.last_error = ''
+    # give it a little while for any more edits
+    message.next_attempt = (datetime.datetime.utcnow() +
+                            datetime.timedelta(
+                              seconds=settings.EMAIL_OUTBOX_DELAY))
+    message.save()
+    return message
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except (smtplib.SMTPException, socket.error):
+        # it's gone either way
+        pass
+
+
+def _claim(message):
+    """return true if this process gets to send the message. It's put off
+    for EMAIL_OUTBOX_CLAIM seconds so that another send_outbox started in
+    the meantime leaves it alone."""
+    # whole seconds so it compares equal to what the database keeps
+    claimed_until = (datetime.datetime.utcnow().replace(microsecond=0) +
+                     datetime.timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM))
+    claimed = (OutboxMessage.objects
+               .filter(pk=message.pk,
+                       next_attempt=message.next_attempt,
+                       sent_date__isnull=True)
+               .update(next_attempt=claimed_until))
+    if claimed:
+        message.next_attempt = claimed_until
+    return bool(claimed)
+
+
+def _failed(message, exception):
+    message.attempts += 1
+    message.last_error = '%s: %s' % (exception.__class__.__name__, exception)
+    backoff = settings.EMAIL_OUTBOX_BACKOFF * 2 ** (message.attempts - 1)
+    claimed_until = message.next_attempt
+    message.next_attempt = (datetime.datetime.utcnow() +
+                            datetime.timedelta(seconds=backoff))
+    # unless it's been replaced by enqueue_notification() meanwhile
+    (OutboxMessage.objects
+     .filter(pk=message.pk, next_attempt=claimed_until)
+     .update(attempts=message.attempts,
+             last_error=message.last_error,
+             next_attempt=message.next_attempt))
+    logging.warning('Unable to send outbox message %s (attempt %s): %s',
+                    message.pk, message.attempts, message.last_error)
+
+
+def send_outbox(batch_size=100, connection=None):
+    """send the messages that are due and return how many were sent and
+    how many failed"""
+    messages = list(OutboxMessage.objects
+                    .filter(sent_date__isnull=True,
+                            next_attempt__lte=datetime.datetime.utcnow(),
+                            attempts__lt=settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+                    .order_by('next_attempt', 'pk')[:batch_size])
+    messages = [x for x in messages if _claim(x)]
+    if not messages:
+        return 0, 0
+    if connection is None:
+        connection = get_connection()
+    try:
+        connection.open()
+    except (smtplib.SMTPException, socket.error), exception:
+        # none of them can be sent
+        for message in messages:
+            _failed(message, exception)
+        return 0, len(messages)
+
+    sent = failed = 0
+    try:
+        for message in messages:
+            try:
+                # opens it again if the last one failed
+                connection.open()
+                EmailMessage(
+                  subject=message.subject,
+                  body=message.body,
+                  from_email=message.from_email,
+                  to=_split(message.to),
+                  cc=_split(message.cc) or None,
+                  connection=connection,
+                ).send()
+            except (smtplib.SMTPException, socket.error), exception:
+                _failed(message, exception)
+                _close(connection)
+                failed += 1
+            else:
+                # a message replaced by enqueue_notification() while it
+                # was being sent is left to go again with the changes
+                (OutboxMessage.objects
+                 .filter(pk=message.pk, next_attempt=message.next_attempt)
+                 .update(sent_date=datetime.datetime.utcnow()))
+                sent += 1
+    finally:
+        _close(connection)
+    return sent, failed
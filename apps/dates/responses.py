@@ -0,0 +1,18 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django import http
+
+
+class StreamedHttpResponse(http.HttpResponse):
+    """a response made from an iterator that is streamed when it's sent
+    but whose content can still be read more than once (e.g. by tests or
+    middleware), which keeps the whole body from then on"""
+
+    def _get_content(self):
+        if not isinstance(self._container, list):
+            self._container = list(self._container)
+        return super(StreamedHttpResponse, self)._get_content()
+
+    content = property(_get_content, http.HttpResponse._set_content)
@@ -28,3 +28,57 @@ class TestUtils(TestCase):
         eq_(parse_datetime('1283140800').year, 2010)
         eq_(parse_datetime('1286744467.0').year, 2010)
         self.assertRaises(DatetimeParseError, parse_datetime, 'junk')
+
+    def test_iter_csv(self):
+        from dates.csv_export import iter_csv
+        rows = [(u'ID', u'NAME')]
+        rows.extend((unicode(i), u'P\xe9ter %d' % i) for i in range(100))
+        chunks = list(iter_csv(rows, chunk_size=100))
+        ok_(len(chunks) > 1)
+        content = ''.join(chunks)
+        lines = content.splitlines()
+        eq_(len(lines), 101)
+        eq_(lines[0], 'ID,NAME')
+        eq_(lines[1].decode('utf-8'), u'0,P\xe9ter 0')
+
+        # same thing when re-encoding to something else
+        content = ''.join(iter_csv(rows, encoding='latin-1'))
+        eq_(content.splitlines()[1].decode('latin-1'), u'0,P\xe9ter 0')
+
+    def test_iter_vcalendar(self):
+        import vobject
+        from dates.ical import iter_vcalendar, fold_line
+        events = [{
+          'uid': '20120101T000000Z-1@localhost',
+          'summary': u'P\xe9ter, Bengtsson; \\ ' * 5 + u'\n2 days PTO',
+          'start': datetime.date(2012, 1, 2),
+          'end': datetime.date(2012, 1, 3),
+          'url': 'http://pto/dates/list/?' + '&name=P%C3%A9ter' * 10,
+          'description': 'Log in to see the details',
+        }]
+        cal = vobject.iCalendar()
+        cal.add('x-wr-calname').value = 'Mozilla PTO'
+        event = cal.add('vevent')
+        for key in ('uid', 'summary', 'url', 'description'):
+            event.add(key).value = events[0][key]
+        event.add('dtstart').value = events[0]['start']
+        event.add('dtend').value = events[0]['end']
+        chunks = list(iter_vcalendar(events, 'Mozilla PTO'))
+        eq_(len(chunks), 4)
+        eq_(''.join(chunks), cal.serialize())
+
+        # folding never splits a character
+        line = fold_line(u'SUMMARY:' + u'\xe9' * 100)
+        for part in line.split('\r\n '):
+            ok_(len(part) <= 75)
+            part.decode('utf-8')
+
+    def test_chunked_queryset(self):
+        from django.contrib.auth.models import User
+        from dates.utils import chunked_queryset
+        for i in range(7):
+            User.objects.create(username='user%d' % i)
+        chunks = list(chunked_queryset(User.objects.all(), 3))
+        eq_([len(x) for x in chunks], [3, 3, 1])
+        pks = [x.pk for chunk in chunks for x in chunk]
+        eq_(pks, sorted(pks))
@@ -123,3 +123,253 @@ class ModelsTest(TestCase):
             if uk.key in keys:
                 raise AssertionError('same key reused')
             keys.add(uk.key)
+
+    def test_observed_users(self):
+        from dates.models import ObservedUser
+
+        def observed(user):
+            return dict((x.observable.username, x.get_reason_display())
+                        for x in (ObservedUser.objects
+                                  .filter(observer=user)
+                                  .select_related('observable')))
+
+        def make_manager(user, manager):
+            profile = user.get_profile()
+            profile.manager_user = manager
+            profile.save()
+
+        todd = User.objects.create(username='todd')
+        mike = User.objects.create(username='mike')
+        ben = User.objects.create(username='ben')
+        laura = User.objects.create(username='laura')
+        axel = User.objects.create(username='axel')
+        make_manager(mike, todd)
+        make_manager(ben, todd)
+        make_manager(laura, mike)
+
+        eq_(observed(todd), {'mike': 'direct manager of',
+                             'ben': 'direct manager of',
+                             'laura': 'indirect manager of'})
+        eq_(observed(mike), {'todd': 'your manager',
+                             'ben': 'teammate',
+                             'laura': 'direct manager of'})
+        eq_(observed(laura), {'mike': 'your manager'})
+
+        FollowingUser.objects.create(follower=mike, following=ben)
+        FollowingUser.objects.create(follower=mike, following=axel)
+        eq_(observed(mike)['ben'], 'curious')
+        eq_(observed(mike)['axel'], 'curious')
+
+        BlacklistedUser.objects.create(observer=mike, observable=ben)
+        BlacklistedUser.objects.create(observer=todd, observable=laura)
+        ok_('ben' not in observed(mike))
+        ok_('laura' not in observed(todd))
+
+        # laura moves to ben's team
+        make_manager(laura, ben)
+        eq_(observed(laura), {'ben': 'your manager'})
+        ok_('laura' not in observed(mike))
+        eq_(observed(ben), {'todd': 'your manager',
+                            'mike': 'teammate',
+                            'laura': 'direct manager of'})
+
+    def test_day_occupancy(self):
+        from dates.models import DayOccupancy
+        from dates.views import get_right_nows, get_upcomings
+        bob = User.objects.create(username='bob')
+        friday = datetime.date(2018, 1, 5)
+        monday = datetime.date(2018, 1, 8)
+        entry = Entry.objects.create(user=bob, start=friday, end=monday)
+        ok_(not DayOccupancy.objects.exists())
+
+        entry.total_hours = 12
+        entry.save()
+        Hours.objects.create(entry=entry, date=friday, hours=8)
+        Hours.objects.create(entry=entry, date=monday, hours=4)
+        eq_(list(DayOccupancy.objects
+                 .filter(entry=entry)
+                 .order_by('date')
+                 .values_list('date', 'hours', 'starts')),
+            [(friday, 8, True),
+             (friday + datetime.timedelta(days=1), 0, False),
+             (friday + datetime.timedelta(days=2), 0, False),
+             (monday, 4, False)])
+
+        right_nows, users = get_right_nows(monday)
+        eq_(users, [bob])
+        eq_(right_nows[bob], [(1, entry)])
+        upcomings, users = get_upcomings(7, monday - datetime.timedelta(days=7))
+        eq_(users, [bob])
+        eq_(upcomings[bob], [(5, entry)])
+        eq_(get_upcomings(7, friday)[1], [])
+
+        entry.start = monday
+        entry.save()
+        eq_(DayOccupancy.objects.filter(entry=entry).count(), 1)
+        eq_(get_right_nows(friday)[1], [])
+
+        # reversals aren't anybody being out
+        entry.total_hours = -4
+        entry.save()
+        eq_(get_right_nows(monday)[1], [])
+
+    def test_yearly_totals(self):
+        from dates.models import YearlyTotal
+        from django.core.management import call_command
+        bob = User.objects.create(username='bob')
+        alice = User.objects.create(username='alice')
+
+        def totals(user):
+            return dict((x.year, (x.hours, x.birthdays)) for x in
+                        YearlyTotal.objects.filter(user=user))
+
+        # Thursday to Tuesday over new year's
+        entry = Entry.objects.create(
+          user=bob,
+          start=datetime.date(2015, 12, 31),
+          end=datetime.date(2016, 1, 5),
+        )
+        eq_(totals(bob), {2015: (0, 0), 2016: (0, 0)})
+        # no hours yet so it's shared by weekday
+        entry.total_hours = 32
+        entry.save()
+        eq_(totals(bob), {2015: (8, 0), 2016: (24, 0)})
+
+        Hours.objects.create(entry=entry, date=datetime.date(2015, 12, 31),
+                             hours=0, birthday=True)
+        for day in (1, 4, 5):
+            Hours.objects.create(entry=entry, hours=8,
+                                 date=datetime.date(2016, 1, day))
+        entry.total_hours = 24
+        entry.save()
+        eq_(totals(bob), {2015: (0, 1), 2016: (24, 0)})
+
+        reversal = Entry.objects.create(
+          user=bob,
+          start=datetime.date(2016, 1, 4),
+          end=datetime.date(2016, 1, 4),
+          total_hours=-8,
+        )
+        eq_(totals(bob)[2016], (16, 0))
+
+        reversal.user = alice
+        reversal.save()
+        eq_(totals(bob)[2016], (24, 0))
+        eq_(totals(alice), {2016: (-8, 0)})
+
+        before = totals(bob), totals(alice)
+        YearlyTotal.objects.all().delete()
+        call_command('rebuild_yearly_totals', verbosity=0)
+        eq_((totals(bob), totals(alice)), before)
+
+        reversal.delete()
+        eq_(totals(alice), {2016: (0, 0)})
+
+    def test_hours_user(self):
+        bob = User.objects.create(username='bob')
+        alice = User.objects.create(username='alice')
+        monday = datetime.date(2011, 7, 25)
+        entry = Entry.objects.create(user=bob, start=monday, end=monday,
+                                     total_hours=8)
+        hours = Hours.objects.create(entry=entry, date=monday, hours=8)
+        eq_(hours.user, bob)
+
+        entry.user = alice
+        entry.save()
+        eq_(Hours.objects.get(pk=hours.pk).user, alice)
+        ok_(not Hours.objects.filter(user=bob))
+
+    def test_entry_bounds(self):
+        from django.core.cache import cache
+        from dates.models import get_entry_bounds
+        cache.clear()
+        eq_(get_entry_bounds(), (None, None, None))
+        bob = User.objects.create(username='bob')
+        monday = datetime.date(2011, 7, 25)
+        friday = datetime.date(2011, 7, 29)
+        filed = datetime.datetime(2011, 7, 1, 12, 0)
+        first = Entry.objects.create(user=bob, start=monday, end=monday,
+                                     add_date=filed)
+        with self.assertNumQueries(0):
+            eq_(get_entry_bounds(), (monday, monday, filed))
+
+        second = Entry.objects.create(user=bob, start=friday, end=friday)
+        with self.assertNumQueries(0):
+            eq_(get_entry_bounds()[:2], (monday, friday))
+
+        # moving or deleting one on a bound has to look again
+        second.end = second.start = monday
+        second.save()
+        eq_(get_entry_bounds()[:2], (monday, monday))
+        first.delete()
+        eq_(get_entry_bounds(),
+            (monday, monday, Entry.objects.get(pk=second.pk).add_date))
+
+    def test_year_occupancy(self):
+        from django.core.cache import cache
+        from dates.models import (get_year_occupancy, get_logged_hours,
+                                  get_overlapping_hours)
+        cache.clear()
+        bob = User.objects.create(username='bob')
+        friday = datetime.date(2011, 12, 30)
+        monday = datetime.date(2012, 1, 2)
+        entry = Entry.objects.create(user=bob, start=friday, end=monday,
+                                     total_hours=12)
+        Hours.objects.create(entry=entry, date=friday, hours=8)
+        Hours.objects.create(entry=entry, date=monday, hours=4)
+        # reversed since
+        leap_day = datetime.date(2012, 2, 29)
+        entry = Entry.objects.create(user=bob, start=leap_day, end=leap_day,
+                                     total_hours=8)
+        Hours.objects.create(entry=entry, date=leap_day, hours=8)
+        entry = Entry.objects.create(user=bob, start=leap_day, end=leap_day,
+                                     total_hours=-8)
+        Hours.objects.create(entry=entry, date=leap_day, hours=-8)
+
+        hours, logged = get_year_occupancy(bob.pk, 2012)
+        eq_(len(hours), 366)
+        eq_((hours[1], logged[1]), (4, 1))
+        eq_((hours[59], logged[59]), (0, 1))
+        eq_(sum(logged), 2)
+        hours, logged = get_year_occupancy(bob.pk, 2011)
+        eq_((hours[363], logged[363]), (8, 1))
+
+        # both years are cached now
+        with self.assertNumQueries(0):
+            eq_(get_logged_hours(bob, friday, leap_day),
+                {friday: 8, monday: 4, leap_day: 0})
+            eq_(get_overlapping_hours(bob, friday, leap_day),
+                [(friday, 8), (monday, 4)])
+        eq_(get_logged_hours(bob, friday, leap_day, use_cache=False),
+            {friday: 8, monday: 4, leap_day: 0})
+
+        # any hours logged make it again
+        monday_hours = Hours.objects.get(date=monday)
+        monday_hours.hours = 8
+        monday_hours.save()
+        eq_(get_overlapping_hours(bob, monday, monday), [(monday, 8)])
+
+    def test_extra_indexes(self):
+        from django.db import connection
+        from dates.indexes import get_index_statements
+        statements = get_index_statements(connection)
+        ok_([x for x in statements if 'dates_entry_user_start_end' in x])
+        ok_([x for x in statements if 'dates_hours_date_entry' in x])
+        ok_([x for x in statements if 'dates_hours_user_date' in x])
+        ok_([x for x in statements if 'dates_entry_end' in x])
+        ok_([x for x in statements
+             if 'users_userhierarchy_descendant_id_depth' in x])
+        if connection.vendor == 'mysql':
+            ok_(not [x for x in statements if 'WHERE' in x])
+        # already made with the test database
+        ok_(not get_index_statements(connection, skip_existing=True))
+        from dates.indexes import create_indexes
+        create_indexes(connection)
+
+    def test_explain_queries(self):
+        from StringIO import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('explain_queries', stdout=out, stderr=StringIO())
+        ok_('get_right_nows' in out.getvalue())
+        ok_('queries without an index' in out.getvalue())
@@ -0,0 +1,148 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import socket
+import smtpd
+import asyncore
+import datetime
+import threading
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test.utils import override_settings
+from dates.models import Entry, OutboxMessage
+from dates.outbox import enqueue_notification, send_outbox
+from nose.tools import eq_, ok_
+from test_utils import TestCase
+
+
+class SMTPStandIn(smtpd.SMTPServer):
+    """an SMTP server on localhost that keeps what it's sent"""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        self.thread = threading.Thread(target=asyncore.loop,
+                                       kwargs={'timeout': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.received.append((mailfrom, sorted(rcpttos), data))
+
+    def stop(self):
+        self.close()
+        self.thread.join(5)
+
+
+def _unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@override_settings(EMAIL_OUTBOX=True,
+                   EMAIL_OUTBOX_DELAY=0,
+                   EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                   EMAIL_HOST='127.0.0.1')
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        super(OutboxTest, self).setUp()
+        self.peter = User.objects.create(username='peter',
+                                         email='peter@mozilla.com')
+        monday = datetime.date(2011, 7, 25)
+        self.entry = Entry.objects.create(user=self.peter, start=monday,
+                                          end=monday, total_hours=8)
+
+    def _enqueue(self, to, body='Out on Monday', is_edit=False):
+        return enqueue_notification(self.entry, 'PTO', body,
+                                    'peter@mozilla.com', to,
+                                    cc=['peter@mozilla.com'],
+                                    is_edit=is_edit)
+
+    def test_send_outbox(self):
+        self._enqueue(['laura@mozilla.com'])
+        # an edit before it's been sent
+        self._enqueue(['mike@mozilla.com'], body='Out on Monday afternoon',
+                      is_edit=True)
+        other = Entry.objects.create(user=self.peter, start=self.entry.start,
+                                     end=self.entry.end, total_hours=4)
+        enqueue_notification(other, 'PTO', 'Out on Monday morning',
+                             'peter@mozilla.com', ['laura@mozilla.com'])
+        eq_(OutboxMessage.objects.count(), 2)
+
+        server = SMTPStandIn()
+        try:
+            with self.settings(EMAIL_PORT=server.port):
+                eq_(send_outbox(), (2, 0))
+                # nothing left to send
+                eq_(send_outbox(), (0, 0))
+        finally:
+            server.stop()
+
+        eq_(len(server.received), 2)
+        mailfrom, rcpttos, data = [x for x in server.received
+                                   if 'mike@mozilla.com' in x[1]][0]
+        eq_(mailfrom, 'peter@mozilla.com')
+        eq_(rcpttos, ['laura@mozilla.com', 'mike@mozilla.com',
+                      'peter@mozilla.com'])
+        ok_('Out on Monday afternoon' in data)
+        ok_(not OutboxMessage.objects.filter(sent_date__isnull=True))
+
+    def test_send_outbox_retry(self):
+        message = self._enqueue(['laura@mozilla.com'])
+        with self.settings(EMAIL_PORT=_unused_port(),
+                           EMAIL_OUTBOX_BACKOFF=60):
+            eq_(send_outbox(), (0, 1))
+            # not until it's backed off
+            eq_(send_outbox(), (0, 0))
+
+        message = OutboxMessage.objects.get(pk=message.pk)
+        eq_(message.attempts, 1)
+        ok_(message.last_error)
+        ok_(message.next_attempt > datetime.datetime.utcnow())
+        ok_(not message.sent_date)
+
+        message.next_attempt = datetime.datetime.utcnow()
+        message.save()
+        server = SMTPStandIn()
+        try:
+            with self.settings(EMAIL_PORT=server.port):
+                call_command('send_outbox')
+        finally:
+            server.stop()
+        eq_(len(server.received), 1)
+        ok_(OutboxMessage.objects.get(pk=message.pk).sent_date)
+
+    def test_send_outbox_claimed(self):
+        from dates.outbox import _claim
+        message = self._enqueue(['laura@mozilla.com'])
+        # another send_outbox got to it first
+        ok_(_claim(OutboxMessage.objects.get(pk=message.pk)))
+        ok_(not _claim(message))
+        with self.settings(EMAIL_PORT=_unused_port()):
+            eq_(send_outbox(), (0, 0))
+        message = OutboxMessage.objects.get(pk=message.pk)
+        eq_(message.attempts, 0)
+        ok_(not message.sent_date)
+
+    def test_emails_sent_queued(self):
+        from django.core.urlresolvers import reverse
+        self.peter.set_password('secret')
+        self.peter.save()
+        assert self.client.login(username='peter', password='secret')
+        url = reverse('dates.emails_sent', args=[self.entry.pk])
+        message = self._enqueue(['laura@mozilla.com'])
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        ok_('Email will be sent shortly to' in response.content)
+
+        message.sent_date = datetime.datetime.utcnow()
+        message.save()
+        response = self.client.get(url)
+        ok_('Email will be sent shortly to' not in response.content)
+        ok_('Email sent to' in response.content)
@@ -15,8 +15,9 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.utils import simplejson as json
 from django.core import mail
+from django.core.cache import cache
 from dates.models import (Entry, Hours, BlacklistedUser, FollowingUser,
-                          UserKey)
+                          UserKey, ObservedUser)
 from nose.tools import eq_, ok_
 from test_utils import TestCase
 from mock import Mock
@@ -89,6 +90,7 @@ class ViewsTest(TestCase, ViewsTestMixin):
         super(ViewsTest, self).setUp()
         # A must when code in this app relies on cache
         settings.CACHE_BACKEND = 'locmem:///'
+        cache.clear()
 
         ldap.open = Mock('ldap.open')
         ldap.open.mock_returns = Mock('ldap_connection')
@@ -732,6 +734,107 @@ class ViewsTest(TestCase, ViewsTestMixin):
         eq_(len(events), 1)
         ok_('birthday' in events[0]['title'])
 
+    def test_calendar_events_cached(self):
+        from dates.views import calendar_events
+        peter = self._login()
+        entry = Entry.objects.create(
+          user=peter,
+          start=datetime.date(2011, 7, 29),
+          end=datetime.date(2011, 8, 2),
+          total_hours=8 * 3,
+        )
+        url = reverse('dates.calendar_events')
+
+        def get(start, end):
+            request = RequestFactory().get(url, {
+              'start': time.mktime(start.timetuple()),
+              'end': time.mktime(end.timetuple()),
+            })
+            request.user = peter
+            response = calendar_events(request)
+            eq_(response.status_code, 200)
+            return json.loads(response.content)['events']
+
+        july = (datetime.datetime(2011, 7, 1), datetime.datetime(2011, 7, 31))
+        events = get(*july)
+        eq_([x['id'] for x in events], [entry.pk])
+        eq_(events[0]['title'], '24 hours')
+
+        # the month asked for is now cached
+        with self.assertNumQueries(0):
+            events = get(*july)
+            eq_([x['id'] for x in events], [entry.pk])
+
+        # only August has to be looked up and then both are cached
+        july_august = (datetime.datetime(2011, 7, 15),
+                       datetime.datetime(2011, 8, 31))
+        events = get(*july_august)
+        eq_([x['id'] for x in events], [entry.pk])
+        with self.assertNumQueries(0):
+            events = get(*july_august)
+            eq_([x['id'] for x in events], [entry.pk])
+
+        # the month after it isn't
+        events = get(datetime.datetime(2011, 9, 1),
+                     datetime.datetime(2011, 9, 30))
+        eq_(events, [])
+
+        entry.total_hours = 8 * 2
+        entry.save()
+        events = get(*july)
+        eq_(events[0]['title'], '16 hours')
+
+        # someone you follow adding an entry
+        bob = User.objects.create(username='bob', email='bob@mozilla.com')
+        bobs = Entry.objects.create(
+          user=bob,
+          start=datetime.date(2011, 7, 4),
+          end=datetime.date(2011, 7, 4),
+          total_hours=8,
+        )
+        eq_([x['id'] for x in get(*july)], [entry.pk])
+        FollowingUser.objects.create(follower=peter, following=bob)
+        eq_([x['id'] for x in get(*july)], [entry.pk, bobs.pk])
+        bobs.delete()
+        eq_([x['id'] for x in get(*july)], [entry.pk])
+
+    def test_entry_title_summary(self):
+        from dates.views import make_entry_title
+        peter = self._login()
+        monday = datetime.date(2018, 1, 1)  # I know this is a Monday
+        wednesday = monday + datetime.timedelta(days=2)
+        entry = Entry.objects.create(
+          user=peter,
+          start=monday,
+          end=wednesday,
+        )
+        url = reverse('dates.hours', args=[entry.pk])
+        response = self.client.post(url, {
+          'd-20180101': str(settings.WORK_DAY),
+          'd-20180102': '-1',
+          'd-20180103': str(settings.WORK_DAY / 2),
+        })
+        eq_(response.status_code, 302)
+
+        entry = Entry.objects.select_related('user').get(pk=entry.pk)
+        eq_(entry.total_days, 1.5)
+        ok_(entry.has_birthday)
+        with self.assertNumQueries(0):
+            title = make_entry_title(entry, peter)
+        eq_(title, '1.5 days (includes birthday)')
+
+        # entries that haven't been summarized yet still work
+        Entry.objects.filter(pk=entry.pk).update(total_days=None,
+                                                 has_birthday=False)
+        entry = Entry.objects.select_related('user').get(pk=entry.pk)
+        eq_(make_entry_title(entry, peter), title)
+
+        from django.core.management import call_command
+        call_command('backfill_entry_days', verbosity=0)
+        entry = Entry.objects.get(pk=entry.pk)
+        eq_(entry.total_days, 1.5)
+        ok_(entry.has_birthday)
+
     def test_notify_free_input(self):
         hr_manager = self._create_hr_manager()
         hr_manager2 = self._create_hr_manager(
@@ -997,6 +1100,165 @@ class ViewsTest(TestCase, ViewsTestMixin):
         totals = [x[4] for x in entries]
         eq_(sum(totals), 8 + 4 - 8)
 
+    def test_enter_reversal_pto_twice(self):
+        from dates.forms import HoursForm
+        monday = datetime.date(2011, 7, 25)
+        friday = monday + datetime.timedelta(days=4)
+        peter = self._login()
+
+        def log(hours):
+            entry = Entry.objects.create(user=peter, start=monday,
+                                         end=friday, details='%d' % hours)
+            url = reverse('dates.hours', args=[entry.pk])
+            data = {}
+            for i in range(5):
+                date = monday + datetime.timedelta(days=i)
+                data[date.strftime('d-%Y%m%d')] = hours
+            response = self.client.post(url, data)
+            eq_(response.status_code, 302)
+            return entry
+
+        log(settings.WORK_DAY)
+        log(settings.WORK_DAY / 2)
+        # used to find more than one Hours on each day
+        entry = log(settings.WORK_DAY)
+
+        eq_(sum(x.total_hours for x in Entry.objects.all()),
+            settings.WORK_DAY * 5)
+        reversals = Entry.objects.filter(total_hours__lt=0)
+        eq_(reversals.count(), 10)
+        eq_(set(x.details for x in reversals),
+            set(['%d' % settings.WORK_DAY, '%d' % (settings.WORK_DAY / 2)]))
+        for reversal in reversals:
+            eq_([(x.date, x.hours) for x in reversal.hours_set.all()],
+                [(reversal.start, reversal.total_hours)])
+
+        with self.assertNumQueries(1):
+            form = HoursForm(entry)
+        eq_(form.fields[monday.strftime('d-%Y%m%d')].help_text,
+            'Already logged %d hours on this day' % settings.WORK_DAY)
+
+    def test_duplicate_report(self):
+        monday = datetime.date(2011, 7, 25)
+        friday = monday + datetime.timedelta(days=4)
+        peter = self._login()
+        url = reverse('dates.duplicate_report')
+
+        first = Entry.objects.create(user=peter, start=monday, end=friday,
+                                     details='Vacation',
+                                     total_hours=settings.WORK_DAY * 5)
+        self._create_entry_hours(first)
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        ok_('No suspect duplicates found' in response.content)
+
+        # the same dates entered again
+        second = Entry.objects.create(user=peter, start=monday, end=friday,
+                                      details='Vacation',
+                                      total_hours=settings.WORK_DAY * 5)
+        self._create_entry_hours(second)
+        # and a day that overlaps
+        third = Entry.objects.create(user=peter, start=friday, end=friday,
+                                     details='Long weekend',
+                                     total_hours=settings.WORK_DAY)
+        self._create_entry_hours(third)
+
+        from dates.duplicates import find_duplicates
+        report = find_duplicates(user=peter)
+        eq_([([x.pk for x in entries], note) for entries, note
+             in report.duplicates],
+            [([first.pk, second.pk],
+              'Probably a duplicate! The details are the same for each entry')])
+        eq_(sorted((x.pk, y.pk) for x, y in report.overlaps),
+            [(first.pk, third.pk), (second.pk, third.pk)])
+        eq_([(date, hours) for user_id, date, hours in report.double_booked],
+            [(monday + datetime.timedelta(days=i), settings.WORK_DAY * 2)
+             for i in range(4)] + [(friday, settings.WORK_DAY * 3)])
+
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        ok_('Instance #1' in response.content)
+        ok_('Overlapping entries' in response.content)
+        ok_('name="delete"' not in response.content)
+
+        response = self.client.post(url, {'delete': [second.pk, third.pk]})
+        eq_(response.status_code, 403)
+        eq_(Entry.objects.count(), 3)
+
+        # only the entries that start on or after since are looked at
+        report = find_duplicates(user=peter, since=friday)
+        eq_((report.duplicates, report.overlaps), ([], []))
+
+        peter.is_staff = True
+        peter.save()
+        response = self.client.get(url)
+        ok_('name="delete"' in response.content)
+        # an entry that isn't in the report is left alone
+        other = Entry.objects.create(user=peter, start=monday.replace(2012),
+                                     end=monday.replace(2012),
+                                     total_hours=settings.WORK_DAY)
+        response = self.client.post(url, {
+          'delete': [second.pk, third.pk, other.pk],
+          'query_string': 'since=%s' % monday.strftime('%d+%B+%Y'),
+        })
+        eq_(response.status_code, 302)
+        ok_(response['Location'].endswith('?since=25+July+2011'))
+        eq_(sorted(Entry.objects.values_list('pk', flat=True)),
+            [first.pk, other.pk])
+        eq_(len(find_duplicates(user=peter)), 0)
+
+    def test_duplicate_report_ignores_reversed_edits(self):
+        monday = datetime.date(2011, 7, 25)
+        friday = monday + datetime.timedelta(days=4)
+        peter = self._login()
+
+        for hours in (settings.WORK_DAY, settings.WORK_DAY / 2):
+            entry = Entry.objects.create(user=peter, start=monday,
+                                         end=friday, details='Vacation')
+            data = {}
+            for i in range(5):
+                date = monday + datetime.timedelta(days=i)
+                data[date.strftime('d-%Y%m%d')] = hours
+            response = self.client.post(reverse('dates.hours',
+                                                args=[entry.pk]), data)
+            eq_(response.status_code, 302)
+
+        from dates.duplicates import find_duplicates
+        eq_(len(find_duplicates(user=peter)), 0)
+
+        # overlapping on a weekend only can't count anything twice
+        saturday = friday + datetime.timedelta(days=8)
+        first = Entry.objects.create(user=peter,
+                                     start=saturday - datetime.timedelta(1),
+                                     end=saturday + datetime.timedelta(1),
+                                     total_hours=settings.WORK_DAY)
+        self._create_entry_hours(first, settings.WORK_DAY, 0, 0)
+        second = Entry.objects.create(user=peter, start=saturday,
+                                      end=saturday + datetime.timedelta(2),
+                                      total_hours=settings.WORK_DAY)
+        self._create_entry_hours(second, 0, 0, settings.WORK_DAY)
+        eq_(len(find_duplicates(user=peter)), 0)
+
+    def test_notify_overlapping(self):
+        monday = datetime.date(2011, 7, 25)
+        tuesday = monday + datetime.timedelta(days=1)
+        peter = self._login()
+        entry = Entry.objects.create(user=peter, start=monday, end=tuesday,
+                                     total_hours=12)
+        self._create_entry_hours(entry, 8, 4)
+
+        url = reverse('dates.notify')
+        response = self.client.post(url, {
+          'start': tuesday.strftime('%Y-%m-%d'),
+          'end': (tuesday + datetime.timedelta(days=1)).strftime('%Y-%m-%d'),
+          'details': 'Going on a cruise',
+        }, follow=True)
+        eq_(response.status_code, 200)
+        ok_('You have already logged PTO on Tuesday 26 July 2011 (4h)'
+            in response.content)
+        # the help text is made from the same cached hours
+        ok_('Already logged 4 hours on this day' in response.content)
+
     def test_list_json(self):
         url = reverse('dates.list_json')
 
@@ -1232,6 +1494,100 @@ class ViewsTest(TestCase, ViewsTestMixin):
         ok_('Peter' not in response.content)
         ok_('Laura' not in response.content)
 
+    def test_list_json_server_side(self):
+        url = reverse('dates.list_json')
+        peter = self._login()
+        laura = User.objects.create(
+          username='laura',
+          email='laura@mozilla.com',
+          first_name='Laura',
+          last_name='Thomson',
+        )
+        monday = datetime.date(2018, 1, 1)  # I know this is a Monday
+        for i in range(5):
+            for user in (peter, laura):
+                Entry.objects.create(
+                  user=user,
+                  start=monday + datetime.timedelta(days=i * 7),
+                  end=monday + datetime.timedelta(days=i * 7),
+                  total_hours=8,
+                  details='Day %d' % i
+                )
+
+        params = {
+          'sEcho': '3',
+          'iDisplayStart': '0',
+          'iDisplayLength': '4',
+          'iSortCol_0': '5',
+          'sSortDir_0': 'asc',
+        }
+        response = self.client.get(url, params)
+        eq_(response.status_code, 200)
+        struct = json.loads(response.content)
+        eq_(struct['sEcho'], 3)
+        eq_(struct['iTotalRecords'], 10)
+        eq_(struct['iTotalDisplayRecords'], 10)
+        eq_(len(struct['aaData']), 4)
+        starts = [x[5] for x in struct['aaData']]
+        eq_(starts, sorted(starts))
+        ok_(struct['sCursor'])
+
+        # the next page with the cursor...
+        params['iDisplayStart'] = '4'
+        response = self.client.get(url, params)
+        by_offset = json.loads(response.content)['aaData']
+        params['sCursor'] = struct['sCursor']
+        response = self.client.get(url, params)
+        by_cursor = json.loads(response.content)['aaData']
+        eq_(by_cursor, by_offset)
+        eq_(len(by_cursor), 4)
+        ok_(not set(x[5] for x in by_cursor) & set(starts[:2]))
+
+        # a cursor made for another page is ignored
+        params['iDisplayStart'] = '8'
+        response = self.client.get(url, params)
+        eq_(len(json.loads(response.content)['aaData']), 2)
+
+        # ...and so is one made with other filters
+        params['iDisplayStart'] = '4'
+        params['sSearch'] = 'laur'
+        response = self.client.get(url, params)
+        eq_(len(json.loads(response.content)['aaData']), 1)
+        del params['sSearch']
+        del params['sCursor']
+
+        params['iDisplayStart'] = '0'
+        params['sSortDir_0'] = 'desc'
+        response = self.client.get(url, params)
+        starts = [x[5] for x in json.loads(response.content)['aaData']]
+        eq_(starts, sorted(starts, reverse=True))
+
+        params['sSearch'] = 'laur'
+        response = self.client.get(url, params)
+        struct = json.loads(response.content)
+        eq_(struct['iTotalRecords'], 10)
+        eq_(struct['iTotalDisplayRecords'], 5)
+        ok_(all(x[0] == laura.email for x in struct['aaData']))
+
+        profile = laura.get_profile()
+        profile.city = 'Berlin'
+        profile.save()
+        params['sSearch'] = 'berl'
+        response = self.client.get(url, params)
+        struct = json.loads(response.content)
+        eq_(struct['iTotalDisplayRecords'], 5)
+        ok_(all(x[7] == 'Berlin' for x in struct['aaData']))
+
+        params['sSearch'] = '2018-01-08'
+        response = self.client.get(url, params)
+        struct = json.loads(response.content)
+        eq_(struct['iTotalDisplayRecords'], 2)
+        ok_(all(x[5] == '2018-01-08' for x in struct['aaData']))
+
+        params['iDisplayStart'] = 'junk'
+        response = self.client.get(url, params)
+        eq_(response.status_code, 400)
+
     def test_list(self):
         url = reverse('dates.list')
         response = self.client.get(url)
@@ -1458,6 +1814,7 @@ class ViewsTest(TestCase, ViewsTestMixin):
         head = False
         rows = 0
         by_ids = {}
+        ids = []
         for row in reader:
             if not head:
                 head = row
@@ -1465,8 +1822,13 @@ class ViewsTest(TestCase, ViewsTestMixin):
             assert len(head) == len(row)
             rows += 1
             by_ids[int(row[0])] = row
+            ids.append(int(row[0]))
 
         eq_(rows, 2)
+        # in the order they were added
+        eq_(ids, [entry2.pk, entry4.pk])
+        # and the streamed content can be read again
+        eq_(len(response.content.splitlines()), 3)
         ok_(entry2.pk in by_ids.keys())
         ok_(entry4.pk in by_ids.keys())
         ok_(entryB.pk not in by_ids.keys())
@@ -1735,6 +2097,16 @@ class ViewsTest(TestCase, ViewsTestMixin):
         ok_('peter' in html)
         ok_('indirect manager of' in html)
 
+        # sorted by first name regardless of case
+        ben.first_name = 'ben'
+        ben.save()
+        laura.first_name = 'Laura'
+        laura.save()
+        response = self.client.get(url)
+        html = response.content.split('id="observed"')[1].split('</table>')[0]
+        ids = re.findall('data-id="(\d+)"', html)
+        ok_(ids.index(str(ben.pk)) < ids.index(str(laura.pk)))
+
         # fire off an AJAX post to unfollow 'peter'
         unfollow_url = reverse('dates.save_unfollowing')
         response = self.client.post(unfollow_url, {'remove': 'xxx'})
@@ -1804,6 +2176,15 @@ class ViewsTest(TestCase, ViewsTestMixin):
         eq_(struct['id'], stas.pk)
         eq_(struct['name'], stas.username)
 
+        # before rebuild_org_hierarchy has filled in the observed users
+        ObservedUser.objects.filter(observer=mike).delete()
+        response = self.client.post(follow_url, {
+          'search': str(stas.pk),
+        })
+        eq_(response.status_code, 200)
+        eq_(json.loads(response.content)['reason'], 'curious')
+        ok_(ObservedUser.objects.filter(observer=mike).exists())
+
         chofman.first_name = 'Chris'
         chofman.last_name = 'Hofman'
         chofman.email = 'chofman@mozilla.com'
@@ -1956,6 +2337,41 @@ class ViewsTest(TestCase, ViewsTestMixin):
         eq_(response.status_code, 200)
         ok_('Calendar expired' in response.content)
 
+    def test_calendar_vcal_conditional_get(self):
+        mike = User.objects.create(username='mike')
+        uk = UserKey.objects.create(user=mike)
+        url = reverse('dates.calendar_vcal', args=[uk.key])
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        ok_('private' in response['Cache-Control'])
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 304)
+        eq_(response.content, '')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        eq_(response.status_code, 304)
+
+        today = datetime.date.today()
+        entry = Entry.objects.create(
+          user=mike,
+          start=today,
+          end=today,
+          total_hours=settings.WORK_DAY,
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        ok_('BEGIN:VEVENT' in response.content)
+        ok_(response['ETag'] != etag)
+        etag = response['ETag']
+
+        # deleting is a change too
+        entry.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        ok_('BEGIN:VEVENT' not in response.content)
+
     def test_calendar_vcal_expired(self):
         key_length = UserKey.KEY_LENGTH
         url = reverse('dates.calendar_vcal', args=['x' * key_length])
@@ -27,3 +27,21 @@ def parse_datetime(datestr):
         if len(datestr) >= len('1283140800'):
             return datetime.datetime.fromtimestamp(float(datestr))
     raise DatetimeParseError(datestr)
+
+
+def chunked_queryset(queryset, chunk_size=500):
+    """Generate lists of at most `chunk_size` objects from the queryset,
+    ordered by primary key. Each chunk is fetched with its own query that
+    seeks past the previous one so only one chunk is ever held in memory.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        yield chunk
+        last_pk = chunk[-1].pk
@@ -0,0 +1,51 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Generation counters for invalidating cached things that are expensive
+# to find and delete. Anything cached is keyed by the generations of what
+# it was made from and whatever changes bumps the relevant generation.
+
+import time
+from django.core.cache import cache
+
+
+# memcached's maximum relative expiry time
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def _key(name, pk):
+    return 'generation:%s:%s' % (name, pk)
+
+
+def _initial():
+    # if a counter is ever evicted it mustn't restart at a number that
+    # has been used before
+    return int(time.time() * 1000)
+
+
+def get_generations(name, pks):
+    """return a dict of each pk and its current generation"""
+    keys = dict((_key(name, pk), pk) for pk in pks)
+    found = cache.get_many(keys.keys())
+    generations = {}
+    missing = {}
+    for key, pk in keys.items():
+        if key not in found:
+            missing[key] = found[key] = _initial()
+        generations[pk] = found[key]
+    if missing:
+        cache.set_many(missing, GENERATION_TIMEOUT)
+    return generations
+
+
+def get_generation(name, pk):
+    return get_generations(name, [pk])[pk]
+
+
+def bump_generation(name, pk):
+    key = _key(name, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial(), GENERATION_TIMEOUT)
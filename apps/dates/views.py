@@ -4,6 +4,7 @@
 
 import re
 import datetime
+import hashlib
 from urllib import urlencode
 from collections import defaultdict
 from django import http
@@ -20,20 +21,29 @@ from django.core.mail import get_connection, EmailMessage
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.shortcuts import render
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.cache import cache_control
 from django.contrib.sites.models import RequestSite
 from django.core.cache import cache
-from django.db.models import Min, Count
-import vobject
-from models import Entry, Hours, BlacklistedUser, FollowingUser, UserKey
+from django.db.models import Min
+from models import (Entry, Hours, BlacklistedUser, FollowingUser, UserKey,
+                    ObservedUser, DayOccupancy, YearlyTotal,
+                    summarize_hours, get_logged_hours, get_entry_bounds,
+                    refresh_observed_users)
 from users.models import UserProfile, User
 from users.utils import ldap_lookup
+from users.utils.profile_loader import get_profile_loader
 from .utils import parse_datetime, DatetimeParseError
+from .utils.generations import get_generation, get_generations
 from .utils.countrytotals import UnrecognizedCountryError, get_country_totals
 import utils
 import forms
+import outbox
 from .decorators import json_view
-from .csv_export import UnicodeWriter as CSVUnicodeWriter
+from .csv_export import iter_csv
+from .responses import StreamedHttpResponse
+from .ical import iter_vcalendar
+from .duplicates import find_duplicates
 
 
 def valid_email(value):
@@ -44,6 +54,18 @@ def valid_email(value):
         return False
 
 
+def _details_visibility(request, loader):
+    """return a function that says if the logged in user may see the
+    details of another user's entries"""
+    def can_see_details(user):
+        if request.user.is_superuser:
+            return True
+        if request.user.pk == user.pk:
+            return True
+        return loader.get_manager_id(user) == request.user.pk
+    return can_see_details
+
+
 def handler500(request):
     data = {}
     import sys
@@ -124,17 +146,11 @@ def get_taken_info(user):
             data['unrecognized_country'] = True
 
     today = datetime.date.today()
-    start_date = datetime.date(today.year, 1, 1)
-    last_date = datetime.date(today.year + 1, 1, 1)
-    from django.db.models import Sum
-    qs = Entry.objects.filter(
-      user=user,
-      start__gte=start_date,
-      end__lt=last_date
-    )
-    agg = qs.aggregate(Sum('total_hours'))
-    total_hours = agg['total_hours__sum']
-    if total_hours is None:
+    try:
+        total_hours = (YearlyTotal.objects
+                       .get(user=user, year=today.year)
+                       .hours)
+    except YearlyTotal.DoesNotExist:
         total_hours = 0
     data['taken'] = _friendly_format_hours(total_hours)
 
@@ -158,42 +174,50 @@ def _friendly_format_hours(total_hours):
             return '%s days' % days
 
 
-def get_right_nows():
+def get_right_nows(date=None):
+    """return who is out on this date (default today) and for how many
+    more days"""
     right_now_users = []
     right_nows = defaultdict(list)
-    _today = datetime.date.today()
-
-    for entry in (Entry.objects
-                  .filter(start__lte=_today,
-                          end__gte=_today,
-                          total_hours__gte=0)
-                  .order_by('user__first_name',
-                            'user__last_name',
-                            'user__username')):
-        if entry.user not in right_now_users:
+    if date is None:
+        date = datetime.date.today()
+
+    for occupancy in (DayOccupancy.objects
+                      .filter(date=date)
+                      .select_related('entry__user')
+                      .order_by('user__first_name',
+                                'user__last_name',
+                                'user__username')):
+        entry = occupancy.entry
+        if entry.user not in right_nows:
             right_now_users.append(entry.user)
-        left = (entry.end - _today).days + 1
+        left = (entry.end - date).days + 1
         right_nows[entry.user].append((left, entry))
 
     return right_nows, right_now_users
 
 
-def get_upcomings(max_days=14):
+def get_upcomings(max_days=14, date=None):
+    """return who starts being out within max_days after this date
+    (default today)"""
     users = []
     upcoming = defaultdict(list)
-    today = datetime.date.today()
-    max_future = today + datetime.timedelta(days=max_days)
-
-    for entry in (Entry.objects
-                  .filter(start__gt=today,
-                          start__lt=max_future,
-                          total_hours__gte=0)
-                  .order_by('user__first_name',
-                            'user__last_name',
-                            'user__username')):
-        if entry.user not in users:
+    if date is None:
+        date = datetime.date.today()
+    max_future = date + datetime.timedelta(days=max_days)
+
+    for occupancy in (DayOccupancy.objects
+                      .filter(date__gt=date,
+                              date__lt=max_future,
+                              starts=True)
+                      .select_related('entry__user')
+                      .order_by('user__first_name',
+                                'user__last_name',
+                                'user__username')):
+        entry = occupancy.entry
+        if entry.user not in upcoming:
             users.append(entry.user)
-        days = (entry.start - today).days + 1
+        days = (entry.start - date).days + 1
         upcoming[entry.user].append((days, entry))
 
     return upcoming, users
@@ -208,22 +232,20 @@ def make_entry_title(entry, this_user, include_details=True):
             title = '%s - ' % entry.user.username
     else:
         title = ''
-    days = 0
-    for hour in Hours.objects.filter(entry=entry):
-        if hour.hours == 8:
-            days += 1
-        elif hour.hours == 4:
-            days += 0.5
+    if entry.total_days is None:
+        # not yet summarized when its hours were saved
+        days, has_birthday = summarize_hours(Hours.objects.filter(entry=entry))
+    else:
+        days, has_birthday = entry.total_days, entry.has_birthday
 
     if days > 1:
         if int(days) == days:
             title += '%d days' % days
         else:
             title += '%s days' % days
-        if Hours.objects.filter(entry=entry, birthday=True).exists():
+        if has_birthday:
             title += ' (includes birthday)'
-    elif (days == 1 and entry.total_hours == 0 and
-        Hours.objects.filter(entry=entry, birthday=True)):
+    elif days == 1 and entry.total_hours == 0 and has_birthday:
         title += 'Birthday!'
     elif days == 1 and entry.total_hours == 8:
         title += '1 day'
@@ -243,151 +265,172 @@ def make_entry_title(entry, this_user, include_details=True):
     return title
 
 
-@json_view
-def calendar_events(request):
-    if not request.user.is_authenticated():
-        return http.HttpResponseForbidden('Must be logged in')
+CALENDAR_CACHE_TIMEOUT = 60 * 60 * 24
 
-    if not request.GET.get('start'):
-        return http.HttpResponseBadRequest('Argument start missing')
-    if not request.GET.get('end'):
-        return http.HttpResponseBadRequest('Argument end missing')
+CALENDAR_COLORS = ("#EAA228", "#c5b47f", "#579575", "#839557", "#958c12",
+                   "#953579", "#4b5de4", "#d8b83f", "#ff5800", "#0085cc",
+                   "#c747a3", "#cddf54", "#FBD178", "#26B4E3", "#bd70c7")
 
-    try:
-        start = parse_datetime(request.GET['start'])
-    except DatetimeParseError:
-        return http.HttpResponseBadRequest('Invalid start')
 
-    try:
-        end = parse_datetime(request.GET['end'])
-    except DatetimeParseError:
-        return http.HttpResponseBadRequest('Invalid end')
+def _get_calendar_user_ids(user, visibility_generation):
+    """return the pks of the users whose entries this user sees in the
+    calendar, starting with the user itself"""
+    cache_key = 'calendar_users:%s:%s' % (user.pk, visibility_generation)
+    user_ids = cache.get(cache_key)
+    if user_ids is None:
+        user_ids = [user.pk]
+        user_ids.extend(x.pk for x in get_observed_users(user))
+        cache.set(cache_key, user_ids, CALENDAR_CACHE_TIMEOUT)
+    return user_ids
 
-    entries = []
 
-    COLORS = ("#EAA228", "#c5b47f", "#579575", "#839557", "#958c12",
-              "#953579", "#4b5de4", "#d8b83f", "#ff5800", "#0085cc",
-              "#c747a3", "#cddf54", "#FBD178", "#26B4E3", "#bd70c7")
-    user_ids = [request.user.pk]
-    colors = {}
-    colors_fullnames = []
-    colors[request.user.pk] = None
-    colors_fullnames.append((request.user.pk, 'Me myself and I', '#3366CC'))
-    for i, user_ in enumerate(get_observed_users(request.user, max_depth=2)):
-        user_ids.append(user_.pk)
-
-        colors[user_.pk] = COLORS[i]
-        full_name = user_.get_full_name()
-        if not full_name:
-            full_name = user_.username
-        colors_fullnames.append((
-          user_.pk,
-          full_name,
-          colors[user_.pk]
-        ))
+def _calendar_months(start, end):
+    """yield the first date of every month between start and end"""
+    month = datetime.date(start.year, start.month, 1)
+    while month <= end:
+        yield month
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
 
-    _managers = {}
 
-    def can_see_details(user):
-        if request.user.is_superuser:
-            return True
-        if request.user.pk == user.pk:
-            return True
-        if user.pk not in _managers:
-            _profile = user.get_profile()
-            _manager = None
-            if _profile and _profile.manager_user:
-                _manager = _profile.manager_user.pk
-            _managers[user.pk] = _manager
-        return _managers[user.pk] == request.user.pk
-
-    visible_user_ids = set()
+def _make_calendar_buckets(request, user_ids, months):
+    """return a dict of month and a list of (user pk, event) for every
+    event that overlaps that month"""
+    first = months[0]
+    last = (months[-1] + datetime.timedelta(days=32)).replace(day=1)
+    last -= datetime.timedelta(days=1)
+
+    loader = get_profile_loader(request)
+    loader.prime(user_ids)
+    can_see_details = _details_visibility(request, loader)
+
+    buckets = dict((month, []) for month in months)
     for entry in (Entry.objects
                    .filter(user__in=user_ids,
                            total_hours__gte=0,
                            total_hours__isnull=False)
                    .select_related('user')
-                   .exclude(Q(end__lt=start) | Q(start__gt=end))):
-        visible_user_ids.add(entry.user.pk)
-        entries.append({
+                   .exclude(Q(end__lt=first) | Q(start__gt=last))):
+        event = {
           'id': entry.pk,
           'title': make_entry_title(entry, request.user,
                                   include_details=can_see_details(entry.user)),
           'start': entry.start.strftime('%Y-%m-%d'),
           'end': entry.end.strftime('%Y-%m-%d'),
-          'color': colors[entry.user.pk],
-        })
-
-    colors = [dict(name=x, color=y) for (pk, x, y) in colors_fullnames
-              if pk in visible_user_ids]
-    return {'events': entries, 'colors': colors}
-
-
-def get_minions(user, depth=1, max_depth=2):
-    minions = []
-    for minion in (UserProfile.objects.filter(manager_user=user)
-                   .select_related('manager_user')
-                   .order_by('manager_user')):
-        minions.append(minion.user)
-
-        if depth < max_depth:
-            minions.extend(get_minions(minion.user,
-                                       depth=depth + 1,
-                                       max_depth=max_depth))
-    return minions
-
+        }
+        for month in _calendar_months(max(entry.start, first),
+                                      min(entry.end, last)):
+            if month in buckets:
+                buckets[month].append((entry.user_id, event))
+    return buckets
 
-def get_siblings(user):
-    profile = user.get_profile()
-    if not profile.manager_user:
-        return []
-    users = []
-    for profile in (UserProfile.objects
-                    .filter(manager_user=profile.manager_user)
-                    .exclude(pk=user.pk)
-                    .select_related('user')):
-        users.append(profile.user)
-    return users
 
+@json_view
+def calendar_events(request):
+    if not request.user.is_authenticated():
+        return http.HttpResponseForbidden('Must be logged in')
 
-def get_followed_users(user):
-    users = []
-    for each in (FollowingUser.objects
-                 .filter(follower=user)
-                 .select_related('following')):
-        users.append(each.following)
-    return users
+    if not request.GET.get('start'):
+        return http.HttpResponseBadRequest('Argument start missing')
+    if not request.GET.get('end'):
+        return http.HttpResponseBadRequest('Argument end missing')
 
+    try:
+        start = parse_datetime(request.GET['start'])
+    except DatetimeParseError:
+        return http.HttpResponseBadRequest('Invalid start')
 
-def get_observed_users(this_user, depth=1, max_depth=2):
-    users = []
+    try:
+        end = parse_datetime(request.GET['end'])
+    except DatetimeParseError:
+        return http.HttpResponseBadRequest('Invalid end')
 
-    def is_blacklisted(user):
-        return (BlacklistedUser.objects
-                .filter(observer=this_user, observable=user)
-                .exists())
+    # The events are cached in buckets per user and month. A bucket is
+    # keyed by the generations of everything that went into it so that
+    # any change to them makes it unreachable.
+    visibility_generation = get_generation('visibility', request.user.pk)
+    user_ids = _get_calendar_user_ids(request.user, visibility_generation)
+    entries_generations = get_generations('entries', user_ids)
+    digest = hashlib.md5(repr((
+      sorted(entries_generations.items()),
+      visibility_generation,
+      request.user.is_superuser,
+    ))).hexdigest()
+
+    months = list(_calendar_months(start.date(), end.date()))
+    cache_keys = dict(
+      ('calendar_events:%s:%s:%s' % (request.user.pk,
+                                     month.strftime('%Y%m'),
+                                     digest), month)
+      for month in months
+    )
+    cached = cache.get_many(cache_keys.keys())
+    buckets = dict((cache_keys[key], bucket)
+                   for key, bucket in cached.items())
+    missing = [x for x in months if x not in buckets]
+    if missing:
+        made = _make_calendar_buckets(request, user_ids, missing)
+        buckets.update(made)
+        cache.set_many(
+          dict((key, made[month]) for key, month in cache_keys.items()
+               if month in made),
+          CALENDAR_CACHE_TIMEOUT
+        )
 
-    for user in get_minions(this_user, depth=depth, max_depth=max_depth):
-        if user not in users:
-            if not is_blacklisted(user):
-                users.append(user)
+    colors = {request.user.pk: None}
+    for i, user_id in enumerate(user_ids[1:]):
+        colors[user_id] = CALENDAR_COLORS[i]
+
+    start_str = start.strftime('%Y-%m-%d')
+    end_str = end.strftime('%Y-%m-%d')
+    events = {}
+    for bucket in buckets.values():
+        for user_id, event in bucket:
+            if event['id'] in events:
+                continue
+            if event['end'] < start_str or event['start'] > end_str:
+                continue
+            event = dict(event, color=colors[user_id])
+            events[event['id']] = (user_id, event)
+    entries = [event for __, (user_id, event) in sorted(events.items())]
+
+    visible_user_ids = set(user_id for (user_id, event) in events.values())
+    colors_fullnames = []
+    if request.user.pk in visible_user_ids:
+        colors_fullnames.append(('Me myself and I', '#3366CC'))
+    others = {}
+    other_ids = visible_user_ids - set([request.user.pk])
+    if other_ids:
+        for user_ in (User.objects.filter(pk__in=other_ids)
+                      .only('username', 'first_name', 'last_name')):
+            others[user_.pk] = user_
+    for user_id in user_ids[1:]:
+        if user_id in others:
+            user_ = others[user_id]
+            full_name = user_.get_full_name()
+            if not full_name:
+                full_name = user_.username
+            colors_fullnames.append((full_name, colors[user_id]))
+
+    colors = [dict(name=x, color=y) for (x, y) in colors_fullnames]
+    return {'events': entries, 'colors': colors}
 
-    for user in get_siblings(this_user):
-        if user not in users:
-            if not is_blacklisted(user):
-                users.append(user)
 
-    profile = this_user.get_profile()
-    manager = profile.manager_user
-    if manager and manager not in users:
-        if not is_blacklisted(manager):
-            users.append(manager)
+def get_minions(user, depth=1, max_depth=2):
+    """return everyone reporting to this user down to max_depth levels
+    below, nearest first. The views read ObservedUser instead, this is
+    kept as a thin wrapper over the UserHierarchy closure table."""
+    return list(User.objects
+                .filter(manager_links__ancestor=user,
+                        manager_links__depth__range=(1,
+                                                     max_depth - depth + 1))
+                .order_by('manager_links__depth', 'pk'))
 
-    for user in get_followed_users(this_user):
-        if user not in users:
-            users.append(user)
 
-    return users
+def get_observed_users(this_user):
+    """return the users whose entries this user sees, reports first"""
+    return list(User.objects
+                .filter(observed_by__observer=this_user)
+                .order_by('observed_by__reason', 'pk'))
 
 
 @transaction.commit_on_success
@@ -411,6 +454,8 @@ def notify(request):
             clean_unfinished_entries(entry)
 
             messages.info(request, 'Entry added, now specify hours')
+            if form.overlapping:
+                messages.info(request, describe_overlapping(form.overlapping))
             url = reverse('dates.hours', args=[entry.pk])
             request.session['notify_extra'] = notify
             return redirect(url)
@@ -452,15 +497,21 @@ def cancel_notify(request):
     return redirect(reverse('dates.home'))
 
 
+def describe_overlapping(overlapping):
+    days = ['%s (%dh)' % (date.strftime('%A %d %B %Y'), hours)
+            for date, hours in overlapping]
+    return ('You have already logged PTO on %s. '
+            'The hours you specify will replace it.' % ', '.join(days))
+
+
 def clean_unfinished_entries(good_entry):
     # delete all entries that don't have total_hours and touch on the
     # same dates as this good one
-    bad_entries = (Entry.objects
-                   .filter(user=good_entry.user,
-                           total_hours__isnull=True)
-                   .exclude(pk=good_entry.pk))
-    for entry in bad_entries:
-        entry.delete()
+    (Entry.objects
+     .filter(user=good_entry.user,
+             total_hours__isnull=True)
+     .exclude(pk=good_entry.pk)
+     .delete())
 
 
 @transaction.commit_on_success
@@ -500,13 +551,11 @@ def hours(request, pk):
             return redirect(url)
     else:
         initial = {}
+        logged_hours = get_logged_hours(entry.user, entry.start, entry.end)
         for date in utils.get_weekday_dates(entry.start, entry.end):
-            try:
-                #hours_ = Hours.objects.get(entry=entry, date=date)
-                hours_ = Hours.objects.get(date=date, entry__user=entry.user)
-                initial[date.strftime('d-%Y%m%d')] = hours_.hours
-            except Hours.DoesNotExist:
-                initial[date.strftime('d-%Y%m%d')] = settings.WORK_DAY
+            initial[date.strftime('d-%Y%m%d')] = logged_hours.get(
+              date, settings.WORK_DAY
+            )
 
         form = forms.HoursForm(entry, initial=initial)
     data['form'] = form
@@ -515,12 +564,11 @@ def hours(request, pk):
         data['total_hours'] = entry.total_hours
     else:
         total_hours = 0
+        entry_hours = dict(Hours.objects
+                           .filter(entry=entry)
+                           .values_list('date', 'hours'))
         for date in utils.get_weekday_dates(entry.start, entry.end):
-            try:
-                hours_ = Hours.objects.get(entry=entry, date=date)
-                total_hours += hours_.hours
-            except Hours.DoesNotExist:
-                total_hours += settings.WORK_DAY
+            total_hours += entry_hours.get(date, settings.WORK_DAY)
         data['total_hours'] = total_hours
 
     notify = request.session.get('notify_extra', [])
@@ -529,10 +577,25 @@ def hours(request, pk):
     return render(request, 'dates/hours.html', data)
 
 
+@transaction.commit_on_success
 def save_entry_hours(entry, form):
     assert form.is_valid()
 
     total_hours = 0
+    entry_hours = []
+    reversals = []
+    # straight from the database since the reversals depend on it
+    logged_hours = get_logged_hours(entry.user, entry.start, entry.end,
+                                    use_cache=False)
+    logged_details = {}
+    if any(logged_hours.values()):
+        # the details of the latest entry on each date
+        logged_details = dict(Hours.objects
+                              .filter(user=entry.user,
+                                      date__in=logged_hours.keys(),
+                                      hours__gt=0)
+                              .order_by('pk')
+                              .values_list('date', 'entry__details'))
     for date in utils.get_weekday_dates(entry.start, entry.end):
         hours = int(form.cleaned_data[date.strftime('d-%Y%m%d')])
         birthday = False
@@ -540,47 +603,55 @@ def save_entry_hours(entry, form):
             birthday = True
             hours = 0
         assert hours >= 0 and hours <= settings.WORK_DAY, hours
-        try:
-            hours_ = Hours.objects.get(entry__user=entry.user,
-                                       date=date)
-            if hours_.hours:
-                # this nullifies the previous entry on this date
-                reverse_entry = Entry.objects.create(
-                  user=hours_.entry.user,
-                  start=date,
-                  end=date,
-                  details=hours_.entry.details,
-                  total_hours=hours_.hours * -1,
-                )
-                Hours.objects.create(
-                  entry=reverse_entry,
-                  hours=hours_.hours * -1,
-                  date=date,
-                )
-            #hours_.hours = hours  # nasty stuff!
-            #hours_.birthday = birthday
-            #hours_.save()
-        except Hours.DoesNotExist:
-            # nothing to credit
-            pass
-        Hours.objects.create(
+        if logged_hours.get(date):
+            # this nullifies the previous entries on this date
+            reversals.append((date, logged_hours[date] * -1))
+        entry_hours.append(Hours(
           entry=entry,
+          user=entry.user,
           hours=hours,
           date=date,
           birthday=birthday,
-        )
+        ))
         total_hours += hours
+
+    if reversals:
+        # One at a time since bulk_create doesn't give them primary keys
+        # and nothing else tells them apart from the reversals of another
+        # save of the same dates in the same second. There are only ever
+        # a few, one per day already logged.
+        reverse_entries = {}
+        for date, hours in reversals:
+            reverse_entries[date] = Entry.objects.create(
+              user=entry.user,
+              start=date,
+              end=date,
+              details=logged_details.get(date, ''),
+              total_hours=hours,
+            )
+        Hours.objects.bulk_create([
+          Hours(entry=reverse_entries[date], user=entry.user,
+                hours=hours, date=date)
+          for date, hours in reversals
+        ])
+    Hours.objects.bulk_create(entry_hours)
     #raise NotImplementedError
 
+    # No signals are sent for the rows created in bulk. Everything they
+    # would update is worked out again on saving the entry they are
+    # all inside of.
     is_edit = entry.total_hours is not None
     #if entry.total_hours is not None:
     entry.total_hours = total_hours
+    entry.total_days, entry.has_birthday = summarize_hours(entry_hours)
     entry.save()
 
     return total_hours, is_edit
 
 
 def send_email_notification(entry, extra_users, is_edit=False):
+    """return (success, email addresses). With settings.EMAIL_OUTBOX the
+    message is only put in the outbox and success means it was queued."""
     email_addresses = []
     for profile in (UserProfile.objects
                      .filter(hr_manager=True,
@@ -598,6 +669,10 @@ def send_email_notification(entry, extra_users, is_edit=False):
     email_addresses = list(set(email_addresses))  # get rid of dupes
     if not email_addresses:
         email_addresses = [settings.FALLBACK_TO_ADDRESS]
+    if (is_edit and settings.EMAIL_OUTBOX and
+        outbox.has_pending_notification(entry)):
+        # nobody has been told about it yet
+        is_edit = False
     if is_edit:
         subject = settings.EMAIL_SUBJECT_EDIT
     else:
@@ -618,6 +693,18 @@ def send_email_notification(entry, extra_users, is_edit=False):
       'start_date': entry.start.strftime(settings.DEFAULT_DATE_FORMAT),
     }
     body = template.render(Context(context)).strip()
+    if settings.EMAIL_OUTBOX:
+        outbox.enqueue_notification(
+          entry,
+          subject=subject,
+          body=body,
+          from_email=entry.user.email,
+          to=email_addresses,
+          cc=entry.user.email and [entry.user.email] or None,
+          is_edit=is_edit,
+        )
+        return True, email_addresses
+
     connection = get_connection()
     message = EmailMessage(
       subject=subject,
@@ -644,9 +731,12 @@ def emails_sent(request, pk):
     if isinstance(emails, basestring):
         emails = [emails]
     data['emails'] = emails
+    data['queued'] = (settings.EMAIL_OUTBOX and
+                      outbox.has_unsent_messages(entry))
     data['emailed_users'] = []
+    records = ldap_lookup.fetch_user_details_many(emails)
     for email in emails:
-        record = ldap_lookup.fetch_user_details(email)
+        record = records[email]
         if record:
             data['emailed_users'].append(record)
         else:
@@ -665,15 +755,13 @@ def list_(request):
         data['filters'] = form.cleaned_data
 
     data['today'] = datetime.date.today()
-    entries_base = Entry.objects.all()
 
-    try:
-        data['first_date'] = entries_base.order_by('start')[0].start
-        data['last_date'] = entries_base.order_by('-end')[0].end
-        data['first_filed_date'] = (entries_base
-                                    .order_by('add_date')[0]
-                                    .add_date)
-    except IndexError:
+    first_date, last_date, first_filed_date = get_entry_bounds()
+    if first_date is not None:
+        data['first_date'] = first_date
+        data['last_date'] = last_date
+        data['first_filed_date'] = first_filed_date
+    else:
         # first run, not so important
         data['first_date'] = datetime.date(2000, 1, 1)
         data['last_date'] = datetime.date(2000, 1, 1)
@@ -684,12 +772,22 @@ def list_(request):
     return render(request, 'dates/list.html', data)
 
 
+CSV_CHUNK_SIZE = 500  # entries fetched per query when exporting
+
+
 @login_required
 def list_csv(request):
     entries = get_entries_from_request(request.GET)
-    response = http.HttpResponse(mimetype='text/csv')
-    writer = CSVUnicodeWriter(response)
-    writer.writerow((
+    # the rows are generated as the response is being sent, in the order
+    # the entries were added (by primary key) which is what the chunks
+    # are fetched in
+    loader = get_profile_loader(request)
+    return StreamedHttpResponse(iter_csv(_list_csv_rows(entries, loader)),
+                                mimetype='text/csv')
+
+
+def _list_csv_rows(entries, loader):
+    yield (
       'ID',
       'EMAIL',
       'FIRST NAME',
@@ -702,58 +800,38 @@ def list_csv(request):
       'CITY',
       'COUNTRY',
       'START DATE',
-    ))
-
-    profiles = {}  # basic memoization
-    for entry in entries:
-        if entry.user.pk not in profiles:
-            profiles[entry.user.pk] = entry.user.get_profile()
-        profile = profiles[entry.user.pk]
-        writer.writerow((
-          str(entry.pk),
-          entry.user.email,
-          entry.user.first_name,
-          entry.user.last_name,
-          entry.add_date.strftime('%Y-%m-%d'),
-          entry.start.strftime('%Y-%m-%d'),
-          entry.end.strftime('%Y-%m-%d'),
-          str(entry.total_hours),
-          entry.details,
-          profile.city,
-          profile.country,
-          (profile.start_date and
-           profile.start_date.strftime('%Y-%m-%d') or ''),
-        ))
+    )
 
-    return response
+    for chunk in utils.chunked_queryset(entries, CSV_CHUNK_SIZE):
+        loader.prime(entry.user_id for entry in chunk)
+        for entry in chunk:
+            profile = loader.load(entry.user)
+            yield (
+              str(entry.pk),
+              entry.user.email,
+              entry.user.first_name,
+              entry.user.last_name,
+              entry.add_date.strftime('%Y-%m-%d'),
+              entry.start.strftime('%Y-%m-%d'),
+              entry.end.strftime('%Y-%m-%d'),
+              str(entry.total_hours),
+              entry.details,
+              profile.city,
+              profile.country,
+              (profile.start_date and
+               profile.start_date.strftime('%Y-%m-%d') or ''),
+            )
 
 
 @json_view
 @login_required
 def list_json(request):
     entries = get_entries_from_request(request.GET)
+    loader = get_profile_loader(request)
+    can_see_details = _details_visibility(request, loader)
 
-    _managers = {}
-
-    def can_see_details(user):
-        if request.user.is_superuser:
-            return True
-        if request.user.pk == user.pk:
-            return True
-        if user.pk not in _managers:
-            _profile = user.get_profile()
-            _manager = None
-            if _profile and _profile.manager_user:
-                _manager = _profile.manager_user.pk
-            _managers[user.pk] = _manager
-        return _managers[user.pk] == request.user.pk
-
-    data = []
-    profiles = {}
-    for entry in entries:
-        if entry.user.pk not in profiles:
-            profiles[entry.user.pk] = entry.user.get_profile()
-        profile = profiles[entry.user.pk]
+    def make_row(entry):
+        profile = loader.load(entry.user)
         if entry.total_hours < 0:
             details = '*automatic edit*'
         elif can_see_details(entry.user):
@@ -761,24 +839,173 @@ def list_json(request):
         else:
             details = ''
 
-        row = [entry.user.email,
-               entry.user.first_name,
-               entry.user.last_name,
-               entry.add_date.strftime('%Y-%m-%d'),
-               entry.total_hours,
-               entry.start.strftime('%Y-%m-%d'),
-               entry.end.strftime('%Y-%m-%d'),
-               profile.city,
-               profile.country,
-               details,
-               #edit_link,
-               #hours_link
-               ]
-        data.append(row)
+        return [entry.user.email,
+                entry.user.first_name,
+                entry.user.last_name,
+                entry.add_date.strftime('%Y-%m-%d'),
+                entry.total_hours,
+                entry.start.strftime('%Y-%m-%d'),
+                entry.end.strftime('%Y-%m-%d'),
+                profile.city,
+                profile.country,
+                details,
+                #edit_link,
+                #hours_link
+                ]
+
+    if 'sEcho' in request.GET:
+        # DataTables is in server-side mode (bServerSide)
+        return _list_json_page(request.GET, entries, make_row, loader)
+
+    entries = list(entries)
+    loader.prime(entry.user_id for entry in entries)
+    data = []
+    for entry in entries:
+        data.append(make_row(entry))
 
     return {'aaData': data}
 
 
+# The columns of the list table that can be sorted on the server and what
+# they sort by. City, country and details live elsewhere and are not sortable.
+LIST_JSON_SORT_COLUMNS = {
+  0: 'user__email',
+  1: 'user__first_name',
+  2: 'user__last_name',
+  3: 'add_date',
+  4: 'total_hours',
+  5: 'start',
+  6: 'end',
+}
+# Indexed columns on Entry for which the next page can be found by seeking
+# past the last row of the previous one instead of an ever growing OFFSET.
+LIST_JSON_KEYSET_COLUMNS = ('add_date', 'start', 'end')
+LIST_JSON_MAX_LENGTH = 500
+
+
+def _list_json_page(params, entries, make_row, loader):
+    try:
+        echo = int(params['sEcho'])
+        offset = max(0, int(params.get('iDisplayStart', 0)))
+        length = int(params.get('iDisplayLength', 10))
+        sort_column = int(params.get('iSortCol_0', 5))
+    except ValueError:
+        return http.HttpResponseBadRequest('Invalid paging parameters')
+    if length <= 0 or length > LIST_JSON_MAX_LENGTH:
+        # DataTables sends -1 when it wants everything
+        length = LIST_JSON_MAX_LENGTH
+    sort_field = LIST_JSON_SORT_COLUMNS.get(sort_column, 'start')
+    descending = params.get('sSortDir_0') == 'desc'
+
+    total_records = entries.count()
+    search = params.get('sSearch', '').strip()
+    if search:
+        entries = entries.filter(_list_json_search(search))
+        total_display_records = entries.count()
+    else:
+        total_display_records = total_records
+
+    prefix = descending and '-' or ''
+    entries = entries.order_by(prefix + sort_field, prefix + 'pk')
+    cursor = None
+    filters = _list_json_filters(params)
+    if sort_field in LIST_JSON_KEYSET_COLUMNS:
+        cursor = _parse_list_json_cursor(params.get('sCursor'), filters,
+                                         sort_field, descending, offset)
+    if cursor:
+        value, pk = cursor
+        operator = descending and 'lt' or 'gt'
+        entries = entries.filter(
+          Q(**{'%s__%s' % (sort_field, operator): value}) |
+          Q(**{sort_field: value, 'pk__%s' % operator: pk})
+        )
+        page = list(entries[:length])
+    else:
+        page = list(entries[offset:offset + length])
+    loader.prime(entry.user_id for entry in page)
+
+    data = {
+      'sEcho': echo,
+      'iTotalRecords': total_records,
+      'iTotalDisplayRecords': total_display_records,
+      'aaData': [make_row(entry) for entry in page],
+    }
+    if page and sort_field in LIST_JSON_KEYSET_COLUMNS:
+        data['sCursor'] = _make_list_json_cursor(page[-1], filters,
+                                                 sort_field, descending,
+                                                 offset + len(page))
+    return data
+
+
+def _list_json_search(search):
+    """return the Q for the search box of the list table. It matches the
+    start of the email, names, city or country and a YYYY-MM-DD date
+    within the entry or the day it was filed. The details aren't
+    searched since not everyone gets to see them."""
+    _users = (UserProfile.objects
+              .filter(Q(city__istartswith=search) |
+                      Q(country__istartswith=search))
+              .values('user_id'))
+    q = (Q(user__email__istartswith=search) |
+         Q(user__first_name__istartswith=search) |
+         Q(user__last_name__istartswith=search) |
+         Q(user__id__in=_users))
+    try:
+        date = datetime.datetime.strptime(search, '%Y-%m-%d').date()
+    except ValueError:
+        return q
+    return (q |
+            Q(start__lte=date, end__gte=date) |
+            Q(add_date__gte=date,
+              add_date__lt=date + datetime.timedelta(days=1)))
+
+
+def _list_json_filters(params):
+    """return a short digest of everything that decides which rows there
+    are so a cursor can't be used with other filters than it was made
+    with"""
+    names = sorted(forms.ListFilterForm.base_fields) + ['sSearch']
+    return hashlib.md5(repr([
+      (name, params.get(name, '').strip()) for name in names
+    ])).hexdigest()[:12]
+
+
+def _make_list_json_cursor(entry, filters, sort_field, descending,
+                           next_offset):
+    """return a string that points just past this entry in the current
+    sort order. It's only valid for fetching the page at `next_offset`
+    with the same filters."""
+    value = getattr(entry, sort_field)
+    if isinstance(value, datetime.datetime):
+        value = value.strftime('%Y-%m-%dT%H:%M:%S.%f')
+    else:
+        value = value.strftime('%Y-%m-%d')
+    return '|'.join([filters, sort_field, descending and 'desc' or 'asc',
+                     str(next_offset), value, str(entry.pk)])
+
+
+def _parse_list_json_cursor(cursor, filters, sort_field, descending, offset):
+    """return (value, pk) if the cursor was made for these exact filters,
+    sort order and page or else None."""
+    if not cursor:
+        return None
+    try:
+        (cursor_filters, field, direction,
+         next_offset, value, pk) = cursor.split('|')
+        if (cursor_filters != filters
+            or field != sort_field
+            or direction != (descending and 'desc' or 'asc')
+            or int(next_offset) != offset):
+            return None
+        if 'T' in value:
+            value = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+        else:
+            value = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        return value, int(pk)
+    except ValueError:
+        return None
+
+
 def get_entries_from_request(data):
     form = forms.ListFilterForm(date_format='%d %B %Y', data=data)
 
@@ -819,25 +1046,11 @@ def get_entries_from_request(data):
 @login_required
 def following(request):
     data = {}
-    observed = []
-    _followed = get_followed_users(request.user)
-    _minions_1 = get_minions(request.user, depth=1, max_depth=1)
-    _minions_2 = get_minions(request.user, depth=1, max_depth=2)
-    _manager = request.user.get_profile().manager_user
-    for user in sorted(get_observed_users(request.user, max_depth=2),
-                       lambda x, y: cmp(x.first_name.lower(),
-                                        y.first_name.lower())):
-        if user in _minions_1:
-            reason = 'direct manager of'
-        elif user in _minions_2:
-            reason = 'indirect manager of'
-        elif user == _manager:
-            reason = 'your manager'
-        elif user in _followed:
-            reason = 'curious'
-        else:
-            reason = 'teammate'
-        observed.append((user, reason))
+    observed = [(x.observable, x.get_reason_display()) for x in
+                (ObservedUser.objects
+                 .filter(observer=request.user)
+                 .select_related('observable'))]
+    observed.sort(key=lambda x: x[0].first_name.lower())
     not_observed = (BlacklistedUser.objects
                     .filter(observer=request.user)
                     .order_by('observable__first_name'))
@@ -898,19 +1111,17 @@ def save_following(request):
     )
 
     # find a reason why we're following this user
-    _minions_1 = get_minions(request.user, depth=1, max_depth=1)
-    _minions_2 = get_minions(request.user, depth=1, max_depth=2)
-    if user in _minions_1:
-        reason = 'direct manager of'
-    elif user in _minions_2:
-        reason = 'indirect manager of'
-    elif user == request.user.get_profile().manager_user:
-        reason = 'your manager'
-    elif (request.user.get_profile().manager_user
-          and user in _minions_1):
-        reason = 'teammate'
-    else:
-        reason = 'curious'
+    def get_reason():
+        for observed in (ObservedUser.objects
+                         .filter(observer=request.user, observable=user)):
+            return observed.get_reason_display()
+
+    reason = get_reason()
+    if reason is None:
+        # rebuild_org_hierarchy hasn't filled in this user yet
+        refresh_observed_users(request.user.pk)
+        reason = (get_reason() or
+                  dict(ObservedUser.REASONS)[ObservedUser.CURIOUS])
 
     name = ('%s %s' % (user.first_name,
                        user.last_name)).strip()
@@ -942,7 +1153,9 @@ def save_unfollowing(request):
         f.delete()
 
     data = {}
-    if user in get_observed_users(request.user, max_depth=2):
+    if (ObservedUser.objects
+        .filter(observer=request.user, observable=user)
+        .exists()):
         # if not blacklisted, this user will automatically re-appear
         BlacklistedUser.objects.get_or_create(
           observer=request.user,
@@ -958,38 +1171,83 @@ def save_unfollowing(request):
     return data
 
 
+# how long calendar clients may hold on to a feed before asking again
+CALENDAR_VCAL_MAX_AGE = 60 * 5
+
+
+def _calendar_vcal_validators(request, key):
+    """return the ETag and Last-Modified of the calendar of this key
+    without building it, or (None, None) if the key isn't known"""
+    if not hasattr(request, '_calendar_vcal_validators'):
+        etag = last_modified = None
+        try:
+            user = UserKey.objects.select_related('user').get(key=key).user
+        except UserKey.DoesNotExist:
+            pass
+        else:
+            visibility_generation = get_generation('visibility', user.pk)
+            user_ids = _get_calendar_user_ids(user, visibility_generation)
+            etag = hashlib.md5(repr((
+              key,
+              request.get_host(),
+              request.is_secure(),
+              datetime.date.today(),
+              visibility_generation,
+              sorted(get_generations('entries', user_ids).items()),
+            ))).hexdigest()
+            # deleted entries can't be seen in any modify_date so the
+            # time the ETag was first seen is used instead
+            cache_key = 'calendar_vcal_modified:%s' % etag
+            last_modified = cache.get(cache_key)
+            if last_modified is None:
+                last_modified = (datetime.datetime.utcnow()
+                                 .replace(microsecond=0))
+                cache.set(cache_key, last_modified, CALENDAR_CACHE_TIMEOUT)
+        request._calendar_vcal_validators = etag, last_modified
+    return request._calendar_vcal_validators
+
+
+def _calendar_vcal_etag(request, key):
+    return _calendar_vcal_validators(request, key)[0]
+
+
+def _calendar_vcal_last_modified(request, key):
+    return _calendar_vcal_validators(request, key)[1]
+
+
+@cache_control(private=True, max_age=CALENDAR_VCAL_MAX_AGE)
+@condition(etag_func=_calendar_vcal_etag,
+           last_modified_func=_calendar_vcal_last_modified)
 def calendar_vcal(request, key):
     base_url = '%s://%s' % (request.is_secure() and 'https' or 'http',
                             RequestSite(request).domain)
     home_url = base_url + '/'
-    cal = vobject.iCalendar()
-    cal.add('x-wr-calname').value = 'Mozilla PTO'
 
     try:
         user = UserKey.objects.get(key=key).user
     except UserKey.DoesNotExist:
         # instead of raising a HTTP error, respond a calendar
         # that urges the user to update the stale URL
-        event = cal.add('vevent')
-        event.add('summary').value = (
-          "Calendar expired. Visit %s#calendarurl to get the "
-          "new calendar URL" % home_url
-        )
         today = datetime.date.today()
-        event.add('dtstart').value = today
-        event.add('dtend').value = today
-        event.add('url').value = '%s#calendarurl' % (home_url,)
-        event.add('description').value = ("The calendar you used has expired "
-        "and is no longer associated with any user")
-        return _render_vcalendar(cal, key)
+        event = {
+          'summary': (
+            "Calendar expired. Visit %s#calendarurl to get the "
+            "new calendar URL" % home_url
+          ),
+          'start': today,
+          'end': today,
+          'url': '%s#calendarurl' % (home_url,),
+          'description': ("The calendar you used has expired "
+                          "and is no longer associated with any user"),
+        }
+        return _render_vcalendar([event], key)
 
     # always start on the first of this month
     today = datetime.date.today()
     #first = datetime.date(today.year, today.month, 1)
 
-    user_ids = [user.pk]
-    for user_ in get_observed_users(user, max_depth=2):
-        user_ids.append(user_.pk)
+    user_ids = _get_calendar_user_ids(user,
+                                      get_generation('visibility', user.pk))
 
     entries = (Entry.objects
                .filter(user__in=user_ids,
@@ -1011,28 +1269,31 @@ def calendar_vcal(request, key):
           'name': name
         }
         return _list_base_url + '?' + urlencode(data, True)
-    for entry in entries:
-        event = cal.add('vevent')
-        event.add('summary').value = '%s PTO' % make_entry_title(entry, user,
-                                                include_details=False)
-        event.add('dtstart').value = entry.start
-        event.add('dtend').value = entry.end
-        #url = (home_url + '?cal_y=%d&cal_m=%d' %
-        #       (slot.date.year, slot.date.month))
-        event.add('url').value = make_list_url(entry)
-        #event.add('description').value = entry.details
-        event.add('description').value = "Log in to see the details"
-
-    return _render_vcalendar(cal, key)
-
-
-def _render_vcalendar(cal, key):
-    #return http.HttpResponse(cal.serialize(),
+
+    def make_events():
+        for entry in entries.iterator():
+            yield {
+              'summary': '%s PTO' % make_entry_title(entry, user,
+                                                     include_details=False),
+              'start': entry.start,
+              'end': entry.end,
+              #url = (home_url + '?cal_y=%d&cal_m=%d' %
+              #       (slot.date.year, slot.date.month))
+              'url': make_list_url(entry),
+              #'description': entry.details
+              'description': "Log in to see the details",
+            }
+
+    return _render_vcalendar(make_events(), key)
+
+
+def _render_vcalendar(events, key):
+    #return http.HttpResponse(iter_vcalendar(events, 'Mozilla PTO'),
     #                         mimetype='text/plain;charset=utf-8'
     #                         )
-    resp = http.HttpResponse(cal.serialize(),
-                             mimetype='text/calendar;charset=utf-8'
-                             )
+    resp = StreamedHttpResponse(iter_vcalendar(events, 'Mozilla PTO'),
+                                mimetype='text/calendar;charset=utf-8'
+                                )
     filename = '%s.ics' % (key,)
     resp['Content-Disposition'] = 'inline; filename="%s"' % filename
     return resp
@@ -1047,62 +1308,69 @@ def reset_calendar_url(request):
 
 
 @login_required
+@transaction.commit_on_success
 def duplicate_report(request):
     data = {
       'filter_errors': None,
     }
+    can_delete = request.user.is_superuser or request.user.is_staff
 
     if request.method == 'POST':
-        raise NotImplementedError
+        if not can_delete:
+            return http.HttpResponseForbidden("Only available for admins")
+        # the filters of the report the entries were picked from
+        query_string = request.POST.get('query_string', '')
+        filters = http.QueryDict(query_string)
     else:
-        form = forms.DuplicateReportFilterForm(date_format='%d %B %Y',
-                                               data=request.GET)
-        user = request.user
-        filter_ = dict(user=user)
+        query_string = request.META.get('QUERY_STRING', '')
+        filters = request.GET
 
-        if form.is_valid():
-            if form.cleaned_data['user']:
-                user = form.cleaned_data['user']
-                if user != request.user:
-                    if not (request.user.is_superuser
-                            or request.user.is_staff):
-                        if user != request.user:
-                            return http.HttpResponse(
-                                                 "Only available for admins")
-                filter_['user'] = user
-
-            if form.cleaned_data['since']:
-                filter_['start__gte'] = form.cleaned_data['since']
-                data['since'] = form.cleaned_data['since']
-        else:
-            data['filter_errors'] = form.errors
-
-        data['first_date'] = (Entry.objects
-                              .filter(user=user)
-                              .aggregate(Min('start'))
-                              ['start__min'])
-
-        start_dates = (Entry.objects
-                       .filter(**filter_)
-                       .values("start")
-                       .annotate(Count("start"))
-                       .order_by('-start__count'))
-        groups = []
-        for each in start_dates:
-            if each['start__count'] <= 1:
-                break
-            entries = Entry.objects.filter(user=user, start=each['start'])
-            details = [x.details for x in entries]
-            note = "Probably not a mistake"
-            if len(set(details)) == 1:
-                note = ("Probably a duplicate! "
-                        "The details are the same for each entry")
-            else:
-                note = "Possibly not a duplicate since the details different"
-            groups.append((entries, note))
-        data['groups'] = groups
+    form = forms.DuplicateReportFilterForm(date_format='%d %B %Y',
+                                           data=filters)
+    user = request.user
+    since = None
+    if form.is_valid():
+        if form.cleaned_data['user']:
+            user = form.cleaned_data['user']
+            if user != request.user and not can_delete:
+                return http.HttpResponse("Only available for admins")
+        if form.cleaned_data['since']:
+            since = data['since'] = form.cleaned_data['since']
+    else:
+        data['filter_errors'] = form.errors
 
-        if 'since' not in data:
-            data['since'] = data['first_date']
+    report = find_duplicates(user=user, since=since)
+
+    if request.method == 'POST':
+        # only what's in the report can be deleted from it
+        reported = {}
+        for entries, note in report.duplicates:
+            reported.update((x.pk, x) for x in entries)
+        for earlier, later in report.overlaps:
+            reported.update([(earlier.pk, earlier), (later.pk, later)])
+        ids = set(int(x) for x in request.POST.getlist('delete')
+                  if x.isdigit())
+        # deleted one at a time for the signals
+        for pk in sorted(ids & set(reported)):
+            reported[pk].delete()
+        url = reverse('dates.duplicate_report')
+        if query_string:
+            url += '?' + query_string
+        return redirect(url)
+
+    data['first_date'] = (Entry.objects
+                          .filter(user=user)
+                          .aggregate(Min('start'))
+                          ['start__min'])
+
+    data['groups'] = report.duplicates
+    data['overlaps'] = report.overlaps
+    data['double_booked'] = [(date, hours) for user_id, date, hours
+                             in report.double_booked]
+    data['can_delete'] = can_delete
+    data['query_string'] = query_string
+
+    if 'since' not in data:
+        data['since'] = data['first_date']
 
     return render(request, 'dates/duplicate-report.html', data)
@@ -10,8 +10,9 @@ from django.core.management.base import NoArgsCommand
 from django.contrib.auth.models import User
 from django.db import transaction
 from legacy.models import Pto
-from dates.models import Entry, Hours
+from dates.models import Entry, Hours, summarize_hours
 from dates.utils import parse_datetime, get_weekday_dates
+from dates.utils.generations import bump_generation
 
 class Command(NoArgsCommand):
     help = """
@@ -89,23 +90,28 @@ class Command(NoArgsCommand):
                     self._report_broken(pto)
                     continue
             #print hours, hours_daily
+            entry_hours = [Hours(hours=t, date=d)
+                           for d, t in hours_daily.items()]
+            total_days, has_birthday = summarize_hours(entry_hours)
             # go ahead and add it
             entry = Entry.objects.create(
               user=user,
               start=start,
               end=end,
               total_hours=hours,
+              total_days=total_days,
+              has_birthday=has_birthday,
               details=pto.details.strip(),
               add_date=added,
               modify_date=added,
             )
 
-            for d, t in hours_daily.items():
-                Hours.objects.create(
-                  entry=entry,
-                  hours=t,
-                  date=d,
-                )
+            for hours_ in entry_hours:
+                hours_.entry = entry
+                hours_.user = user
+            Hours.objects.bulk_create(entry_hours)
+            # bulk_create sends no signals to do this
+            bump_generation('entries', user.pk)
 
             pto.delete()
             count += 1
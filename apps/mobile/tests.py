@@ -224,6 +224,7 @@ class MobileViewsTest(TestCase, ViewsTestMixin):
         response = self.client.post(url, data)
         struct = json.loads(response.content)
         ok_(struct['entry'])
+        ok_('overlapping' not in struct)
         entry = Entry.objects.get(pk=struct['entry'])
         eq_(entry.start, today)
         eq_(entry.end, today + datetime.timedelta(days=1))
@@ -233,6 +234,19 @@ class MobileViewsTest(TestCase, ViewsTestMixin):
         ok_(Entry.objects.get(details='Finished'))
         ok_(not Entry.objects.filter(details='Unfinished').count())
 
+        # PTO already logged on these days is pointed out
+        monday = datetime.date(2011, 7, 25)
+        finished = Entry.objects.create(user=user, start=monday, end=monday,
+                                        total_hours=8)
+        Hours.objects.create(entry=finished, date=monday, hours=8)
+        response = self.client.post(url, {
+          'start': monday,
+          'end': monday + datetime.timedelta(days=1),
+        })
+        struct = json.loads(response.content)
+        ok_(struct['entry'])
+        ok_('Monday 25 July 2011 (8h)' in struct['overlapping'])
+
     def test_save_hours(self):
         url = reverse('mobile.save_hours')
         response = self.client.get(url)
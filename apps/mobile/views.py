@@ -11,7 +11,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.shortcuts import redirect, get_object_or_404, render
 from django.contrib.auth import login as auth_login, logout as auth_logout
-from dates.models import Entry, Hours
+from dates.models import Entry, get_logged_hours
 from dates.decorators import json_view
 from dates.utils import get_weekday_dates
 from users.forms import ProfileForm
@@ -106,7 +106,7 @@ def notify(request):
     if not request.user.is_authenticated():  # XXX improve this
         return {'error': 'Not logged in'}
     from dates.forms import AddForm
-    from dates.views import clean_unfinished_entries
+    from dates.views import clean_unfinished_entries, describe_overlapping
     form = AddForm(request.user, data=request.POST)
     if form.is_valid():
         start = form.cleaned_data['start']
@@ -122,7 +122,10 @@ def notify(request):
         )
         clean_unfinished_entries(entry)
         request.session['notify_extra'] = notify
-        return {'entry': entry.pk}
+        data = {'entry': entry.pk}
+        if form.overlapping:
+            data['overlapping'] = describe_overlapping(form.overlapping)
+        return data
     else:
         return {'form_errors': form.errors}
 
@@ -172,18 +175,12 @@ def hours_json(request):
         return http.HttpResponseForbidden("Not your entry")
     days = []
 
+    logged_hours = get_logged_hours(entry.user, entry.start, entry.end)
     for date in get_weekday_dates(entry.start, entry.end):
         key = date.strftime('d-%Y%m%d')
-        try:
-            hours_ = Hours.objects.get(
-              date=date,
-              entry__user=entry.user,
-              hours__gt=0,
-            )
-            #initial[date.strftime('d-%Y%m%d')] = hours_.hours
-            value = hours_.hours
-        except Hours.DoesNotExist:
-            #initial[date.strftime('d-%Y%m%d')] = settings.WORK_DAY
+        if logged_hours.get(date, 0) > 0:
+            value = logged_hours[date]
+        else:
             value = settings.WORK_DAY
         days.append({'key': key,
                      'value': value,
@@ -7,6 +7,7 @@ import django.contrib.auth.forms
 from .models import UserProfile
 from dates.forms import BaseModelForm
 from lib.country_aliases import ALIASES as COUNTRY_ALIASES
+from .utils.country_catalog import get_country_choices
 
 
 class EmailInput(forms.widgets.Input):
@@ -40,26 +41,7 @@ class ProfileForm(BaseModelForm):
     def __init__(self, *args, **kwargs):
         super(ProfileForm, self).__init__(*args, **kwargs)
 
-        country_choices = []
-        _all_longforms = []
-        for each in (UserProfile.objects.exclude(country='')
-                     .values('country')
-                     .distinct('country')
-                     .order_by('country')):
-            country = each['country']
-            long_form = country
-            if long_form in COUNTRY_ALIASES.values():
-                long_form = [k for (k, v) in COUNTRY_ALIASES.items()
-                             if v == country][0]
-            _all_longforms.append(long_form)
-            country_choices.append((country, long_form))
-        for alias, country in COUNTRY_ALIASES.items():
-            if alias not in _all_longforms:
-                _all_longforms.append(alias)
-                country_choices.append((country, alias))
-
-        country_choices.sort(lambda x, y: cmp(x[1], y[1]))
-        self.fields['country'].choices = country_choices
+        self.fields['country'].choices = get_country_choices()
 
     def clean_country(self):  # pragma: no cover
         # this method doesn't do much since we're using a ChoiceField
@@ -0,0 +1,60 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import random
+import string
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from users.utils.people_index import PeopleIndex
+
+
+class Command(NoArgsCommand):
+    help = """
+    Times building a people index of made up people and searching it for
+    prefixes of their names.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--people', default=20000, type='int',
+                                    help="People in the index "
+                                         "(default 20000)"),
+                        make_option('--searches', default=5000, type='int',
+                                    help="Prefixes searched for "
+                                         "(default 5000)"),
+    )
+
+    def handle_noargs(self, **options):
+        random.seed(0)
+
+        def word():
+            return ''.join(random.choice(string.ascii_lowercase)
+                           for i in range(random.randint(3, 10))).title()
+
+        people = []
+        for i in range(options['people']):
+            given_name, sn = word(), word()
+            uid = (given_name[0] + sn).lower()
+            people.append({'uid': uid, 'mail': u'%s@mozilla.com' % uid,
+                           'givenName': given_name, 'sn': sn,
+                           'cn': u'%s %s' % (given_name, sn)})
+        t0 = time.time()
+        index = PeopleIndex(people, [x['mail'] for x in people[::10]])
+        print "Built in %.1f ms" % ((time.time() - t0) * 1000)
+
+        timings = []
+        for i in range(options['searches']):
+            person = random.choice(people)
+            name = random.choice((person['givenName'], person['sn'],
+                                  person['mail'], person['cn']))
+            query = name[:random.randint(1, len(name))]
+            known_only = not i % 2
+            t0 = time.time()
+            index.search(query, 30, known_only=known_only)
+            timings.append(time.time() - t0)
+        timings.sort()
+        for label, at in (('p50', 0.5), ('p99', 0.99), ('max', 1)):
+            timing = timings[min(int(len(timings) * at), len(timings) - 1)]
+            print "%s %8.3f ms" % (label, timing * 1000)
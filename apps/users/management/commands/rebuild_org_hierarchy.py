@@ -0,0 +1,61 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from users.models import UserProfile, UserHierarchy, org_hierarchy_changed
+
+
+class Command(NoArgsCommand):
+    help = """
+    Rebuilds the org hierarchy table from the managers of all user
+    profiles.
+    """
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        managers = dict(UserProfile.objects
+                        .filter(manager_user__isnull=False)
+                        .values_list('user_id', 'manager_user_id'))
+
+        loops = self._break_loops(managers)
+
+        UserHierarchy.objects.all().delete()
+        batch = []
+        for user_id in managers:
+            depth = 1
+            manager_id = managers[user_id]
+            while manager_id is not None:
+                batch.append(UserHierarchy(ancestor_id=manager_id,
+                                           descendant_id=user_id,
+                                           depth=depth))
+                depth += 1
+                manager_id = managers.get(manager_id)
+            if len(batch) >= 1000:
+                UserHierarchy.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            UserHierarchy.objects.bulk_create(batch)
+
+        org_hierarchy_changed.send(sender=UserProfile, user_id=None,
+                                   old_manager_id=None, new_manager_id=None)
+
+        if int(options.get('verbosity', 1)):
+            print "Rebuilt the hierarchy of", len(managers), "users",
+            print "(%d loops broken)" % loops
+
+    def _break_loops(self, managers):
+        """drop the manager of the lowest user in every loop of managers"""
+        loops = 0
+        for user_id in list(managers):
+            seen = [user_id]
+            manager_id = managers.get(user_id)
+            while manager_id is not None:
+                if manager_id in seen:
+                    del managers[min(seen[seen.index(manager_id):])]
+                    loops += 1
+                    break
+                seen.append(manager_id)
+                manager_id = managers.get(manager_id)
+        return loops
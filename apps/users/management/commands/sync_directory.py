@@ -0,0 +1,34 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from users.utils.directory import sync_directory
+
+
+class Command(NoArgsCommand):
+    help = """
+    Copies the people in LDAP that have changed since the last time into
+    the DirectoryPerson table.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--full', default=False,
+                                    action='store_true',
+                                    help="Copy everybody and delete the "
+                                         "people no longer in LDAP"),
+                        make_option('--page-size', default=500, type='int',
+                                    help="People asked for at a time "
+                                         "(default 500)"),
+    )
+
+    def handle_noargs(self, **options):
+        added, updated, deleted = sync_directory(
+          full=options['full'],
+          page_size=options['page_size'],
+        )
+        if int(options.get('verbosity', 1)):
+            print "Added", added, "updated", updated, "and deleted",
+            print deleted, "people"
@@ -4,10 +4,14 @@
 
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
-from django.dispatch import receiver
+from django.db.models.signals import post_save, pre_save, post_delete
+from django.dispatch import receiver, Signal
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
+from dates.utils.generations import bump_generation
+from users.utils.people_index import bump_people_generation
+from users.utils.city_index import bump_cities_generation
+from users.utils.country_catalog import bump_countries_generation
 
 
 def valid_email(value):
@@ -31,6 +35,40 @@ def force_profile_creation(sender, instance, **kwargs):
     get_user_profile(instance)
 
 
+@receiver(post_save, sender=User)
+def user_bump_generation(sender, instance, **kwargs):
+    # names are part of the titles of their entries, logging in isn't
+    previous = getattr(instance, '_previous_people_values', None)
+    if previous and previous[1:] == _people_index_values(instance)[1:]:
+        return
+    bump_generation('entries', instance.pk)
+
+
+def _people_index_values(user):
+    return user.username, user.email, user.first_name, user.last_name
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_user(sender, instance, **kwargs):
+    instance._previous_people_values = None
+    if instance.pk is not None:
+        for previous in (User.objects.filter(pk=instance.pk)
+                         .values_list('username', 'email',
+                                      'first_name', 'last_name')):
+            instance._previous_people_values = previous
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_bump_people_generation(sender, instance, signal, **kwargs):
+    # logging in saves the user too but that doesn't change the index
+    if (signal is post_save and
+        getattr(instance, '_previous_people_values', None) ==
+        _people_index_values(instance)):
+        return
+    bump_people_generation()
+
+
 class UserProfile(models.Model):
     user = models.ForeignKey(User)
     manager = models.CharField(max_length=100, blank=True)
@@ -56,8 +94,136 @@ def explode_office_to_country_and_city(sender, instance, **kwargs):
         instance.country = country
 
 
+@receiver(pre_save, sender=UserProfile)
+def remember_previous_place(sender, instance, **kwargs):
+    instance._previous_place = ('', '')
+    if instance.pk is not None:
+        for place in (UserProfile.objects.filter(pk=instance.pk)
+                      .values_list('city', 'country')):
+            instance._previous_place = place
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_bump_place_generations(sender, instance, signal, **kwargs):
+    city, country = instance.city, instance.country
+    if signal is post_save:
+        city, country = getattr(instance, '_previous_place', ('', ''))
+    if city != instance.city or signal is post_delete:
+        bump_cities_generation()
+    if country != instance.country or signal is post_delete:
+        bump_countries_generation()
+
+
 @receiver(pre_save, sender=UserProfile)
 def explode_find_manager_user(sender, instance, **kwargs):
     if instance.manager and valid_email(instance.manager):
         for user in User.objects.filter(email__iexact=instance.manager):
             instance.manager_user = user
+
+
+# sent when a user is moved to another manager (or to none) and with
+# user_id None when the whole hierarchy has been rebuilt
+org_hierarchy_changed = Signal(providing_args=['user_id', 'old_manager_id',
+                                               'new_manager_id'])
+
+
+class UserHierarchy(models.Model):
+    """closure table of the org chart with a row for every manager above
+    a user at any depth (a direct manager is depth 1)"""
+    ancestor = models.ForeignKey(User, related_name='report_links')
+    descendant = models.ForeignKey(User, related_name='manager_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %s above %s by %d>' % (self.__class__.__name__,
+                                            self.ancestor_id,
+                                            self.descendant_id,
+                                            self.depth)
+
+
+def relink_org_hierarchy(user_id, manager_id):
+    """move the user, and everyone below, to be under this manager"""
+    subtree = dict(UserHierarchy.objects
+                   .filter(ancestor=user_id)
+                   .values_list('descendant_id', 'depth'))
+    subtree[user_id] = 0
+    (UserHierarchy.objects
+     .filter(descendant__in=subtree.keys())
+     .exclude(ancestor__in=subtree.keys())
+     .delete())
+    if manager_id is None:
+        return
+    ancestors = dict(UserHierarchy.objects
+                     .filter(descendant=manager_id)
+                     .values_list('ancestor_id', 'depth'))
+    ancestors[manager_id] = 0
+    UserHierarchy.objects.bulk_create([
+      UserHierarchy(ancestor_id=ancestor_id,
+                    descendant_id=descendant_id,
+                    depth=above + below + 1)
+      for ancestor_id, above in ancestors.items()
+      for descendant_id, below in subtree.items()
+    ])
+
+
+@receiver(post_save, sender=UserProfile)
+def update_org_hierarchy(sender, instance, **kwargs):
+    new_manager_id = instance.manager_user_id
+    if new_manager_id is not None:
+        if (new_manager_id == instance.user_id or
+            UserHierarchy.objects.filter(ancestor=instance.user_id,
+                                         descendant=new_manager_id).exists()):
+            # managing your own manager would make a loop
+            new_manager_id = None
+    old_manager_id = None
+    for old_manager_id in (UserHierarchy.objects
+                           .filter(descendant=instance.user_id, depth=1)
+                           .values_list('ancestor_id', flat=True)):
+        break
+    if old_manager_id == new_manager_id:
+        return
+    relink_org_hierarchy(instance.user_id, new_manager_id)
+    org_hierarchy_changed.send(sender=UserProfile,
+                               user_id=instance.user_id,
+                               old_manager_id=old_manager_id,
+                               new_manager_id=new_manager_id)
+
+
+class DirectoryPerson(models.Model):
+    """a person in LDAP as copied by the sync_directory command, searched
+    instead of LDAP when settings.LDAP_LOOKUP_MIRROR is true"""
+    dn = models.CharField(max_length=255, unique=True)
+    uid = models.CharField(max_length=100, db_index=True)
+    mail = models.CharField(max_length=255, db_index=True)
+    given_name = models.CharField(max_length=100, db_index=True)
+    sn = models.CharField(max_length=100, db_index=True)
+    cn = models.CharField(max_length=255, db_index=True)
+    # modifyTimestamp in LDAP, e.g. 20120314151617Z
+    modify_timestamp = models.CharField(max_length=20, db_index=True)
+
+    # LDAP attribute -> field
+    ATTRIBUTES = (
+      ('uid', 'uid'),
+      ('mail', 'mail'),
+      ('givenName', 'given_name'),
+      ('sn', 'sn'),
+      ('cn', 'cn'),
+      ('modifyTimestamp', 'modify_timestamp'),
+    )
+
+    def __repr__(self):  # pragma: no cover
+        return "<DirectoryPerson: %s>" % self.mail
+
+    def as_result(self):
+        """return it like ldap_lookup.search_users() does"""
+        return {
+          'uid': self.uid,
+          'mail': self.mail,
+          'givenName': self.given_name,
+          'sn': self.sn,
+          'cn': self.cn,
+        }
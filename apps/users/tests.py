@@ -8,6 +8,7 @@ import datetime
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from nose.tools import eq_, ok_
 from test_utils import TestCase
@@ -84,6 +85,37 @@ class LDAPLookupTests(TestCase):
         details = func('mortal@mozilla.com', force_refresh=True)
         eq_(details['givenName'], u'Different')
 
+    def test_fetch_user_details_many(self):
+        func = ldap_lookup.fetch_user_details_many
+        fake_user = [
+          ('mail=mortal@mozilla.com,o=com,dc=mozilla',
+           {'cn': ['Peter Bengtsson'],
+            'givenName': ['Pet\xc3\xa3r'],  # utf-8 encoded
+            'mail': ['mortal@mozilla.com'],
+            'sn': ['Bengtss\xc2\xa2n'],
+            'uid': ['pbengtsson']
+            })
+        ]
+        _key = ldap_lookup.account_wrap_search_filter(
+          '(|(mail=Mortal@mozilla.com)(mail=xxx@mozilla.com))'
+        )
+        ldap.initialize = Mock(return_value=MockLDAP({
+          _key: fake_user,
+          }
+        ))
+
+        details = func(['Mortal@mozilla.com', 'xxx@mozilla.com'])
+        eq_(details['Mortal@mozilla.com']['givenName'], u'Pet\xe3r')
+        eq_(details['xxx@mozilla.com'], {})
+        eq_(ldap.initialize.call_count, 1)
+
+        # all cached, found or not
+        eq_(func(['xxx@mozilla.com', 'Mortal@mozilla.com']), details)
+        eq_(ldap.initialize.call_count, 1)
+        eq_(ldap_lookup.fetch_user_details('Mortal@mozilla.com'),
+            details['Mortal@mozilla.com'])
+        eq_(ldap.initialize.call_count, 1)
+
     def test_search_users_uid_search(self):
         func = ldap_lookup.search_users
         fake_user = [
@@ -220,10 +252,93 @@ class LDAPLookupTests(TestCase):
         ok_(not result)
 
 
+class BrokenLDAP(MockLDAP):  # pragma: no cover
+    """a connection the server has gone away from"""
+
+    def search_s(self, *args, **kwargs):
+        raise ldap.SERVER_DOWN
+
+    whoami_s = search_s
+
+
+class LDAPPoolTests(TestCase):
+
+    def setUp(self):
+        super(LDAPPoolTests, self).setUp()
+        ldap_lookup._pool = None
+
+    def tearDown(self):
+        super(LDAPPoolTests, self).tearDown()
+        ldap_lookup._pool = None
+        from django.core.cache import cache
+        cache.clear()
+
+    def _pool(self, **kwargs):
+        from users.utils.ldap_pool import LDAPPool
+        return LDAPPool('ldap://localhost', 'dn', 'secret', **kwargs)
+
+    def test_search_users_pooled(self):
+        _key = ldap_lookup.account_wrap_search_filter('mail=mortal@mozilla.com')
+        ldap.initialize = Mock(return_value=MockLDAP({
+          _key: [('mail=mortal@mozilla.com,o=com,dc=mozilla',
+                  {'mail': ['mortal@mozilla.com']})],
+        }))
+        with self.settings(LDAP_POOL_SIZE=2):
+            for i in range(3):
+                results = ldap_lookup.search_users('mortal@mozilla.com', 1)
+                eq_(results[0]['mail'], u'mortal@mozilla.com')
+            metrics = ldap_lookup.get_pool_metrics()
+        eq_(ldap.initialize.call_count, 1)
+        eq_(metrics['checkouts'], 3)
+        eq_(metrics['connects'], 1)
+        eq_(metrics['idle'], 1)
+        eq_(metrics['in_use'], 0)
+
+    def test_reconnect(self):
+        ldap.initialize = Mock(side_effect=[BrokenLDAP({}),
+                                            MockLDAP({'dc=mozilla': []})])
+        pool = self._pool()
+        eq_(pool.call(lambda c: c.search_s('dc=mozilla', None)), [])
+        eq_(pool.get_metrics()['reconnects'], 1)
+        eq_(pool.get_metrics()['idle'], 1)
+
+        # it was fine when it was checked in but isn't any more
+        pool.clear()
+        ldap.initialize = Mock(side_effect=[BrokenLDAP({}), MockLDAP({})])
+        pool = self._pool(check_idle=-1)
+        pool.checkin(*pool.checkout())
+        connection, pooled = pool.checkout()
+        ok_(not isinstance(connection, BrokenLDAP))
+        eq_(pool.get_metrics()['reconnects'], 1)
+
+    def test_max_idle(self):
+        ldap.initialize = Mock(side_effect=lambda uri: MockLDAP({}))
+        pool = self._pool(max_idle=-1)
+        pool.checkin(*pool.checkout())
+        pool.checkin(*pool.checkout())
+        metrics = pool.get_metrics()
+        eq_(metrics['connects'], 2)
+        eq_(metrics['discards'], 1)
+
+    def test_overflow(self):
+        ldap.initialize = Mock(side_effect=lambda uri: MockLDAP({}))
+        pool = self._pool(size=1, wait=0)
+        first = pool.checkout()
+        second = pool.checkout()
+        eq_((first[1], second[1]), (True, False))
+        pool.checkin(*second)
+        pool.checkin(*first)
+        metrics = pool.get_metrics()
+        eq_(metrics['overflows'], 1)
+        eq_(metrics['idle'], 1)
+
+
 class UsersTests(TestCase):
 
     def setUp(self):
         super(UsersTests, self).setUp()
+        # the cached country catalog outlives the rolled back database
+        cache.clear()
         ldap.open = Mock('ldap.open')
         ldap.open.mock_returns = Mock('ldap_connection')
         ldap.set_option = Mock(return_value=None)
@@ -545,3 +660,220 @@ class UsersTests(TestCase):
         profile = UserProfile.objects.get(user=mortal)
         eq_(profile.country, 'GB')
         eq_(profile.city, 'London')
+
+    def test_country_choices(self):
+        from users.forms import ProfileForm
+        from dates.forms import ListFilterForm
+        mortal = User.objects.create(username='mortal')
+        profile = mortal.get_profile()
+        profile.country = 'SE'
+        profile.save()
+
+        choices = ProfileForm().fields['country'].choices
+        ok_(('SE', 'SE') in choices)
+        ok_(('GB', 'United Kingdom') in choices or
+            ('GB', 'Great Britain') in choices)
+        eq_(choices, sorted(choices, key=lambda x: x[1]))
+        with self.assertNumQueries(0):
+            ProfileForm()
+            form = ListFilterForm()
+        eq_(form.fields['country'].choices,
+            [('', 'Any country'), ('SE', 'SE')])
+
+        profile.country = 'GB'
+        profile.save()
+        form = ListFilterForm()
+        eq_(form.fields['country'].choices,
+            [('', 'Any country'), ('GB', 'GB')])
+
+    def test_entries_generation_on_rename(self):
+        from dates.utils.generations import get_generation
+        mortal = User.objects.create(username='mortal', first_name='Mortal')
+        generation = get_generation('entries', mortal.pk)
+        # logging in doesn't change the titles of any entries
+        mortal.last_login = datetime.datetime.now()
+        mortal.save()
+        eq_(get_generation('entries', mortal.pk), generation)
+
+        mortal.first_name = 'Immortal'
+        mortal.save()
+        ok_(get_generation('entries', mortal.pk) != generation)
+
+
+class ProfileLoaderTests(TestCase):
+
+    def test_load_primed_in_one_query(self):
+        from users.utils.profile_loader import ProfileLoader
+        boss = User.objects.create(username='boss', email='boss@mozilla.com')
+        users = []
+        for i in range(5):
+            user = User.objects.create(username='user%d' % i)
+            profile = user.get_profile()
+            profile.manager_user = boss
+            profile.city = 'City %d' % i
+            profile.save()
+            users.append(user)
+
+        loader = ProfileLoader()
+        loader.prime(users)
+        loader.prime([boss.pk])
+        with self.assertNumQueries(1):
+            for i, user in enumerate(users):
+                eq_(loader.load(user).city, 'City %d' % i)
+                eq_(loader.get_manager_id(user), boss.pk)
+                eq_(loader.load(user).manager_user, boss)
+            eq_(loader.get_manager_id(boss.pk), None)
+
+        # not primed but still only fetched once
+        other = User.objects.create(username='other')
+        with self.assertNumQueries(1):
+            eq_(loader.load(other).user, other)
+            eq_(sorted(loader.load_many([other, boss]).keys()),
+                sorted([other.pk, boss.pk]))
+
+    def test_load_user_without_profile(self):
+        from users.utils.profile_loader import ProfileLoader
+        user = User.objects.create(username='user')
+        UserProfile.objects.filter(user=user).delete()
+        profile = ProfileLoader().load(user)
+        eq_(profile.user, user)
+        ok_(profile.pk)
+
+
+class OrgHierarchyTests(TestCase):
+
+    def _create(self, username, manager=None):
+        user = User.objects.create(username=username,
+                                   email='%s@mozilla.com' % username)
+        if manager:
+            self._move(user, manager)
+        return user
+
+    def _move(self, user, manager):
+        profile = user.get_profile()
+        profile.manager_user = manager
+        profile.save()
+
+    def _hierarchy(self):
+        from users.models import UserHierarchy
+        return sorted(UserHierarchy.objects
+                      .values_list('ancestor__username',
+                                   'descendant__username',
+                                   'depth'))
+
+    def test_maintained_on_save(self):
+        from users.models import org_hierarchy_changed
+        changes = []
+
+        def listener(sender, **kwargs):
+            changes.append((kwargs['user_id'],
+                            kwargs['old_manager_id'],
+                            kwargs['new_manager_id']))
+        org_hierarchy_changed.connect(listener)
+
+        try:
+            gary = self._create('gary')
+            todd = self._create('todd', gary)
+            mike = self._create('mike', todd)
+            laura = self._create('laura', mike)
+            eq_(self._hierarchy(), [
+              ('gary', 'laura', 3),
+              ('gary', 'mike', 2),
+              ('gary', 'todd', 1),
+              ('mike', 'laura', 1),
+              ('todd', 'laura', 2),
+              ('todd', 'mike', 1),
+            ])
+            eq_(changes[-1], (laura.pk, None, mike.pk))
+
+            # saving without moving anybody is not a change
+            changes = []
+            laura.get_profile().save()
+            eq_(changes, [])
+
+            # mike takes his team over to gary
+            self._move(mike, gary)
+            eq_(self._hierarchy(), [
+              ('gary', 'laura', 2),
+              ('gary', 'mike', 1),
+              ('gary', 'todd', 1),
+              ('mike', 'laura', 1),
+            ])
+            eq_(changes, [(mike.pk, todd.pk, gary.pk)])
+
+            # gary can't report to someone below him
+            self._move(gary, laura)
+            eq_(len(self._hierarchy()), 4)
+
+            self._move(todd, None)
+            eq_(self._hierarchy(), [
+              ('gary', 'laura', 2),
+              ('gary', 'mike', 1),
+              ('mike', 'laura', 1),
+            ])
+        finally:
+            org_hierarchy_changed.disconnect(listener)
+
+    def test_rebuild_org_hierarchy(self):
+        from django.core.management import call_command
+        from users.models import UserHierarchy
+        gary = self._create('gary')
+        todd = self._create('todd', gary)
+        self._create('mike', todd)
+        before = self._hierarchy()
+        UserHierarchy.objects.all().delete()
+        # loops are broken rather than followed
+        UserProfile.objects.filter(user=gary).update(manager_user=todd)
+
+        call_command('rebuild_org_hierarchy', verbosity=0)
+        eq_(self._hierarchy(), before)
+
+
+class DirectoryTests(TestCase):
+
+    def _person(self, uid, given_name, sn, modified='20120101000000Z'):
+        return ('mail=%s@mozilla.com,o=com,dc=mozilla' % uid,
+                {'uid': [uid],
+                 'mail': ['%s@mozilla.com' % uid],
+                 'givenName': [given_name],
+                 'sn': [sn],
+                 'cn': ['%s %s' % (given_name, sn)],
+                 'modifyTimestamp': [modified]})
+
+    def test_sync_directory(self):
+        from django.core.management import call_command
+        from users.models import DirectoryPerson
+        peter = self._person('pbengtsson', 'Peter', 'Bengtsson')
+        laura = self._person('laura', 'Laura', 'Thomson')
+        ldap.initialize = Mock(return_value=MockLDAP({
+          'dc=mozilla': [peter, laura],
+        }))
+        call_command('sync_directory', full=True, verbosity=0)
+        eq_(DirectoryPerson.objects.count(), 2)
+
+        with self.settings(LDAP_LOOKUP_MIRROR=True):
+            results = ldap_lookup.search_users('pet', 30, autocomplete=True)
+            eq_(results, [{'uid': u'pbengtsson',
+                           'mail': u'pbengtsson@mozilla.com',
+                           'givenName': u'Peter',
+                           'sn': u'Bengtsson',
+                           'cn': u'Peter Bengtsson'}])
+            eq_(len(ldap_lookup.search_users('Laura T', 30,
+                                             autocomplete=True)), 1)
+            eq_(len(ldap_lookup.search_users(':laura', 30,
+                                             autocomplete=True)), 1)
+            ok_(ldap_lookup.fetch_user_details('laura@mozilla.com'))
+            ok_(not ldap_lookup.search_users('xyz', 30, autocomplete=True))
+
+        # Laura got married and Peter left
+        laura = self._person('laura', 'Laura', 'van Der Thomson',
+                             modified='20120202000000Z')
+        ldap.initialize = Mock(return_value=MockLDAP({
+          'dc=mozilla': [laura],
+        }))
+        call_command('sync_directory', verbosity=0)
+        eq_(DirectoryPerson.objects.get(uid='laura').sn, u'van Der Thomson')
+        # only a full sync notices
+        ok_(DirectoryPerson.objects.filter(uid='pbengtsson'))
+        call_command('sync_directory', full=True, verbosity=0)
+        ok_(not DirectoryPerson.objects.filter(uid='pbengtsson'))
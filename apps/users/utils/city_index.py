@@ -0,0 +1,69 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# The distinct cities of all the user profiles, sorted case-insensitively
+# with how many profiles are in each. It's kept in memcache and in every
+# process and made again when the 'cities' generation is bumped.
+
+import threading
+from bisect import bisect_left
+from django.core.cache import cache
+from django.db.models import Count
+from dates.utils.generations import get_generation, bump_generation
+
+
+CITIES_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def bump_cities_generation():
+    bump_generation('cities', 0)
+
+
+def _build_cities():
+    """return a sorted list of (lowercase city, city, profiles)"""
+    from users.models import UserProfile
+    counts = (UserProfile.objects.exclude(city='')
+              .values_list('city')
+              .annotate(Count('pk'))
+              .order_by())
+    return sorted((city.lower(), city, count) for city, count in counts)
+
+
+_cities = None
+_cities_version = None
+_cities_lock = threading.Lock()
+
+
+def get_cities():
+    global _cities, _cities_version
+    version = get_generation('cities', 0)
+    if _cities is None or _cities_version != version:
+        with _cities_lock:
+            if _cities is None or _cities_version != version:
+                cache_key = 'cities:%s' % version
+                cities = cache.get(cache_key)
+                if cities is None:
+                    cities = _build_cities()
+                    cache.set(cache_key, cities, CITIES_CACHE_TIMEOUT)
+                _cities = ([x[0] for x in cities], cities)
+                _cities_version = version
+    return _cities
+
+
+def search_cities(term=None, by_popularity=False):
+    """return the cities that start with term (case-insensitively), in
+    alphabetical order or with the ones most profiles are in first"""
+    keys, cities = get_cities()
+    if term:
+        term = term.lower()
+        start = bisect_left(keys, term)
+        end = start
+        while end < len(keys) and keys[end].startswith(term):
+            end += 1
+        found = cities[start:end]
+    else:
+        found = cities
+    if by_popularity:
+        found = sorted(found, key=lambda x: (-x[2], x[0]))
+    return [city for key, city, count in found]
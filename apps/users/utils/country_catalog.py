@@ -0,0 +1,69 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# The distinct countries of all the user profiles and the choices made
+# from them. They're kept in memcache and in every process and made again
+# when the 'countries' generation is bumped.
+
+import threading
+from django.core.cache import cache
+from dates.utils.generations import get_generation, bump_generation
+from lib.country_aliases import ALIASES as COUNTRY_ALIASES
+
+
+COUNTRIES_CACHE_TIMEOUT = 60 * 60 * 24
+
+# e.g. 'GB' -> 'United Kingdom'
+LONG_FORMS = {}
+for _alias, _country in COUNTRY_ALIASES.items():
+    LONG_FORMS.setdefault(_country, _alias)
+
+
+def bump_countries_generation():
+    bump_generation('countries', 0)
+
+
+def _build_countries():
+    from users.models import UserProfile
+    return sorted(set(UserProfile.objects.exclude(country='')
+                      .values_list('country', flat=True)))
+
+
+_countries = None
+_countries_version = None
+_countries_lock = threading.Lock()
+
+
+def get_countries():
+    """return the sorted distinct countries of all profiles"""
+    global _countries, _countries_version
+    version = get_generation('countries', 0)
+    if _countries is None or _countries_version != version:
+        with _countries_lock:
+            if _countries is None or _countries_version != version:
+                cache_key = 'countries:%s' % version
+                countries = cache.get(cache_key)
+                if countries is None:
+                    countries = _build_countries()
+                    cache.set(cache_key, countries, COUNTRIES_CACHE_TIMEOUT)
+                _countries = countries
+                _countries_version = version
+    return _countries
+
+
+def get_country_choices():
+    """return (country, name) choices of every country in a profile and
+    every aliased country, sorted by name"""
+    choices = []
+    names = set()
+    for country in get_countries():
+        name = LONG_FORMS.get(country, country)
+        names.add(name)
+        choices.append((country, name))
+    for alias, country in COUNTRY_ALIASES.items():
+        if alias not in names:
+            names.add(alias)
+            choices.append((country, alias))
+    choices.sort(key=lambda x: x[1])
+    return choices
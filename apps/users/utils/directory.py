@@ -0,0 +1,118 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copies the people in LDAP into DirectoryPerson so that looking people
+# up doesn't have to wait on LDAP (see settings.LDAP_LOOKUP_MIRROR).
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+from ldap.filter import filter_format
+from django.db import transaction
+from django.db.models import Max
+from django.utils.encoding import smart_unicode
+from users.models import DirectoryPerson
+from . import ldap_lookup
+from .people_index import bump_people_generation
+
+
+def iter_paged_search(connection, base, search_filter, attrs,
+                      page_size=500):
+    """yield every (dn, attributes) found, asking for page_size at a time"""
+    control = SimplePagedResultsControl(ldap.LDAP_CONTROL_PAGE_OID, True,
+                                        (page_size, ''))
+    while True:
+        msgid = connection.search_ext(base, ldap.SCOPE_SUBTREE,
+                                      search_filter, attrs,
+                                      serverctrls=[control])
+        rtype, rdata, rmsgid, serverctrls = connection.result3(msgid)
+        for each in rdata:
+            yield each
+        cookie = None
+        for each in serverctrls:
+            if each.controlType == ldap.LDAP_CONTROL_PAGE_OID:
+                estimate, cookie = each.controlValue
+        if not cookie:
+            break
+        control.controlValue = (page_size, cookie)
+
+
+def _person_values(attributes):
+    values = {}
+    for attribute, field in DirectoryPerson.ATTRIBUTES:
+        value = attributes.get(attribute) or ['']
+        values[field] = smart_unicode(value[0])
+    return values
+
+
+def _save_people(people):
+    """insert or update these {dn: field values}"""
+    existing = dict(
+      (x.dn, x) for x in DirectoryPerson.objects.filter(dn__in=people.keys())
+    )
+    new = []
+    updated = 0
+    for dn, values in people.items():
+        person = existing.get(dn)
+        if person is None:
+            new.append(DirectoryPerson(dn=dn, **values))
+        elif any(getattr(person, k) != v for k, v in values.items()):
+            DirectoryPerson.objects.filter(pk=person.pk).update(**values)
+            updated += 1
+    DirectoryPerson.objects.bulk_create(new)
+    return len(new), updated
+
+
+@transaction.commit_on_success
+def sync_directory(full=False, page_size=500, connection=None):
+    """copy the people in LDAP that have changed since the last time, or
+    everybody if full, and return how many were (added, updated, deleted).
+
+    Only a full sync can tell who has gone from LDAP.
+    """
+    search_filter = '(objectClass=inetOrgPerson)(mail=*)'
+    since = None
+    if not full:
+        since = (DirectoryPerson.objects
+                 .aggregate(Max('modify_timestamp'))
+                 ['modify_timestamp__max'])
+    if since:
+        search_filter += filter_format('(modifyTimestamp>=%s)', (since,))
+    search_filter = '(&%s)' % search_filter
+    if connection is None:
+        connection = ldap_lookup.connect()
+
+    added = updated = 0
+    seen = set()
+    people = {}
+    attrs = [x for x, y in DirectoryPerson.ATTRIBUTES]
+    for dn, attributes in iter_paged_search(connection, 'dc=mozilla',
+                                            search_filter, attrs,
+                                            page_size=page_size):
+        if not dn:
+            # a referral
+            continue
+        dn = smart_unicode(dn)
+        seen.add(dn)
+        people[dn] = _person_values(attributes)
+        if len(people) >= page_size:
+            counts = _save_people(people)
+            added += counts[0]
+            updated += counts[1]
+            people = {}
+    if people:
+        counts = _save_people(people)
+        added += counts[0]
+        updated += counts[1]
+
+    deleted = 0
+    if full:
+        gone = [pk for pk, dn in
+                DirectoryPerson.objects.values_list('pk', 'dn')
+                if dn not in seen]
+        for i in range(0, len(gone), page_size):
+            DirectoryPerson.objects.filter(pk__in=gone[i:i + page_size]).delete()
+        deleted = len(gone)
+    if added or updated or deleted:
+        bump_people_generation()
+    return added, updated, deleted
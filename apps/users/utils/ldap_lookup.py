@@ -3,14 +3,51 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
+import hashlib
+import threading
 import ldap
 from ldap.filter import filter_format
 from django.utils.encoding import smart_unicode
 from django.conf import settings
 from django.core.cache import cache
+from django.db.models import Q
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django_auth_ldap.config import LDAPSearch
+from .ldap_pool import LDAPPool
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """return the LDAPPool of this process or None if LDAP_POOL_SIZE is 0
+    which makes a new connection for every search"""
+    global _pool
+    if not getattr(settings, 'LDAP_POOL_SIZE', 0):
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = LDAPPool(
+              settings.AUTH_LDAP_SERVER_URI,
+              settings.AUTH_LDAP_BIND_DN,
+              settings.AUTH_LDAP_BIND_PASSWORD,
+              size=settings.LDAP_POOL_SIZE,
+              max_idle=settings.LDAP_POOL_MAX_IDLE,
+              check_idle=settings.LDAP_POOL_CHECK_IDLE,
+              timeout=settings.LDAP_POOL_TIMEOUT,
+              wait=settings.LDAP_POOL_WAIT,
+            )
+        return _pool
+
+
+def get_pool_metrics():
+    """return how the LDAPPool of this process has been used"""
+    pool = get_pool()
+    if pool is None:
+        return {}
+    return pool.get_metrics()
 
 
 def account_wrap_search_filter(search_filter):
@@ -26,8 +63,15 @@ def _valid_email(value):
     except ValidationError:
         return False
 
+def _details_cache_key(email):
+    # hash() differs between processes and architectures
+    if isinstance(email, unicode):
+        email = email.encode('utf-8')
+    return 'ldap_peeps_%s' % hashlib.md5(email).hexdigest()
+
+
 def fetch_user_details(email, force_refresh=False):
-    cache_key = 'ldap_peeps_%s' % hash(email)
+    cache_key = _details_cache_key(email)
     if not force_refresh:
         result = cache.get(cache_key)
         if result is not None:
@@ -46,13 +90,75 @@ def fetch_user_details(email, force_refresh=False):
     return result
 
 
-def search_users(query, limit, autocomplete=False):
+def fetch_user_details_many(emails, force_refresh=False):
+    """return a dict of each email and what fetch_user_details() would
+    return for it, looking up all the ones not cached at once"""
+    keys = dict((_details_cache_key(x), x) for x in emails)
+    found = {}
+    if not force_refresh:
+        found = cache.get_many(keys.keys())
+    details = dict((keys[x], found[x]) for x in found)
+    missing = []
+    for email in emails:
+        if email not in details and email not in missing:
+            missing.append(email)
+    if not missing:
+        return details
+
+    for email in [x for x in missing if not _valid_email(x)]:
+        details[email] = fetch_user_details(email,
+                                            force_refresh=force_refresh)
+    missing = [x for x in missing if _valid_email(x)]
+    if missing:
+        if getattr(settings, 'LDAP_LOOKUP_MIRROR', False):
+            from users.models import DirectoryPerson
+            results = [x.as_result() for x in
+                       DirectoryPerson.objects.filter(mail__in=missing)]
+        else:
+            search_filter = '(|%s)' % ''.join(
+              filter_format('(mail=%s)', (x,)) for x in missing
+            )
+            results = []
+            for each in _run_search(account_wrap_search_filter(search_filter),
+                                    0):
+                result = each[1]
+                _expand_result(result)
+                results.append(result)
+        by_email = {}
+        for result in results:
+            mails = result.get('mail') or []
+            if not isinstance(mails, list):
+                mails = [mails]
+            for mail in mails:
+                by_email.setdefault(mail.lower(), result)
+        hits = {}
+        misses = {}
+        for email in missing:
+            result = by_email.get(email.lower())
+            if result:
+                hits[_details_cache_key(email)] = details[email] = result
+            else:
+                misses[_details_cache_key(email)] = details[email] = {}
+        if hits:
+            cache.set_many(hits, 60 * 60)
+        if misses:
+            # tell the cache to not bother again, for a while
+            cache.set_many(misses, 60)
+    return details
+
+
+def connect():
+    """return a new bound LDAP connection"""
     connection = ldap.initialize(settings.AUTH_LDAP_SERVER_URI)
     connection.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
-    if limit > 0:
-        connection.set_option(ldap.OPT_SIZELIMIT, limit)
     connection.simple_bind_s(settings.AUTH_LDAP_BIND_DN,
                              settings.AUTH_LDAP_BIND_PASSWORD)
+    return connection
+
+
+def search_users(query, limit, autocomplete=False):
+    if getattr(settings, 'LDAP_LOOKUP_MIRROR', False):
+        return _search_mirror(query, limit, autocomplete=autocomplete)
     if autocomplete:
         filter_elems = []
         if query.startswith(':'):
@@ -76,12 +182,9 @@ def search_users(query, limit, autocomplete=False):
             search_filter = filter_format("(uid=%s)", (query[1:], ))
         else:
             search_filter = filter_format("(cn=*%s*)", (query, ))
-    attrs = ['cn', 'sn', 'mail', 'givenName', 'uid', 'objectClass']
     search_filter = account_wrap_search_filter(search_filter)
 
-    rs = connection.search_s("dc=mozilla", ldap.SCOPE_SUBTREE,
-                            search_filter,
-                            attrs)
+    rs = _run_search(search_filter, limit)
     results = []
     for each in rs:
         result = each[1]
@@ -92,6 +195,49 @@ def search_users(query, limit, autocomplete=False):
 
     return results
 
+def _search_mirror(query, limit, autocomplete=False):
+    # the same searches as in LDAP but in the DirectoryPerson copy of it
+    from users.models import DirectoryPerson
+    people = DirectoryPerson.objects.all()
+    if autocomplete:
+        if query.startswith(':'):
+            people = people.filter(uid__istartswith=query[1:])
+        else:
+            q = (Q(given_name__istartswith=query) |
+                 Q(sn__istartswith=query) |
+                 Q(mail__istartswith=query))
+            if ' ' in query:
+                q |= Q(cn__istartswith=query)
+            people = people.filter(q)
+    else:
+        if '@' in query and _valid_email(query):
+            people = people.filter(mail__iexact=query)
+        elif query.startswith(':'):
+            people = people.filter(uid__iexact=query[1:])
+        else:
+            people = people.filter(cn__icontains=query)
+    people = people.order_by('given_name', 'sn', 'pk')
+    if limit > 0:
+        people = people[:limit]
+    return [x.as_result() for x in people]
+
+
+def _run_search(search_filter, limit):
+    attrs = ['cn', 'sn', 'mail', 'givenName', 'uid', 'objectClass']
+    pool = get_pool()
+    if pool is None:
+        return _search(connect(), search_filter, attrs, limit)
+    return pool.call(_search, search_filter, attrs, limit)
+
+
+def _search(connection, search_filter, attrs, limit):
+    # pooled connections are shared so the limit is set every time
+    connection.set_option(ldap.OPT_SIZELIMIT, max(limit, 0))
+    return connection.search_s("dc=mozilla", ldap.SCOPE_SUBTREE,
+                               search_filter,
+                               attrs)
+
+
 def _expand_result(result):
     """
     Turn
@@ -31,6 +31,16 @@ class MockLDAP:  # pragma: no cover
                 pass
         return []
 
+    def search_ext(self, search, scope, filter=None, attrlist=None,
+                   serverctrls=None):
+        # all in one page
+        self._results = self.search_s(search, scope, filter=filter,
+                                      attrs=attrlist)
+        return 1
+
+    def result3(self, msgid):
+        return ldap.RES_SEARCH_RESULT, self._results, msgid, []
+
     def simple_bind_s(self, dn, password):
         try:
             o = self._simple_bind_s(dn, password)
@@ -53,4 +63,4 @@ class MockLDAP:  # pragma: no cover
     def void(self, *args, **kwargs):
         pass
 
-    set_option = unbind_s = start_tls_s = void
+    set_option = unbind_s = start_tls_s = whoami_s = void
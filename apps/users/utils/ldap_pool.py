@@ -0,0 +1,191 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Bound LDAP connections kept around between requests so that every
+# search doesn't start with a new connection and bind.
+
+import time
+import logging
+import threading
+import ldap
+
+
+class LDAPPool(object):
+    """a thread-safe pool of up to `size` bound LDAP connections.
+
+    Connections idle for longer than `max_idle` seconds are thrown away
+    and ones idle for longer than `check_idle` seconds are checked with a
+    whoami before they're handed out. `timeout` is set on every connection
+    as the limit of each call. If they're all in use for longer than
+    `wait` seconds an extra connection is made that isn't kept.
+    """
+
+    def __init__(self, uri, bind_dn, bind_password, size=5, max_idle=300,
+                 check_idle=30, timeout=10, wait=5):
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.size = size
+        self.max_idle = max_idle
+        self.check_idle = check_idle
+        self.timeout = timeout
+        self.wait = wait
+        self._idle = []  # (connection, last used)
+        self._count = 0  # idle and in use
+        self._condition = threading.Condition()
+        self.metrics = {
+          'checkouts': 0,
+          'waits': 0,
+          'reconnects': 0,
+          'connects': 0,
+          'overflows': 0,
+          'discards': 0,
+        }
+
+    def _increment(self, key):
+        # called with the lock held
+        self.metrics[key] += 1
+
+    def connect(self):
+        connection = ldap.initialize(self.uri)
+        connection.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
+        if self.timeout:
+            connection.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+            connection.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        connection.simple_bind_s(self.bind_dn, self.bind_password)
+        with self._condition:
+            self._increment('connects')
+        return connection
+
+    def _close(self, connection):
+        try:
+            connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _healthy(self, connection):
+        try:
+            connection.whoami_s()
+            return True
+        except ldap.LDAPError, exception:
+            logging.info('Dropping a broken LDAP connection: %s', exception)
+            return False
+
+    def checkout(self):
+        """return (connection, pooled) where pooled is false if it's an
+        extra one made after waiting too long"""
+        deadline = time.time() + self.wait
+        stale = []
+        with self._condition:
+            self._increment('checkouts')
+            waited = overflow = False
+            while True:
+                now = time.time()
+                while self._idle:
+                    connection, last_used = self._idle.pop()
+                    if now - last_used <= self.max_idle:
+                        break
+                    self._count -= 1
+                    self._increment('discards')
+                    stale.append(connection)
+                else:
+                    connection = None
+                if connection is not None:
+                    break
+                if self._count < self.size:
+                    # make a new one below
+                    self._count += 1
+                    break
+                if now >= deadline:
+                    self._increment('overflows')
+                    overflow = True
+                    break
+                if not waited:
+                    self._increment('waits')
+                    waited = True
+                self._condition.wait(deadline - now)
+
+        for each in stale:
+            self._close(each)
+        if overflow:
+            return self.connect(), False
+        if connection is None:
+            try:
+                return self.connect(), True
+            except:
+                self._forget()
+                raise
+        if now - last_used > self.check_idle and not self._healthy(connection):
+            self._close(connection)
+            with self._condition:
+                self._increment('reconnects')
+            try:
+                return self.connect(), True
+            except:
+                self._forget()
+                raise
+        return connection, True
+
+    def checkin(self, connection, pooled=True):
+        if not pooled:
+            self._close(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.time()))
+            self._condition.notify()
+
+    def _forget(self):
+        # a pooled connection has gone and nothing replaces it
+        with self._condition:
+            self._count -= 1
+            self._increment('discards')
+            self._condition.notify()
+
+    def call(self, function, *args, **kwargs):
+        """return function(connection, *args, **kwargs) with a connection
+        from the pool, trying once more on a new one if the server has
+        gone away"""
+        connection, pooled = self.checkout()
+        try:
+            try:
+                result = function(connection, *args, **kwargs)
+            except ldap.SERVER_DOWN:
+                self._close(connection)
+                connection = None
+                with self._condition:
+                    self._increment('reconnects')
+                connection = self.connect()
+                result = function(connection, *args, **kwargs)
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT):
+            if connection is not None:
+                self._close(connection)
+            if pooled:
+                self._forget()
+            raise
+        except:
+            if connection is None:
+                # couldn't connect again
+                if pooled:
+                    self._forget()
+            else:
+                # the connection is still good
+                self.checkin(connection, pooled)
+            raise
+        self.checkin(connection, pooled)
+        return result
+
+    def get_metrics(self):
+        with self._condition:
+            metrics = dict(self.metrics)
+            metrics['idle'] = len(self._idle)
+            metrics['in_use'] = self._count - len(self._idle)
+        return metrics
+
+    def clear(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+            self._condition.notify_all()
+        for connection, last_used in idle:
+            self._close(connection)
@@ -0,0 +1,142 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# An in-memory index of everyone autocomplete can suggest: the people in
+# the DirectoryPerson copy of LDAP and the users we know. Every process
+# builds its own and builds it again when the 'people' generation is
+# bumped.
+
+import threading
+from bisect import bisect_left
+from django.contrib.auth.models import User
+from dates.utils.generations import get_generation, bump_generation
+
+
+def bump_people_generation():
+    bump_generation('people', 0)
+
+
+def _sorted_keys(pairs):
+    pairs.sort()
+    return [x for x, y in pairs], [y for x, y in pairs]
+
+
+class PeopleIndex(object):
+    """sorted lists of the lowercase names, emails and uids of people,
+    searched with bisect"""
+
+    def __init__(self, people, known_emails):
+        # each person is a dict like ldap_lookup.search_users() returns
+        self.people = people
+        self.known_emails = frozenset(x.lower() for x in known_emails)
+        fields = []
+        tokens = []
+        uids = []
+        for i, person in enumerate(people):
+            names = set(x.lower() for x in (
+              person['givenName'],
+              person['sn'],
+              person['mail'],
+              person['cn'],
+              u'%s %s' % (person['givenName'], person['sn']),
+            ) if x.strip())
+            for name in names:
+                fields.append((name, i))
+            # e.g. 'der' in 'Laura van Der Thomson'
+            words = set()
+            for name in names:
+                words.update(name.split())
+            for word in words - names:
+                tokens.append((word, i))
+            if person['uid']:
+                uids.append((person['uid'].lower(), i))
+        self._fields = _sorted_keys(fields)
+        self._tokens = _sorted_keys(tokens)
+        self._uids = _sorted_keys(uids)
+
+    def is_known(self, email):
+        return email.lower() in self.known_emails
+
+    def _matches(self, keys_and_ids, prefix, exact=False):
+        keys, ids = keys_and_ids
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            if exact and keys[i] != prefix:
+                break
+            yield ids[i]
+            i += 1
+
+    def search(self, query, limit, known_only=False):
+        """return up to limit people where the query is a whole name,
+        email or uid first, then the start of one, then the start of any
+        word in their name. A query starting with : only looks at uids.
+        """
+        query = query.strip().lower()
+        if query.startswith(':'):
+            query = query[1:]
+            lists = (self._uids,)
+        else:
+            lists = (self._fields, self._tokens)
+        if not query:
+            return []
+        found = []
+        seen = set()
+        for exact, each in ([(True, x) for x in lists] +
+                            [(False, x) for x in lists]):
+            for i in self._matches(each, query, exact=exact):
+                if i in seen:
+                    continue
+                seen.add(i)
+                person = self.people[i]
+                if known_only and not self.is_known(person['mail']):
+                    continue
+                found.append(person)
+                if len(found) >= limit:
+                    return found
+        return found
+
+
+def build_index():
+    from users.models import DirectoryPerson
+    people = []
+    directory_emails = set()
+    for uid, mail, given_name, sn, cn in (DirectoryPerson.objects
+                                          .values_list('uid', 'mail',
+                                                       'given_name', 'sn',
+                                                       'cn')):
+        people.append({'uid': uid, 'mail': mail, 'givenName': given_name,
+                       'sn': sn, 'cn': cn})
+        directory_emails.add(mail.lower())
+
+    known_emails = []
+    for username, email, first_name, last_name in (User.objects
+                                                   .exclude(email='')
+                                                   .values_list('username',
+                                                                'email',
+                                                                'first_name',
+                                                                'last_name')):
+        known_emails.append(email)
+        if email.lower() not in directory_emails:
+            people.append({'uid': username, 'mail': email,
+                           'givenName': first_name, 'sn': last_name,
+                           'cn': (u'%s %s' % (first_name, last_name)).strip()})
+    return PeopleIndex(people, known_emails)
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """return the PeopleIndex of this process, built again if it's out of
+    date"""
+    global _index, _index_version
+    version = get_generation('people', 0)
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = build_index()
+                _index_version = version
+    return _index
@@ -0,0 +1,66 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from users.models import UserProfile, User, get_user_profile
+
+
+class ProfileLoader(object):
+    """Identity map of UserProfile objects (with their user and manager)
+    keyed by user ID.
+
+    Call `prime()` with all the user IDs you're going to need and the
+    first `load()` fetches all of them in one query. Anything asked for
+    that wasn't primed is fetched together with whatever else is pending.
+    """
+
+    def __init__(self):
+        self._profiles = {}
+        self._pending = set()
+
+    def prime(self, users):
+        for user_id in self._ids(users):
+            if user_id not in self._profiles:
+                self._pending.add(user_id)
+
+    def load(self, user):
+        user_id, = self._ids([user])
+        if user_id not in self._profiles:
+            self._pending.add(user_id)
+            self._dispatch()
+        return self._profiles[user_id]
+
+    def load_many(self, users):
+        user_ids = self._ids(users)
+        self.prime(user_ids)
+        self._dispatch()
+        return dict((x, self._profiles[x]) for x in user_ids)
+
+    def get_manager_id(self, user):
+        return self.load(user).manager_user_id
+
+    def _ids(self, users):
+        return [isinstance(x, User) and x.pk or x for x in users]
+
+    def _dispatch(self):
+        if not self._pending:
+            return
+        user_ids = list(self._pending)
+        self._pending.clear()
+        for profile in (UserProfile.objects
+                        .filter(user__in=user_ids)
+                        .select_related('user', 'manager_user')):
+            self._profiles.setdefault(profile.user_id, profile)
+        for user_id in user_ids:
+            if user_id not in self._profiles:
+                # every saved user gets a profile but not if they were
+                # created before that was the case
+                user = User.objects.get(pk=user_id)
+                self._profiles[user_id] = get_user_profile(user)
+
+
+def get_profile_loader(request):
+    """return the ProfileLoader that lives as long as this request"""
+    if not hasattr(request, '_profile_loader'):
+        request._profile_loader = ProfileLoader()
+    return request._profile_loader
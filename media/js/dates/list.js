@@ -123,17 +123,34 @@ var Filter = (function() {
 })();
 
 function loadDataTable() {
+  // the server hands back a cursor pointing just past the last row it sent
+  // which makes fetching the next page cheap no matter how deep it is
+  var cursor = null;
   $('#pto_table').dataTable({
     bProcessing: true,
-    bDeferRender: true,  // creates page 2 and onwards TRs once loaded
-    //bServerSide: true,  // more scalable but more work (for later)
+    bServerSide: true,
     sAjaxSource: Data.href(),
     //aaSorting: [[ 2, 'asc' ],[ 1, 'asc' ],[ 3, 'desc' ]],
     aaSorting: [[ 5, 'asc' ],],
-    //aoColumnDefs: [{'bSearchable' : false, 'bVisible' : false, 'aTargets' : [ 0 ] }],
+    // city, country and details can't be sorted on the server
+    aoColumnDefs: [{bSortable: false, aTargets: [7, 8, 9]}],
+    // the details aren't searched since not everyone may see them
+    oLanguage: {sSearch: 'Search names, email, city, country or YYYY-MM-DD:'},
     //sPaginationType: 'full_numbers',
-    headers: {
-       5: {sorter: false}
+    fnServerData: function(url, data, callback, settings) {
+      if (cursor) {
+        data.push({name: 'sCursor', value: cursor});
+      }
+      settings.jqXHR = $.ajax({
+         url: url,
+         data: data,
+         dataType: 'json',
+         cache: false,
+         success: function(json) {
+           cursor = json.sCursor || null;
+           callback(json);
+         }
+      });
     }
   });
 }
@@ -187,6 +187,13 @@ var Notify = (function() {
              });
            } else {
              $('#id_entry').val(response.entry);
+             $('#hours p.overlapping').remove();
+             if (response.overlapping) {
+               $('<p>')
+                 .text(response.overlapping)
+                   .addClass('overlapping')
+                     .prependTo($('#hours form'));
+             }
              $.mobile.changePage('#hours');
            }
          });
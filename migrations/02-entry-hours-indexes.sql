@@ -0,0 +1,7 @@
+-- Composite indexes for the hot Entry and Hours lookups.
+-- See apps/dates/indexes.py (MySQL has no partial indexes so the
+-- dates_entry_shown_user_end one is left out here).
+CREATE INDEX dates_entry_user_start_end ON dates_entry (user_id, start, `end`);
+CREATE INDEX dates_entry_start_end_total_hours ON dates_entry (start, `end`, total_hours);
+CREATE INDEX dates_entry_add_date ON dates_entry (add_date);
+CREATE INDEX dates_hours_date_entry ON dates_hours (date, entry_id);
@@ -0,0 +1,5 @@
+-- Summary of each entry's hours so titles don't need to query them.
+-- Run ./manage.py backfill_entry_days afterwards.
+ALTER TABLE dates_entry
+  ADD COLUMN total_days double precision NULL,
+  ADD COLUMN has_birthday bool NOT NULL DEFAULT 0;
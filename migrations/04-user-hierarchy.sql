@@ -0,0 +1,12 @@
+-- Closure table of the org chart (see users.models.UserHierarchy).
+-- Run ./manage.py rebuild_org_hierarchy afterwards.
+CREATE TABLE `users_userhierarchy` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `ancestor_id` integer NOT NULL,
+    `descendant_id` integer NOT NULL,
+    `depth` integer UNSIGNED NOT NULL,
+    UNIQUE (`ancestor_id`, `descendant_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+ALTER TABLE `users_userhierarchy` ADD CONSTRAINT `ancestor_id_refs_id_userhierarchy` FOREIGN KEY (`ancestor_id`) REFERENCES `auth_user` (`id`);
+ALTER TABLE `users_userhierarchy` ADD CONSTRAINT `descendant_id_refs_id_userhierarchy` FOREIGN KEY (`descendant_id`) REFERENCES `auth_user` (`id`);
+CREATE INDEX `users_userhierarchy_descendant_id_depth` ON `users_userhierarchy` (`descendant_id`, `depth`);
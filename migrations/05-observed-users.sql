@@ -0,0 +1,12 @@
+-- Who observes whom and why (see dates.models.ObservedUser).
+-- Run ./manage.py rebuild_org_hierarchy afterwards which fills it too.
+CREATE TABLE `dates_observeduser` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `observer_id` integer NOT NULL,
+    `observable_id` integer NOT NULL,
+    `reason` smallint UNSIGNED NOT NULL,
+    UNIQUE (`observer_id`, `observable_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+ALTER TABLE `dates_observeduser` ADD CONSTRAINT `observer_id_refs_id_observeduser` FOREIGN KEY (`observer_id`) REFERENCES `auth_user` (`id`);
+ALTER TABLE `dates_observeduser` ADD CONSTRAINT `observable_id_refs_id_observeduser` FOREIGN KEY (`observable_id`) REFERENCES `auth_user` (`id`);
+CREATE INDEX `dates_observeduser_observable_id` ON `dates_observeduser` (`observable_id`);
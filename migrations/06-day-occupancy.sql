@@ -0,0 +1,14 @@
+-- A row for every day of every shown entry (see dates.models.DayOccupancy).
+-- Run ./manage.py backfill_day_occupancy afterwards.
+CREATE TABLE `dates_dayoccupancy` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `date` date NOT NULL,
+    `user_id` integer NOT NULL,
+    `entry_id` integer NOT NULL,
+    `hours` integer NOT NULL,
+    `starts` bool NOT NULL,
+    UNIQUE (`entry_id`, `date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+ALTER TABLE `dates_dayoccupancy` ADD CONSTRAINT `user_id_refs_id_dayoccupancy` FOREIGN KEY (`user_id`) REFERENCES `auth_user` (`id`);
+ALTER TABLE `dates_dayoccupancy` ADD CONSTRAINT `entry_id_refs_id_dayoccupancy` FOREIGN KEY (`entry_id`) REFERENCES `dates_entry` (`id`);
+CREATE INDEX dates_dayoccupancy_date_starts_user ON dates_dayoccupancy (date, starts, user_id);
@@ -0,0 +1,11 @@
+-- PTO taken per user and year (see dates.models.YearlyTotal).
+-- Run ./manage.py rebuild_yearly_totals afterwards.
+CREATE TABLE `dates_yearlytotal` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `user_id` integer NOT NULL,
+    `year` integer NOT NULL,
+    `hours` integer NOT NULL,
+    `birthdays` integer NOT NULL,
+    UNIQUE (`user_id`, `year`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+ALTER TABLE `dates_yearlytotal` ADD CONSTRAINT `user_id_refs_id_yearlytotal` FOREIGN KEY (`user_id`) REFERENCES `auth_user` (`id`);
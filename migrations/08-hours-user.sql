@@ -0,0 +1,9 @@
+-- The user of the entry of each Hours (see dates.models.Hours.user).
+-- Not unique on (user_id, date): reversals and the hours they reverse
+-- are all kept on the same date.
+ALTER TABLE `dates_hours` ADD COLUMN `user_id` integer NULL;
+UPDATE `dates_hours` h INNER JOIN `dates_entry` e ON h.`entry_id` = e.`id`
+    SET h.`user_id` = e.`user_id`;
+ALTER TABLE `dates_hours` MODIFY `user_id` integer NOT NULL;
+ALTER TABLE `dates_hours` ADD CONSTRAINT `user_id_refs_id_hours` FOREIGN KEY (`user_id`) REFERENCES `auth_user` (`id`);
+CREATE INDEX dates_hours_user_date ON dates_hours (user_id, date);
@@ -0,0 +1,20 @@
+-- Notification emails waiting to be sent (see dates.models.OutboxMessage).
+-- Run ./manage.py send_outbox every minute or so, e.g. from cron.
+CREATE TABLE `dates_outboxmessage` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `entry_id` integer,
+    `is_edit` bool NOT NULL,
+    `subject` varchar(255) NOT NULL,
+    `body` longtext NOT NULL,
+    `from_email` varchar(255) NOT NULL,
+    `to` longtext NOT NULL,
+    `cc` longtext NOT NULL,
+    `attempts` integer NOT NULL,
+    `last_error` longtext NOT NULL,
+    `next_attempt` datetime NOT NULL,
+    `sent_date` datetime,
+    `add_date` datetime NOT NULL,
+    `modify_date` datetime NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+ALTER TABLE `dates_outboxmessage` ADD CONSTRAINT `entry_id_refs_id_outboxmessage` FOREIGN KEY (`entry_id`) REFERENCES `dates_entry` (`id`);
+CREATE INDEX `dates_outboxmessage_next_attempt` ON `dates_outboxmessage` (`next_attempt`);
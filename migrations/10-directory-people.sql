@@ -0,0 +1,18 @@
+-- A copy of the people in LDAP (see users.models.DirectoryPerson).
+-- Run ./manage.py sync_directory --full afterwards.
+CREATE TABLE `users_directoryperson` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `dn` varchar(255) NOT NULL UNIQUE,
+    `uid` varchar(100) NOT NULL,
+    `mail` varchar(255) NOT NULL,
+    `given_name` varchar(100) NOT NULL,
+    `sn` varchar(100) NOT NULL,
+    `cn` varchar(255) NOT NULL,
+    `modify_timestamp` varchar(20) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+CREATE INDEX `users_directoryperson_uid` ON `users_directoryperson` (`uid`);
+CREATE INDEX `users_directoryperson_mail` ON `users_directoryperson` (`mail`);
+CREATE INDEX `users_directoryperson_given_name` ON `users_directoryperson` (`given_name`);
+CREATE INDEX `users_directoryperson_sn` ON `users_directoryperson` (`sn`);
+CREATE INDEX `users_directoryperson_cn` ON `users_directoryperson` (`cn`);
+CREATE INDEX `users_directoryperson_modify_timestamp` ON `users_directoryperson` (`modify_timestamp`);
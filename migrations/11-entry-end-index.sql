@@ -0,0 +1,4 @@
+-- For the Max('end') in dates.models.get_entry_bounds (see
+-- apps/dates/indexes.py). Min('start') and Min('add_date') already have
+-- an index to read from.
+CREATE INDEX dates_entry_end ON dates_entry (`end`);
@@ -333,6 +333,20 @@ EMAIL_SUBJECT_EDIT = 'PTO update from %(first_name)s %(last_name)s'
 EMAIL_SIGNATURE = "The Mozilla PTO cruncher"
 FALLBACK_TO_ADDRESS = 'jvandeven@mozilla.com'
 
+# Put notification emails in an outbox instead of sending them straight
+# away. Only turn this on where the send_outbox command is scheduled,
+# e.g. a crontab entry like
+#   * * * * * cd /path/to/pto && python manage.py send_outbox
+# or else nothing gets sent.
+EMAIL_OUTBOX = False
+# seconds to wait for more edits of the same entry before sending
+EMAIL_OUTBOX_DELAY = 60
+# seconds to wait after a failed attempt, doubled every time
+EMAIL_OUTBOX_BACKOFF = 60
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+# seconds a message being sent is kept from other send_outbox runs
+EMAIL_OUTBOX_CLAIM = 300
+
 # People you're not allowed to notify additionally
 EMAIL_BLACKLIST = (
   'all@mozilla.com',
@@ -380,6 +394,21 @@ try:
     )
     AUTH_LDAP_USER_DN_TEMPLATE = "mail=%(user)s,o=com,dc=mozilla"
 
+    # bound connections kept for searching (0 connects for every search)
+    LDAP_POOL_SIZE = 5
+    # seconds before an idle connection is closed
+    LDAP_POOL_MAX_IDLE = 300
+    # seconds idle after which a connection is checked before it's used
+    LDAP_POOL_CHECK_IDLE = 30
+    # seconds any one LDAP call may take
+    LDAP_POOL_TIMEOUT = 10
+    # seconds to wait for a free connection before making an extra one
+    LDAP_POOL_WAIT = 5
+
+    # search the DirectoryPerson copy of LDAP made by the sync_directory
+    # command instead of LDAP itself
+    LDAP_LOOKUP_MIRROR = False
+
 except ImportError:
     AUTHENTICATION_BACKENDS = (
        'users.email_auth_backend.EmailOrUsernameModelBackend',
@@ -12,3 +12,8 @@ CACHES = {
 AUTH_LDAP_BIND_PASSWORD = 'anything'
 AUTH_LDAP_SERVER_URI = 'as long as its'
 AUTH_LDAP_BIND_DN = 'not blank'
+# the tests mock ldap.initialize so connections can't be kept
+LDAP_POOL_SIZE = 0
+
+# send notifications straight away so they end up in mail.outbox
+EMAIL_OUTBOX = False